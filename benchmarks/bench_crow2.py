@@ -0,0 +1,303 @@
+"""
+Time the crow2 load, decision and save paths on synthetic clerical files.
+
+Each run generates files of the requested sizes (see synthetic_data.py),
+puts them in a local stand-in for hdfs (see fake_hadoop.py) and times the
+helper functions the /cluster_version page calls, inside flask request
+contexts, reporting the median time of each operation in milliseconds.
+
+    python benchmarks/bench_crow2.py --sizes 10k 100k --save baseline.json
+    python benchmarks/bench_crow2.py --sizes 10k 100k --compare baseline.json
+
+"""
+
+import argparse
+import configparser
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fake_hadoop
+from synthetic_data import generate_clerical_file, parse_size
+
+CROW2_DIR = Path(__file__).resolve().parents[1] / "crow2"
+
+OPERATIONS = [
+    "new_file_actions",
+    "session_write",
+    "local_write",
+    "reload_page",
+    "reload_page_cold",
+    "auto_resolve",
+    "make_match",
+    "make_non_match",
+    "advance_cluster",
+    "highlighter_func",
+    "save",
+    "save_delta",
+]
+
+
+def setup_workspace():
+    """
+    A function to set up a throwaway crow2 working directory with a config
+    pointing at local folders, hadoop/hdfs shims on the PATH, and import the
+    app from it.
+
+    Parameters: None
+    Returns: flask_new_flow module, helper_functions module, hdfs folder (String)
+    """
+    workspace = Path(tempfile.mkdtemp(prefix="crow_bench_"))
+    config = configparser.ConfigParser()
+    config.read(CROW2_DIR / "config_flow.ini")
+    config["filespaces"]["local_space"] = f"{workspace}/tmp/"
+    config["filespaces"]["hdfs_folder"] = "hdfs:///crow/"
+    with open(workspace / "config_flow.ini", "w") as config_file:
+        config.write(config_file)
+
+    fake_hadoop.install(workspace / "bin")
+    os.makedirs(workspace / "hdfs" / "crow")
+    os.environ["PATH"] = f"{workspace / 'bin'}{os.pathsep}{os.environ['PATH']}"
+    os.environ["FAKE_HADOOP_ROOT"] = str(workspace / "hdfs")
+    os.environ["HADOOP_USER_NAME"] = "bench"
+    os.chdir(workspace)
+
+    sys.path.insert(0, str(CROW2_DIR))
+    import flask_new_flow
+    import helper_functions
+
+    flask_new_flow.prepare_app()
+    return flask_new_flow, helper_functions, workspace / "hdfs" / "crow"
+
+
+def timed(function, repeat, setup=None):
+    """
+    A function to time repeated calls and return the median in milliseconds.
+
+    Parameters: function - called with the output of setup (Callable)
+                repeat - number of calls (Int)
+                setup - untimed function called before each call (Callable)
+    Returns: median time (Float)
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def bench_size(fnf, hf, hdfs_folder, num_records, repeat):
+    """
+    A function to time each operation on one file size.
+
+    Parameters: fnf - flask_new_flow module
+                hf - helper_functions module
+                hdfs_folder - local folder standing in for hdfs (Path)
+                num_records - file size (Int)
+                repeat - number of calls per operation (Int)
+    Returns: results - median ms per operation (Dict)
+    """
+    app = fnf.app
+    filename = f"synthetic_{num_records}"
+    full_file = generate_clerical_file(num_records)
+    full_file.to_parquet(hdfs_folder / filename)
+    hdfs_path = f"hdfs:///crow/{filename}"
+    results = {}
+    state = {}
+
+    def form_context(**form):
+        # each request gets a fresh session, so carry the state over.
+        ctx = app.test_request_context("/cluster_version", method="POST", data=form)
+        ctx.push()
+        fnf.session.update(state)
+        return ctx
+
+    ctx = form_context(file_path=hdfs_path)
+    loaded = []
+    results["new_file_actions"] = timed(
+        lambda: loaded.append(hf.new_file_actions()), max(1, repeat // 2)
+    )
+    review, *paths = loaded[-1]
+    hf.set_session_variables(review)
+    # the local working set, as written when the file is opened.
+    hf.write_working_set(review, review.to_frame(), paths[0])
+    results["session_write"] = timed(
+        lambda: hf.store_review(review), max(1, repeat // 2)
+    )
+
+    def decide_cluster():
+        # a decision, for each request to write to the local working set.
+        ids = list(review.cluster_frame([fnf.rec_id])[fnf.rec_id])
+        review.match_records(ids[:2])
+        hf.advance_cluster(review)
+        return ()
+
+    results["local_write"] = timed(
+        lambda: hf.write_working_changes(review, paths[0]),
+        repeat,
+        setup=decide_cluster,
+    )
+    results["reload_page"] = timed(hf.reload_page, max(1, repeat // 2))
+
+    def forget_review():
+        # as after a restart, or on another worker process.
+        fnf.session["review_version"] = -1
+        return ()
+
+    results["reload_page_cold"] = timed(
+        hf.reload_page, max(1, repeat // 2), setup=forget_review
+    )
+    fnf.session["review_version"] = hf.review_sessions[fnf.session["review_key"]][0]
+
+    # the pre-pass, on a fresh copy of the file, with every rule; the
+    # loaded file only has the columns in use, so add the ones compared.
+    loaded_file = review.to_frame()
+    extra = [column for column in full_file if column not in loaded_file]
+    loaded_file = loaded_file.merge(full_file[[fnf.rec_id, *extra]], on=fnf.rec_id)
+    hf.config["auto_resolution"] = {
+        "rules": "singletons,exact,all_but_one",
+        "columns": "name,surname,dob,sex,address,postcode",
+    }
+    results["auto_resolve"] = timed(
+        hf.auto_resolve_file,
+        max(1, repeat // 2),
+        setup=lambda: (hf.build_review(loaded_file.copy()),),
+    )
+    hf.config["auto_resolution"] = {"rules": ""}
+    state.update(
+        {
+            key: fnf.session[key]
+            for key in (
+                "full_path",
+                "filename",
+                "index",
+                "review_key",
+                "review_version",
+            )
+        },
+        highlight_differences=1,
+    )
+    ctx.pop()
+
+    def decide(decision):
+        ids = list(review.cluster_frame([fnf.rec_id])[fnf.rec_id])
+        ctx = form_context(cluster=ids[:2], Comment="bench", **{decision: decision})
+        return ctx, ids
+
+    def run_decision(function, ctx, ids):
+        if function is hf.make_match:
+            function(review, "")
+        else:
+            function(review)
+        hf.store_review(review)
+        state.update(
+            index=fnf.session["index"], review_version=fnf.session["review_version"]
+        )
+        ctx.pop()
+
+    results["make_match"] = timed(
+        lambda ctx, ids: run_decision(hf.make_match, ctx, ids),
+        repeat,
+        setup=lambda: decide("Match"),
+    )
+    results["make_non_match"] = timed(
+        lambda ctx, ids: run_decision(hf.make_non_match, ctx, ids),
+        repeat,
+        setup=lambda: decide("Non-Match"),
+    )
+
+    ctx = form_context()
+    results["advance_cluster"] = timed(lambda: hf.advance_cluster(review), repeat)
+
+    display_cols = [
+        fnf.config["display_columns"][i] for i in fnf.config["display_columns"]
+    ]
+    highlight_cols = [col for col in display_cols if col != fnf.rec_id]
+
+    def display_frame():
+        df_display = review.cluster_frame(display_cols + ["Match", "Comment"])
+        df_display[display_cols] = df_display[display_cols].astype(str)
+        return (df_display,)
+
+    results["highlighter_func"] = timed(
+        lambda df_display: hf.highlighter_func(highlight_cols, df_display),
+        repeat,
+        setup=display_frame,
+    )
+    results["save"] = timed(
+        lambda: fnf.save_thread(
+            paths[0], paths[2], review.to_frame(), paths[1], paths[3]
+        ),
+        max(1, repeat // 2),
+    )
+    # the decisions made above, saved as a delta next to the file saved.
+    changes = hf.decision_changes(
+        review.to_frame(),
+        review.take_changes(),
+        review.record_id,
+        review.decision_columns,
+    )
+    results["save_delta"] = timed(
+        lambda: fnf.save_thread(
+            paths[0], paths[2], review.to_frame(), paths[1], paths[3], False, changes
+        ),
+        max(1, repeat // 2),
+    )
+    ctx.pop()
+    return results
+
+
+def print_table(results, baseline=None):
+    """
+    A function to print the results as a markdown table, with the change
+    against a baseline run when one is given.
+
+    Parameters: results - median ms per operation per size (Dict)
+                baseline - results of an earlier run (Dict)
+    Returns: None
+    """
+    sizes = list(results)
+    header = "| operation | " + " | ".join(f"{size} ms" for size in sizes) + " |"
+    print(header)
+    print("| --- |" + " ---: |" * len(sizes))
+    for operation in OPERATIONS:
+        cells = []
+        for size in sizes:
+            value = results[size][operation]
+            cell = f"{value:.1f}"
+            if baseline and operation in baseline.get(size, {}):
+                change = value / baseline[size][operation]
+                cell += f" ({change:.2f}x)"
+            cells.append(cell)
+        print(f"| {operation} | " + " | ".join(cells) + " |")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", nargs="+", default=["10k", "100k"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="json file of a baseline run")
+    args = parser.parse_args()
+
+    # read the baseline before the working directory changes.
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    save_path = Path(args.save).resolve() if args.save else None
+
+    fnf, hf, hdfs_folder = setup_workspace()
+    results = {}
+    for size in args.sizes:
+        results[size] = bench_size(fnf, hf, hdfs_folder, parse_size(size), args.repeat)
+    print_table(results, baseline)
+    if save_path:
+        save_path.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+A local stand-in for the hadoop and hdfs command line tools.
+
+CROW shells out to `hadoop fs` and `hdfs dfs` to list, stat, copy, make
+folders and remove files. This script implements the handful of commands CROW uses
+against a folder on local disk (FAKE_HADOOP_ROOT), so the load and save paths
+can be
+benchmarked, subprocess overhead included, without a cluster. A remote path
+such as s3a://bucket/user/file maps to $FAKE_HADOOP_ROOT/bucket/user/file.
+
+install() writes `hadoop` and `hdfs` shims that call this script into a bin
+folder to put at the front of PATH.
+"""
+
+import os
+import shutil
+import stat
+import sys
+from pathlib import Path
+
+
+def to_local(remote_path):
+    """Map a remote path onto the local root folder."""
+    path = remote_path.split("://", 1)[-1].lstrip("/")
+    return Path(os.environ["FAKE_HADOOP_ROOT"]) / path
+
+
+def copy(source, destination):
+    """Copy a file or folder, refusing to overwrite like hadoop fs does."""
+    if destination.exists():
+        print(f"copy: `{destination}': File exists", file=sys.stderr)
+        return 1
+    if not source.exists():
+        print(f"copy: `{source}': No such file or directory", file=sys.stderr)
+        return 1
+    if source.is_dir():
+        shutil.copytree(source, destination)
+    else:
+        shutil.copyfile(source, destination)
+    return 0
+
+
+def remove(path):
+    """Remove a file or folder."""
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+    else:
+        print(f"rm: `{path}': No such file or directory", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run(args):
+    """Run one hadoop fs / hdfs dfs command and return its exit code."""
+    command, *args = args
+    flags = [arg for arg in args if arg.startswith("-")]
+    paths = [arg for arg in args if not arg.startswith("-")]
+    if command == "-get":
+        return copy(to_local(paths[0]), Path(paths[1]))
+    if command == "-put":
+        return copy(Path(paths[0]), to_local(paths[1]))
+    if command in ("-rm", "-rmr"):
+        return max(remove(to_local(path)) for path in paths)
+    if command == "-mkdir":
+        local = to_local(paths[0])
+        if local.exists() and "-p" not in flags:
+            print(f"mkdir: `{paths[0]}': File exists", file=sys.stderr)
+            return 1
+        local.mkdir(parents="-p" in flags, exist_ok=True)
+        return 0
+    if command == "-test":
+        local = to_local(paths[0])
+        if "-d" in flags:
+            return 0 if local.is_dir() else 1
+        if "-f" in flags:
+            return 0 if local.is_file() else 1
+        return 0 if local.exists() else 1
+    if command == "-stat":
+        local = to_local(paths[-1])
+        if not local.exists():
+            print(f"stat: `{paths[-1]}': No such file or directory", file=sys.stderr)
+            return 1
+        fields = {
+            "%b": "0" if local.is_dir() else str(local.stat().st_size),
+            "%Y": str(int(local.stat().st_mtime * 1000)),
+            "%F": "directory" if local.is_dir() else "regular file",
+            "%n": local.name,
+        }
+        line = paths[0] if len(paths) > 1 else "%Y"
+        for field, value in fields.items():
+            line = line.replace(field, value)
+        print(line)
+        return 0
+    if command == "-du":
+        local = to_local(paths[0])
+        files = local.rglob("*") if local.is_dir() else [local]
+        size = sum(path.stat().st_size for path in files if path.is_file())
+        print(f"{size}  {size}  {paths[0]}")
+        return 0
+    if command == "-ls":
+        folder = paths[0].rstrip("/")
+        if not to_local(folder).is_dir():
+            print(f"ls: `{folder}': No such file or directory", file=sys.stderr)
+            return 1
+        for child in sorted(to_local(folder).iterdir()):
+            print(f"{folder}/{child.name}")
+        return 0
+    print(f"{command}: Unknown command", file=sys.stderr)
+    return 1
+
+
+def install(bin_folder):
+    """Write hadoop and hdfs shims calling this script into bin_folder."""
+    os.makedirs(bin_folder, exist_ok=True)
+    for tool in ("hadoop", "hdfs"):
+        shim = Path(bin_folder) / tool
+        # drop the "fs"/"dfs" sub-command before handing over.
+        shim.write_text(
+            f'#!/bin/sh\nshift\nexec "{sys.executable}" "{Path(__file__).resolve()}" "$@"\n'
+        )
+        shim.chmod(shim.stat().st_mode | stat.S_IEXEC)
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,133 @@
+"""
+Compare the requests/sec and latency of the crow2 app on the flask
+development server and on the production (waitress) server.
+
+The app is started in a throwaway working directory with a copy of
+config_flow.ini pointing its local space at a temp folder, then each page
+is hit by a pool of concurrent clients.
+
+    python benchmarks/serve_benchmark.py --requests 2000 --clients 16
+
+"""
+
+import argparse
+import configparser
+import http.cookiejar
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+CROW2_DIR = Path(__file__).resolve().parents[1] / "crow2"
+
+SERVERS = {
+    "dev": (
+        "import flask_new_flow as f; f.prepare_app(dev_mode=True); "
+        "f.app.run(host='127.0.0.1', port={port})"
+    ),
+    "waitress": ("import wsgi; wsgi.serve('127.0.0.1', {port}, {threads})"),
+}
+
+
+def make_workspace():
+    """Create a working directory with a config pointing at a temp space."""
+    workspace = tempfile.mkdtemp(prefix="crow_bench_")
+    config = configparser.ConfigParser()
+    config.read(CROW2_DIR / "config_flow.ini")
+    config["filespaces"]["local_space"] = f"{workspace}/tmp/"
+    with open(f"{workspace}/config_flow.ini", "w") as config_file:
+        config.write(config_file)
+    return workspace
+
+
+def get_free_port():
+    """Ask the OS for a free port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(name, workspace, port, threads):
+    """Start a server in a subprocess and wait until it answers."""
+    env = dict(os.environ, PYTHONPATH=str(CROW2_DIR), HADOOP_USER_NAME="bench")
+    code = SERVERS[name].format(port=port, threads=threads)
+    process = subprocess.Popen(
+        [sys.executable, "-c", code],
+        cwd=workspace,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/about_page")
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{name} server did not start")
+
+
+clients = threading.local()
+
+
+def fetch(url):
+    """Time a single request; each client thread keeps its own session cookie."""
+    if not hasattr(clients, "opener"):
+        clients.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+    start = time.perf_counter()
+    with clients.opener.open(url) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run_load(url, num_requests, clients):
+    """Hit a url num_requests times from a pool of clients."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = sorted(pool.map(fetch, [url] * num_requests))
+    elapsed = time.perf_counter() - start
+    return {
+        "req_per_sec": num_requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--pages", nargs="+", default=["/about_page", "/"])
+    args = parser.parse_args()
+
+    print(f"{'server':<10}{'page':<14}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name in SERVERS:
+        workspace = make_workspace()
+        port = get_free_port()
+        process = start_server(name, workspace, port, args.threads)
+        try:
+            for page in args.pages:
+                url = f"http://127.0.0.1:{port}{page}"
+                run_load(url, min(args.requests, 100), args.clients)  # warm up
+                result = run_load(url, args.requests, args.clients)
+                print(
+                    f"{name:<10}{page:<14}{result['req_per_sec']:>10.0f}"
+                    f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Generate synthetic clerical files for benchmarking CROW.
+
+The records are modelled on crow1/data/clusters_example_data.csv: the
+values are drawn from the columns of the example data, cluster sizes follow
+its distribution (mostly pairs and triples) with a long tail of larger
+clusters, and records within a cluster are copies of the cluster's first
+record with typo perturbations (substituted, deleted and transposed
+characters, and missing values coded as -9), or unrelated records.
+
+    python benchmarks/synthetic_data.py 100000 clerical_100k.parquet
+
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+EXAMPLE_DATA = (
+    Path(__file__).resolve().parents[1] / "crow1" / "data" / "clusters_example_data.csv"
+)
+
+# example data column -> synthetic column, in the layout crow2 expects.
+COLUMNS = {
+    "First_Name": "name",
+    "Last_Name": "surname",
+    "Sex": "sex",
+    "Address": "address",
+    "Postcode": "postcode",
+    "Source": "dataset",
+}
+
+# cluster size distribution of the example data (2: 124, 3: 67, 4: 7, 5: 1),
+# with some singletons and a tail of large clusters from blocking errors.
+CLUSTER_SIZES = np.array([1, 2, 3, 4, 5, 6, 8, 10, 20, 50])
+CLUSTER_SIZE_WEIGHTS = np.array(
+    [0.05, 0.58, 0.31, 0.033, 0.01, 0.006, 0.004, 0.003, 0.0025, 0.0015]
+)
+
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+
+
+def perturb(value, rng):
+    """
+    A function to add a single typo to a string.
+
+    Parameters: value - string to perturb (String)
+                rng - random generator (numpy Generator)
+    Returns: perturbed string (String)
+    """
+    if len(value) < 2:
+        return value
+    position = rng.integers(0, len(value) - 1)
+    kind = rng.integers(0, 3)
+    if kind == 0:
+        return value[:position] + rng.choice(LETTERS) + value[position + 1 :]
+    if kind == 1:
+        return value[:position] + value[position + 1 :]
+    return (
+        value[:position] + value[position + 1] + value[position] + value[position + 2 :]
+    )
+
+
+def draw_cluster_sizes(num_records, rng):
+    """
+    A function to draw cluster sizes that add up to num_records.
+
+    Parameters: num_records - number of records wanted (Int)
+                rng - random generator (numpy Generator)
+    Returns: sizes - size of each cluster (numpy array)
+    """
+    mean_size = (CLUSTER_SIZES * CLUSTER_SIZE_WEIGHTS).sum()
+    sizes = rng.choice(
+        CLUSTER_SIZES,
+        size=int(num_records / mean_size * 1.1) + 10,
+        p=CLUSTER_SIZE_WEIGHTS / CLUSTER_SIZE_WEIGHTS.sum(),
+    )
+    sizes = sizes[: np.searchsorted(sizes.cumsum(), num_records) + 1]
+    sizes[-1] -= sizes.sum() - num_records
+    return sizes[sizes > 0]
+
+
+def generate_clerical_file(
+    num_records, typo_rate=0.15, non_match_rate=0.2, missing_rate=0.02, seed=0
+):
+    """
+    A function to generate a synthetic clerical file.
+
+    Parameters: num_records - number of records (Int)
+                typo_rate - chance of a typo in each field of a copied record (Float)
+                non_match_rate - chance a record is unrelated to its cluster (Float)
+                missing_rate - chance of a field being -9 (Float)
+                seed - random seed (Int)
+    Returns: dataframe with record_id, cluster_id and display columns (pandas Dataframe)
+    """
+    rng = np.random.default_rng(seed)
+    example = pd.read_csv(EXAMPLE_DATA, dtype=str, keep_default_na=False)
+
+    sizes = draw_cluster_sizes(num_records, rng)
+    num_clusters = len(sizes)
+    cluster_rows = np.repeat(np.arange(num_clusters), sizes)
+    first_in_cluster = np.r_[0, sizes.cumsum()[:-1]]
+    is_first = np.zeros(num_records, dtype=bool)
+    is_first[first_in_cluster] = True
+
+    # each record either copies its cluster's first record or is unrelated.
+    unrelated = (rng.random(num_records) < non_match_rate) & ~is_first
+    source_row = rng.integers(0, len(example), num_clusters)[cluster_rows]
+    source_row[unrelated] = rng.integers(0, len(example), unrelated.sum())
+
+    data = {}
+    for example_col, col in COLUMNS.items():
+        values = example[example_col].to_numpy()[source_row].astype(object)
+        if col != "dataset":
+            typo = np.flatnonzero((rng.random(num_records) < typo_rate) & ~is_first)
+            values[typo] = [perturb(values[i], rng) for i in typo]
+            values[rng.random(num_records) < missing_rate] = "-9"
+        data[col] = values
+
+    # day/month/year of birth as one column, with the odd transposed digit.
+    dob = (
+        example["Day_Of_Birth"].str.zfill(2)
+        + "/"
+        + example["Month_Of_Birth"].str.zfill(2)
+        + "/"
+        + example["Year_Of_Birth"]
+    ).to_numpy()[source_row]
+    typo = np.flatnonzero((rng.random(num_records) < typo_rate / 2) & ~is_first)
+    dob[typo] = [perturb(dob[i], rng) for i in typo]
+
+    record_ids = rng.permutation(np.arange(num_records, dtype=np.int64))
+    cluster_ids = rng.permutation(np.arange(num_clusters, dtype=np.int64))
+
+    return pd.DataFrame(
+        {
+            "record_id": "c" + pd.Series(record_ids).astype(str).str.zfill(12),
+            "cluster_id": cluster_ids[cluster_rows],
+            "name": data["name"],
+            "surname": data["surname"],
+            "dob": dob,
+            "sex": data["sex"],
+            "address": data["address"],
+            "postcode": data["postcode"],
+            "dataset": data["dataset"],
+        }
+    )
+
+
+def write_clerical_file(df, path):
+    """
+    A function to write a synthetic file as parquet or csv, based on the suffix.
+
+    Parameters: df - synthetic clerical file (pandas Dataframe)
+                path - output path (String)
+    Returns: None
+    """
+    if str(path).endswith(".csv"):
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False)
+
+
+def parse_size(size):
+    """
+    A function to turn a size such as 10k or 1M into a number of records.
+
+    Parameters: size (String)
+    Returns: number of records (Int)
+    """
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    size = size.strip().lower()
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("size", help="number of records, e.g. 10k, 1M")
+    parser.add_argument("output", help="output path (.parquet or .csv)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--typo-rate", type=float, default=0.15)
+    args = parser.parse_args()
+    df = generate_clerical_file(
+        parse_size(args.size), typo_rate=args.typo_rate, seed=args.seed
+    )
+    write_clerical_file(df, args.output)
+    print(f"wrote {len(df)} records in {df.cluster_id.nunique()} clusters")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Measure how far two or more matchers agree on the same clerical file.
+
+For quality assurance a sample is reviewed twice (or more) by different
+matchers. Each review is read as the pairs of records it says match: in a
+cluster file two records match when they were put in the same match (crow2's
+stringified lists and crow1's comma-joined ids are both read, see
+crow_core.decisions), and in a pairwise file each row is a pair, 1 or 0.
+The reviews are joined by record id (by row for pairwise files) and for
+every pair of records within a cluster the matchers' answers are compared.
+
+The share of pairs every matcher agrees on, and Cohen's kappa (Fleiss'
+kappa for more than two matchers), are given overall and for each cluster.
+Kappa corrects the agreement for that expected by chance; it is 1 for
+complete agreement and 0 for no better than chance.
+
+    python coordinator/agreement.py sample_alice_done sample_bob_done
+    python coordinator/agreement.py a_DONE.csv b_DONE.csv --clusters clusters.csv \\
+        --disagreements sample_recheck.csv
+
+The clusters the matchers disagree on can be written as a new clerical file
+(--disagreements), without decisions, for a third matcher to review. Pairs
+are compared a block of clusters at a time, so memory stays bounded however
+large the clusters are.
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import file_columns, write_file  # noqa: E402
+from crow_core.files import FORMATS  # noqa: E402
+from crow_core.decisions import detect_format, match_keys, parse_matches  # noqa: E402
+from merge_done import finished_by, is_done  # noqa: E402
+from prepare_files import clerical_file_format, read_clerical_file  # noqa: E402
+
+# The most pairs of records compared at once.
+PAIRS_PER_BLOCK = 5_000_000
+
+# Columns holding the decisions of a file, left out of the file of
+# disagreements.
+DECISION_COLUMNS = [
+    "Match",
+    "Comment",
+    "Comments",
+    "Decision_Source",
+    "Sequential_Cluster_Id",
+    "Sequential_Record_Id",
+    "match",
+    "comments",
+    "decision_source",
+]
+
+
+def reviewer_name(path: str) -> str:
+    """Name a review after the user who finished it, or else its file.
+
+    Parameters
+    ----------
+    path : str
+        The reviewed clerical file.
+
+    Returns
+    -------
+    str
+        The name.
+    """
+    if is_done(path) and finished_by(path):
+        return finished_by(path)
+    return os.path.basename(path.rstrip("/"))
+
+
+def read_labels(path: str, record_id: str | None, cluster_id: str | None) -> tuple:
+    """Read a review as a label per record, equal for records matched.
+
+    Parameters
+    ----------
+    path : str
+        The reviewed clerical file.
+    record_id : str or None
+        The record id column; None for a pairwise file.
+    cluster_id : str or None
+        The cluster id column; None for a pairwise file.
+
+    Returns
+    -------
+    tuple
+        The record ids (the row numbers of a pairwise file), their cluster
+        ids and their labels. Labels are ints: -1 for no decision; in a
+        pairwise file 1 for a match and 0 for not.
+    """
+    if record_id is None:
+        data = read_clerical_file(path, ["match"])
+        values = pd.to_numeric(data["match"], errors="coerce")
+        labels = values.fillna(-1).astype(np.int64).to_numpy()
+        rows = pd.Series(np.arange(len(data)).astype(str))
+        return rows, rows, labels
+    columns = file_columns(path, clerical_file_format(path))
+    data = read_clerical_file(
+        path,
+        [column for column in columns if column in (record_id, cluster_id, "Match")],
+    )
+    decision_format = detect_format(data)
+    keys = match_keys(parse_matches(data[decision_format.match_col], decision_format))
+    ids = data[record_id].astype(str)
+    # a record matched to none has a label of its own.
+    keys = keys.where((keys != "").fillna(True), "\x00" + ids)
+    labels = pd.factorize(keys, use_na_sentinel=True)[0]
+    return ids, data[cluster_id].astype(str), labels
+
+
+def _within_cluster_pairs(starts: np.ndarray, sizes: np.ndarray) -> tuple:
+    """Get the positions of every pair of records within each cluster.
+
+    The records of each cluster are at positions starts to starts + sizes.
+    """
+    records = np.repeat(starts, sizes) + (
+        np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    )
+    later = np.repeat(starts + sizes, sizes) - records - 1
+    left = np.repeat(records, later)
+    right = (
+        left + 1 + (np.arange(later.sum()) - np.repeat(np.cumsum(later) - later, later))
+    )
+    return left, right
+
+
+def count_agreement(
+    labels: np.ndarray,
+    clusters: np.ndarray,
+    pairwise: bool = False,
+    pairs_per_block: int = PAIRS_PER_BLOCK,
+) -> pd.DataFrame:
+    """Count the pairs of records each cluster's reviews agree on.
+
+    Parameters
+    ----------
+    labels : np.ndarray
+        A row per record and a column per review (see read_labels), the
+        records sorted by cluster.
+    clusters : np.ndarray
+        The cluster number of each record, sorted.
+    pairwise : bool, optional
+        Whether each record is a pair of a pairwise file, its label being
+        the decision.
+    pairs_per_block : int, optional
+        The most pairs compared at once.
+
+    Returns
+    -------
+    pd.DataFrame
+        For each cluster: the pairs compared, the pairs every review agrees
+        on, the pairs each review says match (match_<n>), and the sum over
+        pairs of the share of pairs of reviews agreeing (for Fleiss' kappa).
+    """
+    num_reviews = labels.shape[1]
+    starts = np.flatnonzero(np.r_[True, clusters[1:] != clusters[:-1]])
+    sizes = np.diff(np.r_[starts, len(clusters)])
+    counts = np.zeros((len(starts), 3 + num_reviews))
+    # blocks of whole clusters, of about pairs_per_block pairs each.
+    pairs = sizes if pairwise else sizes * (sizes - 1) // 2
+    blocks = (np.cumsum(pairs) - pairs) // pairs_per_block
+    bounds = np.r_[0, np.flatnonzero(np.diff(blocks)) + 1, len(starts)]
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        if pairwise:
+            left = np.arange(starts[first], starts[last - 1] + sizes[last - 1])
+            matched = labels[left] == 1
+            decided = (labels[left] >= 0).all(axis=1)
+        else:
+            left, right = _within_cluster_pairs(starts[first:last], sizes[first:last])
+            matched = labels[left] == labels[right]
+            decided = ((labels[left] >= 0) & (labels[right] >= 0)).all(axis=1)
+        owner = np.searchsorted(starts, left[decided], side="right") - 1
+        matched = matched[decided]
+        said_match = matched.sum(axis=1)
+        said_other = num_reviews - said_match
+        agreed = (said_match == 0) | (said_other == 0)
+        # the share of pairs of reviews agreeing on the pair, for Fleiss.
+        share = (said_match * (said_match - 1) + said_other * (said_other - 1)) / (
+            num_reviews * (num_reviews - 1)
+        )
+        block = np.column_stack([np.ones(len(owner)), agreed, share, matched])
+        for column in range(block.shape[1]):
+            counts[first:last, column] += np.bincount(
+                owner - first, block[:, column], minlength=last - first
+            )
+    names = ["pairs", "agreed", "share_sum"] + [
+        f"match_{n}" for n in range(num_reviews)
+    ]
+    return pd.DataFrame(counts, columns=names)
+
+
+def kappa(counts: pd.DataFrame, num_reviews: int) -> pd.Series | float:
+    """Get Cohen's kappa (Fleiss' for more than two reviews) from counts.
+
+    Parameters
+    ----------
+    counts : pd.DataFrame
+        From count_agreement, or its sum.
+    num_reviews : int
+        The number of reviews.
+
+    Returns
+    -------
+    pd.Series or float
+        Kappa; NaN where every pair had the same answer from every review,
+        so chance agreement is certain.
+    """
+    pairs = counts["pairs"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        match_rates = [counts[f"match_{n}"] / pairs for n in range(num_reviews)]
+        if num_reviews == 2:
+            observed = counts["agreed"] / pairs
+            expected = match_rates[0] * match_rates[1] + (1 - match_rates[0]) * (
+                1 - match_rates[1]
+            )
+        else:
+            observed = counts["share_sum"] / pairs
+            rate = sum(match_rates) / num_reviews
+            expected = rate**2 + (1 - rate) ** 2
+        result = (observed - expected) / (1 - expected)
+    if np.ndim(result):
+        return result.where(expected < 1)
+    return result if expected < 1 else np.nan
+
+
+def compare_reviews(
+    paths: list,
+    record_id: str | None,
+    cluster_id: str | None,
+    pairs_per_block: int = PAIRS_PER_BLOCK,
+) -> tuple:
+    """Compare two or more reviews of the same clerical file.
+
+    Parameters
+    ----------
+    paths : list
+        The reviewed clerical files.
+    record_id : str or None
+        The record id column; None for pairwise files.
+    cluster_id : str or None
+        The cluster id column; None for pairwise files.
+    pairs_per_block : int, optional
+        The most pairs compared at once.
+
+    Returns
+    -------
+    tuple
+        A dict of the overall figures, a DataFrame with a row per cluster
+        (cluster_id, pairs, agreed, agreement and kappa), and the names of
+        the reviews.
+
+    Raises
+    ------
+    ValueError
+        If fewer than two files are given, or pairwise files differ in
+        length.
+    """
+    if len(paths) < 2:
+        raise ValueError("at least two reviews are needed to compare")
+    pairwise = record_id is None
+    reviews = [read_labels(path, record_id, cluster_id) for path in paths]
+    ids, clusters, _ = reviews[0]
+    if pairwise and any(len(review[0]) != len(ids) for review in reviews):
+        raise ValueError("the pairwise files have different numbers of rows")
+    # the records every review has, in the first review's clusters.
+    index = pd.Index(ids)
+    positions = [index.get_indexer(review[0]) for review in reviews]
+    labels = np.full((len(ids), len(reviews)), -1, dtype=np.int64)
+    for column, ((_, _, review_labels), rows) in enumerate(zip(reviews, positions)):
+        found = rows >= 0
+        labels[rows[found], column] = review_labels[found]
+    codes, uniques = pd.factorize(clusters)
+    order = np.argsort(codes, kind="stable")
+    counts = count_agreement(labels[order], codes[order], pairwise, pairs_per_block)
+    counts.insert(0, "cluster_id", uniques)
+    num_reviews = len(reviews)
+    total = counts.drop(columns="cluster_id").sum()
+    names = [reviewer_name(path) for path in paths]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        counts["agreement"] = counts["agreed"] / counts["pairs"]
+    counts["kappa"] = kappa(counts, num_reviews)
+    overall = {
+        "records": len(ids),
+        "records_in_every_review": int((labels >= 0).all(axis=1).sum()),
+        "clusters": len(counts),
+        "pairs": int(total["pairs"]),
+        "agreement": total["agreed"] / total["pairs"] if total["pairs"] else np.nan,
+        "kappa": kappa(total, num_reviews),
+        **{
+            f"match_rate_{name}": total[f"match_{n}"] / total["pairs"]
+            for n, name in enumerate(names)
+        },
+    }
+    clusters = counts[["cluster_id", "pairs", "agreed", "agreement", "kappa"]]
+    clusters = clusters.astype({"pairs": np.int64, "agreed": np.int64})
+    return overall, clusters, names
+
+
+def write_disagreements(
+    path: str,
+    output: str,
+    clusters: pd.DataFrame,
+    cluster_id: str | None,
+) -> int:
+    """Write the clusters reviews disagree on as a new clerical file.
+
+    Parameters
+    ----------
+    path : str
+        One of the reviewed files, whose columns are kept.
+    output : str
+        The clerical file to write; its format is given by its extension,
+        and is parquet if it has none.
+    clusters : pd.DataFrame
+        From compare_reviews.
+    cluster_id : str or None
+        The cluster id column; None for pairwise files.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    disagreed = clusters.loc[clusters["agreed"] < clusters["pairs"], "cluster_id"]
+    data = read_clerical_file(path)
+    if cluster_id is None:
+        keep = np.isin(np.arange(len(data)).astype(str), disagreed.to_numpy())
+    else:
+        keep = data[cluster_id].astype(str).isin(disagreed).to_numpy()
+    data = data[keep].drop(columns=[c for c in DECISION_COLUMNS if c in data.columns])
+    write_file(
+        data.reset_index(drop=True), output, file_format=clerical_file_format(output)
+    )
+    return len(data)
+
+
+def check_output(output: str) -> str | None:
+    """Check a clerical file can be written before the reviews are compared.
+
+    Parameters
+    ----------
+    output : str
+        The clerical file to write (see write_disagreements).
+
+    Returns
+    -------
+    str or None
+        Why it cannot be written, or None if it can.
+    """
+    path = Path(output)
+    suffix = path.suffix.lower()
+    if suffix and suffix not in FORMATS:
+        return f"{output} is not a clerical file: use one of {', '.join(FORMATS)}"
+    if not path.parent.is_dir():
+        return f"{path.parent} is not a folder"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("files", nargs="+", help="two or more reviews of one file")
+    parser.add_argument("--record-id", default="record_id")
+    parser.add_argument("--cluster-id", default="cluster_id")
+    parser.add_argument(
+        "--pairwise", action="store_true", help="the files are pairwise files"
+    )
+    parser.add_argument(
+        "--clusters", help="write the figures per cluster to a csv file"
+    )
+    parser.add_argument(
+        "--disagreements", help="write the clusters disagreed on to this clerical file"
+    )
+    args = parser.parse_args()
+    if args.disagreements:
+        problem = check_output(args.disagreements)
+        if problem is not None:
+            sys.exit(problem)
+    record_id = None if args.pairwise else args.record_id
+    cluster_id = None if args.pairwise else args.cluster_id
+    overall, clusters, names = compare_reviews(args.files, record_id, cluster_id)
+    for name, value in overall.items():
+        print(
+            f"{name:>30}: {value:.4f}"
+            if isinstance(value, float)
+            else f"{name:>30}: {value}"
+        )
+    disagreed = (clusters["agreed"] < clusters["pairs"]).sum()
+    print(f"{disagreed} of {len(clusters)} clusters disagreed on ({', '.join(names)})")
+    if args.clusters:
+        clusters.to_csv(args.clusters, index=False)
+    if args.disagreements:
+        rows = write_disagreements(
+            args.files[0], args.disagreements, clusters, cluster_id
+        )
+        print(f"wrote {rows} rows to {args.disagreements}")
+
+
+if __name__ == "__main__":
+    main()
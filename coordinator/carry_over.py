@@ -0,0 +1,396 @@
+"""
+Carry decisions over to clusters unchanged since an earlier round of review.
+
+When the linkage is run again, many clusters come back exactly as they were.
+Each cluster of the new clerical files is fingerprinted (a hash of its
+records' ids and display values, whatever their order) and looked up among
+the clusters of the done files of the earlier round:
+
+- carried: a cluster with the same records and values was reviewed; its
+  decisions and comments are copied over and marked "carried" in the
+  Decision_Source column, so the front-ends leave the cluster out of the
+  review, as they do auto-resolved clusters;
+- changed: a cluster with the same records was reviewed, but some of their
+  display values have changed;
+- partial: some of its records were reviewed, in a cluster with other
+  records;
+- new: none of its records were reviewed.
+
+Only carried clusters are decided; the others are reviewed as usual, and
+the status of each is written to a Carry_Over column so changed and partial
+clusters can be looked at with the earlier decisions in mind.
+
+    python coordinator/carry_over.py clerical round1_done --config crow2/config_flow.ini \\
+        --in-place
+    python coordinator/carry_over.py new.csv round1_done --output carried --version crow1 \\
+        --record-id Resident_ID --cluster-id Cluster_Number --columns First_Name Last_Name
+
+Files already in progress or done are left as they are. A folder of parquet
+files, partitioned or not, keeps its part files: the decision columns are
+joined onto each of them by record id.
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import (  # noqa: E402
+    CARRIED,
+    CROW1_CLUSTER_FORMAT,
+    CROW2_FORMAT,
+    file_columns,
+    write_file,
+)
+from crow_core.decisions import detect_format, parse_matches  # noqa: E402
+from merge_done import is_done, saved_at  # noqa: E402
+from prepare_files import (  # noqa: E402
+    DECISION_COLUMNS,
+    REVIEWED_MARKERS,
+    clerical_file_format,
+    list_clerical_files,
+    read_clerical_file,
+    read_config,
+)
+
+# The decision format of each version.
+FORMATS = {"crow2": CROW2_FORMAT, "crow1": CROW1_CLUSTER_FORMAT}
+
+# The column the carry-over status of each record's cluster is written to.
+STATUS_COLUMN = "Carry_Over"
+
+STATUSES = ("carried", "changed", "partial", "new")
+
+
+def cluster_fingerprints(
+    data: pd.DataFrame, record_id: str, cluster_id: str, columns: list
+) -> tuple:
+    """Fingerprint the clusters of a clerical file.
+
+    Each record is hashed (pandas' hash_pandas_object) and a cluster's
+    fingerprint is the sum of its records' hashes, so the order of the
+    records does not matter.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file.
+    record_id : str
+        The record id column.
+    cluster_id : str
+        The cluster id column.
+    columns : list
+        The display columns.
+
+    Returns
+    -------
+    tuple
+        The cluster number of each record (numbered in order of first
+        appearance), and for each cluster, the fingerprint of its record
+        ids and values and the fingerprint of its record ids only.
+    """
+    clusters = pd.factorize(data[cluster_id])[0]
+    # values as text, so a file read from CSV and one from parquet agree.
+    text = pd.DataFrame(
+        {
+            column: data[column].astype(object).where(data[column].notna(), "")
+            for column in [record_id, *columns]
+        }
+    ).astype(str)
+    records = pd.util.hash_pandas_object(text, index=False).to_numpy()
+    ids = pd.util.hash_pandas_object(text[record_id], index=False).to_numpy()
+    num_clusters = clusters.max(initial=-1) + 1
+    content = np.zeros(num_clusters, dtype=np.uint64)
+    membership = np.zeros(num_clusters, dtype=np.uint64)
+    # sums wrap around, as the hashes use every bit.
+    np.add.at(content, clusters, records)
+    np.add.at(membership, clusters, ids)
+    return clusters, content, membership
+
+
+def read_done_file(
+    path: str, record_id: str, cluster_id: str, columns: list
+) -> pd.DataFrame | None:
+    """Read the fingerprints and decisions of the records of a done file.
+
+    Parameters
+    ----------
+    path : str
+        The done file.
+    record_id, cluster_id, columns
+        As for cluster_fingerprints.
+
+    Returns
+    -------
+    pd.DataFrame or None
+        A row per record: its id, the fingerprints of its cluster, the
+        records it was matched with (see crow_core.decisions.parse_matches),
+        its comment and when the file was saved; None if the file does not
+        have every column.
+    """
+    available = file_columns(path, clerical_file_format(path))
+    comments = [CROW2_FORMAT.comment_col, CROW1_CLUSTER_FORMAT.comment_col]
+    wanted = [record_id, cluster_id, *columns, CROW2_FORMAT.match_col]
+    if any(column not in available for column in wanted):
+        return None
+    data = read_clerical_file(
+        path, [c for c in available if c in wanted or c in comments]
+    )
+    clusters, content, membership = cluster_fingerprints(
+        data, record_id, cluster_id, columns
+    )
+    decision_format = detect_format(data)
+    comment = decision_format.comment_col
+    return pd.DataFrame(
+        {
+            "record_id": data[record_id].astype(str).to_numpy(),
+            "content": content[clusters],
+            "membership": membership[clusters],
+            "matches": parse_matches(
+                data[decision_format.match_col], decision_format
+            ).to_numpy(),
+            "comment": data[comment].fillna("").astype(str).to_numpy()
+            if comment in data.columns
+            else "",
+            "saved_at": saved_at(path),
+        }
+    )
+
+
+def build_index(
+    folders: list, record_id: str, cluster_id: str, columns: list
+) -> pd.DataFrame:
+    """Read every done file of an earlier round of review.
+
+    Parameters
+    ----------
+    folders : list
+        The folders of clerical files of the earlier round; only the done
+        files are read.
+    record_id, cluster_id, columns
+        As for cluster_fingerprints.
+
+    Returns
+    -------
+    pd.DataFrame
+        A row per record reviewed (see read_done_file), indexed by record
+        id; a record in more than one file is taken from the one saved last.
+    """
+    paths = [p for folder in folders for p in list_clerical_files(folder)]
+    tables = []
+    for path in paths:
+        if not is_done(path):
+            continue
+        table = read_done_file(path, record_id, cluster_id, columns)
+        if table is None:
+            print(f"skipped {path}: it does not have every display column")
+            continue
+        tables.append(table)
+    if not tables:
+        raise ValueError(f"no done files with the display columns in {folders}")
+    index = pd.concat(tables, ignore_index=True).sort_values("saved_at", kind="stable")
+    index = index.drop_duplicates("record_id", keep="last")
+    return index.set_index("record_id")
+
+
+def carry_over(
+    data: pd.DataFrame,
+    index: pd.DataFrame,
+    record_id: str,
+    cluster_id: str,
+    columns: list,
+    version: str = "crow2",
+) -> pd.DataFrame:
+    """Carry the decisions of unchanged clusters over to a new clerical file.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The new clerical file.
+    index : pd.DataFrame
+        The records reviewed in the earlier round (see build_index).
+    record_id, cluster_id, columns
+        As for cluster_fingerprints.
+    version : str, optional
+        "crow2" (the default) or "crow1", the version the file is for.
+
+    Returns
+    -------
+    pd.DataFrame
+        The file with the decision columns, the decisions of the carried
+        clusters and the STATUS_COLUMN of every record.
+    """
+    decision_format = FORMATS[version]
+    data = data.copy()
+    for column, value in DECISION_COLUMNS[version].items():
+        if column not in data.columns:
+            data[column] = value
+    for column in (decision_format.comment_col, decision_format.provenance_col):
+        if column not in data.columns:
+            data[column] = ""
+
+    clusters, content, membership = cluster_fingerprints(
+        data, record_id, cluster_id, columns
+    )
+    ids = data[record_id].astype(str)
+    # the row of each record in the index, -1 if it was not reviewed; the
+    # fingerprints are taken by position so they stay exact uint64.
+    position = index.index.get_indexer(ids)
+    seen = position >= 0
+    position = position.clip(0)
+    num_clusters = len(content)
+    # a cluster matches if every record was reviewed in a cluster with the
+    # same fingerprint.
+    same_content = np.bincount(
+        clusters,
+        (index["content"].to_numpy()[position] == content[clusters]) & seen,
+        minlength=num_clusters,
+    )
+    same_members = np.bincount(
+        clusters,
+        (index["membership"].to_numpy()[position] == membership[clusters]) & seen,
+        minlength=num_clusters,
+    )
+    any_seen = np.bincount(clusters, seen, minlength=num_clusters) > 0
+    sizes = np.bincount(clusters, minlength=num_clusters)
+    status = np.select(
+        [same_content == sizes, same_members == sizes, any_seen],
+        [0, 1, 2],
+        default=3,
+    )
+    data[STATUS_COLUMN] = np.asarray(STATUSES)[status][clusters]
+
+    # only the records of carried clusters that were decided (and not
+    # already decided in this file) take the earlier decision.
+    previous = index["matches"].to_numpy()[position]
+    carried = (status[clusters] == 0) & pd.notna(previous)
+    carried &= (data[decision_format.match_col] == decision_format.undecided).to_numpy()
+    rows = np.flatnonzero(carried)
+    matches = previous[rows]
+    data.loc[data.index[rows], decision_format.match_col] = [
+        decision_format.match_value(list(matched))
+        if len(matched)
+        else decision_format.non_match_value(record)
+        for matched, record in zip(matches, ids.to_numpy()[rows])
+    ]
+    data.loc[data.index[rows], decision_format.comment_col] = index[
+        "comment"
+    ].to_numpy()[position[rows]]
+    data.loc[data.index[rows], decision_format.provenance_col] = CARRIED
+    return data
+
+
+def carry_over_file(
+    path: str,
+    index: pd.DataFrame,
+    record_id: str,
+    cluster_id: str,
+    columns: list,
+    output: str,
+    version: str = "crow2",
+) -> dict:
+    """Carry decisions over to a clerical file and write it.
+
+    Parameters
+    ----------
+    path : str
+        The new clerical file.
+    index, record_id, cluster_id, columns, version
+        As for carry_over.
+    output : str
+        The folder to write the file to, which may be its own.
+
+    Returns
+    -------
+    dict
+        The file and the number of its clusters of each status.
+    """
+    result = {"file": path}
+    if any(marker in Path(path).name.lower() for marker in REVIEWED_MARKERS):
+        return {**result, "skipped": "already reviewed"}
+    data = read_clerical_file(path)
+    missing = [c for c in [record_id, cluster_id, *columns] if c not in data.columns]
+    if missing:
+        return {**result, "skipped": f"no columns {missing}"}
+    data = carry_over(data, index, record_id, cluster_id, columns, version)
+    counts = data.drop_duplicates(cluster_id)[STATUS_COLUMN].value_counts()
+    target = os.path.join(output, os.path.basename(path))
+    if os.path.isdir(path):
+        # a folder of parquet files (e.g. partitioned region=North/...) gets
+        # the decision columns joined onto each part file, keeping its layout.
+        decision_format = FORMATS[version]
+        write_file(
+            data,
+            target,
+            source=path,
+            key=record_id,
+            columns=[
+                decision_format.match_col,
+                decision_format.comment_col,
+                decision_format.provenance_col,
+                STATUS_COLUMN,
+            ],
+            file_format="parquet",
+        )
+    else:
+        write_file(data, target, file_format=clerical_file_format(path))
+    return {**result, **{status: int(counts.get(status, 0)) for status in STATUSES}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("new", help="a new clerical file, or a folder of them")
+    parser.add_argument(
+        "earlier", nargs="+", help="folders of clerical files of the earlier round"
+    )
+    parser.add_argument(
+        "--config", help="take the id and display columns from a crow2 config file"
+    )
+    parser.add_argument("--record-id", default="record_id")
+    parser.add_argument("--cluster-id", default="cluster_id")
+    parser.add_argument("--columns", nargs="+", default=[], help="display columns")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="write the files to this folder")
+    target.add_argument(
+        "--in-place", action="store_true", help="write the files where they are"
+    )
+    parser.add_argument("--version", choices=list(FORMATS), default="crow2")
+    args = parser.parse_args()
+    record_id, cluster_id, columns = args.record_id, args.cluster_id, args.columns
+    if args.config:
+        record_id, cluster_id, columns = read_config(args.config)
+    columns = [c for c in columns if c not in (record_id, cluster_id)]
+
+    index = build_index(args.earlier, record_id, cluster_id, columns)
+    if os.path.isdir(args.new):
+        paths = list_clerical_files(args.new)
+    else:
+        paths = [args.new]
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    report = pd.DataFrame(
+        [
+            carry_over_file(
+                path,
+                index,
+                record_id,
+                cluster_id,
+                columns,
+                os.path.dirname(os.path.abspath(path))
+                if args.in_place
+                else args.output,
+                args.version,
+            )
+            for path in paths
+        ]
+    )
+    print(report.to_string(index=False))
+    print(f"{len(index)} records of the earlier round read")
+
+
+if __name__ == "__main__":
+    main()
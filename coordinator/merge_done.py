@@ -0,0 +1,419 @@
+"""
+Merge the completed clerical files of a project into one table of decisions.
+
+Every done file (crow2's *_done parquet files and crow1's *_DONE.csv files)
+in the folders given is read, its decisions put into one form (the sorted
+ids each record was matched with; see crow_core.decisions) and the results
+written as one parquet dataset, partitioned into buckets of records.
+
+A record decided in more than one file, e.g. a file reopened by a second
+matcher (file_alice_bob_done) while a copy of file_alice_done was kept, is
+resolved by --policy:
+
+- latest: the decision from the file saved last wins;
+- user: the decision of the first of --users to decide it wins, then the
+  latest;
+- flag: as latest, but records decided differently in different files are
+  left with no decision, for review again.
+
+Either way, files counts the files that decided the record and conflict
+marks records decided differently.
+
+    python coordinator/merge_done.py project_folder results --config crow2/config_flow.ini
+    python coordinator/merge_done.py hdfs_copy crow1_files results --policy user --users ab cd
+
+Memory is bounded however many files there are: the files are read a
+process per CPU at a time, each record going to a bucket by the hash of its
+id, then the buckets are resolved a process per CPU at a time. Copy files
+from hdfs with `hdfs dfs -get -p`, which keeps the times they were saved.
+"""
+
+import argparse
+import configparser
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import file_columns  # noqa: E402
+from crow_core.decisions import detect_format, match_keys, parse_matches  # noqa: E402
+from prepare_files import (  # noqa: E402
+    clerical_file_format,
+    list_clerical_files,
+    read_clerical_file,
+)
+
+POLICIES = ("latest", "user", "flag")
+
+# The end of the name of a done file, before any extension.
+DONE_SUFFIX = "_done"
+
+
+def is_done(path: str) -> bool:
+    """Check whether a clerical file's name marks it as done.
+
+    Parameters
+    ----------
+    path : str
+        The clerical file.
+
+    Returns
+    -------
+    bool
+        True for crow2's name_user_done and crow1's name_user_DONE.csv.
+    """
+    return _stem(path).lower().endswith(DONE_SUFFIX)
+
+
+def finished_by(path: str) -> str:
+    """Get the user who finished a done file, from its name.
+
+    The front-ends add the user of each matcher who opens a file to its
+    name, so the last is the one who finished it.
+
+    Parameters
+    ----------
+    path : str
+        The done file.
+
+    Returns
+    -------
+    str
+        The user, or "" if the name has none.
+    """
+    name = _stem(path)[: -len(DONE_SUFFIX)]
+    return name.rsplit("_", 1)[1] if "_" in name else ""
+
+
+def _stem(path: str) -> str:
+    """Get the name of a clerical file without its extension."""
+    name = os.path.basename(path.rstrip("/"))
+    if clerical_file_format(name) != "parquet" or name.lower().endswith(".parquet"):
+        return Path(name).stem
+    return name
+
+
+def saved_at(path: str) -> float:
+    """Get when a file (or folder of parquet files) was last saved."""
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    return max(
+        [
+            os.path.getmtime(os.path.join(folder, name))
+            for folder, _, names in os.walk(path)
+            for name in names
+        ]
+        or [os.path.getmtime(path)]
+    )
+
+
+def _bucket_folder(folder: str, bucket: int) -> str:
+    """Get the folder of a bucket of records, hive-style."""
+    return os.path.join(folder, f"bucket={bucket}")
+
+
+def spool_file(
+    index: int,
+    path: str,
+    spool: str,
+    record_id: str,
+    cluster_id: str,
+    columns: list,
+    buckets: int,
+) -> dict:
+    """Read the decisions of a done file into the buckets of its records.
+
+    Parameters
+    ----------
+    index : int
+        The number of the file, to name its part of each bucket.
+    path : str
+        The done file.
+    spool : str
+        The folder of buckets.
+    record_id : str
+        The record id column.
+    cluster_id : str
+        The cluster id column.
+    columns : list
+        Other columns to keep.
+    buckets : int
+        The number of buckets.
+
+    Returns
+    -------
+    dict
+        The file, the user who finished it and the decisions read.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    available = file_columns(path, clerical_file_format(path))
+    wanted = [record_id, cluster_id, "Match", "Comment", "Comments", "Decision_Source"]
+    data = read_clerical_file(
+        path, [column for column in available if column in wanted + columns]
+    )
+    decision_format = detect_format(data)
+    matches = parse_matches(data[decision_format.match_col], decision_format)
+    decided = matches.notna().to_numpy()
+
+    def text(column):
+        if column not in data.columns:
+            return pd.Series("", index=data.index, dtype=object)
+        return data[column].astype(object).where(data[column].notna(), "").astype(str)
+
+    decisions = pd.DataFrame(
+        {
+            "record_id": text(record_id),
+            "cluster_id": text(cluster_id),
+            "matches": matches,
+            "comment": text(decision_format.comment_col),
+            "decision_source": text(decision_format.provenance_col),
+            **{column: text(column) for column in columns},
+        }
+    )[decided]
+    decisions["user"] = finished_by(path)
+    decisions["file"] = path
+    decisions["saved_at"] = pd.Timestamp(saved_at(path), unit="s")
+    hashes = pd.util.hash_pandas_object(decisions["record_id"], index=False)
+    decisions["bucket"] = (hashes % buckets).to_numpy()
+    table = pa.Table.from_pandas(decisions, preserve_index=False)
+    table = table.replace_schema_metadata()
+    for bucket in np.unique(decisions["bucket"]):
+        rows = table.filter(pc.equal(table.column("bucket"), bucket))
+        folder = _bucket_folder(spool, int(bucket))
+        os.makedirs(folder, exist_ok=True)
+        pq.write_table(
+            rows.drop_columns("bucket"),
+            os.path.join(folder, f"part-{index:06d}.parquet"),
+        )
+    return {"file": path, "user": finished_by(path), "decisions": int(decided.sum())}
+
+
+def resolve_bucket(
+    bucket: int,
+    spool: str,
+    output: str,
+    policy: str = "latest",
+    users: list = (),
+) -> dict:
+    """Resolve the records decided in more than one file, for a bucket.
+
+    Parameters
+    ----------
+    bucket : int
+        The bucket.
+    spool : str
+        The folder of buckets written by spool_file.
+    output : str
+        The folder of the merged dataset.
+    policy : str, optional
+        "latest", "user" or "flag" (see the module docstring).
+    users : list, optional
+        For the user policy, the users in order of priority.
+
+    Returns
+    -------
+    dict
+        The bucket, its records and how many were decided differently.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    decisions = pq.read_table(_bucket_folder(spool, bucket)).to_pandas(
+        types_mapper=pd.ArrowDtype
+    )
+    decisions["key"] = match_keys(decisions["matches"])
+    grouped = decisions.groupby("record_id", sort=False)
+    files = grouped["file"].transform("size")
+    conflict = grouped["key"].transform("nunique") > 1
+    decisions = decisions.assign(files=files, conflict=conflict)
+    order = ["saved_at", "file"]
+    ascending = [False, False]
+    if policy == "user":
+        ranks = {user: rank for rank, user in enumerate(users)}
+        decisions["rank"] = decisions["user"].astype(str).map(ranks).fillna(len(ranks))
+        order, ascending = ["rank"] + order, [True] + ascending
+    merged = decisions.sort_values(order, ascending=ascending, kind="stable")
+    merged = merged.drop_duplicates("record_id").sort_values("record_id")
+    if policy == "flag":
+        merged.loc[merged["conflict"], "matches"] = None
+    merged = merged.drop(columns=[c for c in ("key", "rank") if c in merged.columns])
+    folder = _bucket_folder(output, bucket)
+    os.makedirs(folder, exist_ok=True)
+    # without the pandas metadata, so any reader gets plain arrow types (the
+    # matches as a list of strings).
+    table = pa.Table.from_pandas(merged, preserve_index=False)
+    pq.write_table(
+        table.replace_schema_metadata(), os.path.join(folder, "part-0.parquet")
+    )
+    return {
+        "bucket": bucket,
+        "records": len(merged),
+        "conflicts": int(merged["conflict"].sum()),
+    }
+
+
+def merge_done(
+    folders: list,
+    output: str,
+    record_id: str,
+    cluster_id: str,
+    policy: str = "latest",
+    users: list = (),
+    columns: list = (),
+    buckets: int = 16,
+    workers: int | None = None,
+) -> tuple:
+    """Merge the done files in folders into one partitioned parquet dataset.
+
+    Parameters
+    ----------
+    folders : list
+        The folders of clerical files (see list_clerical_files); only the
+        done files in them are read.
+    output : str
+        The folder to write the merged dataset to; it is replaced.
+    record_id : str
+        The record id column.
+    cluster_id : str
+        The cluster id column.
+    policy : str, optional
+        "latest", "user" or "flag" (see the module docstring).
+    users : list, optional
+        For the user policy, the users in order of priority.
+    columns : list, optional
+        Other columns to keep, e.g. the display columns.
+    buckets : int, optional
+        The number of buckets the records are shared between; each is
+        resolved in memory, so raise it for very large projects.
+    workers : int, optional
+        The number of files read, and buckets resolved, at once; defaults
+        to one per CPU.
+
+    Returns
+    -------
+    tuple
+        Two DataFrames: a row for each done file read, with the user who
+        finished it and the decisions read; and a row for each bucket, with
+        its records and how many were decided differently.
+
+    Raises
+    ------
+    ValueError
+        If the policy is unknown, or no done files are found.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"unknown policy {policy!r} (expected one of {POLICIES})")
+    paths = [
+        path
+        for folder in folders
+        for path in list_clerical_files(folder)
+        if is_done(path)
+    ]
+    if not paths:
+        raise ValueError(f"no done files in {folders}")
+    output = str(output).rstrip("/")
+    parent = os.path.dirname(os.path.abspath(output))
+    spool = tempfile.mkdtemp(prefix=".merge_spool_", dir=parent)
+    temporary = f"{output}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            spool_one = partial(
+                spool_file,
+                spool=spool,
+                record_id=record_id,
+                cluster_id=cluster_id,
+                columns=list(columns),
+                buckets=buckets,
+            )
+            report = list(executor.map(spool_one, range(len(paths)), paths))
+            written = sorted(
+                int(name.split("=", 1)[1])
+                for name in os.listdir(spool)
+                if name.startswith("bucket=")
+            )
+            resolve = partial(
+                resolve_bucket,
+                spool=spool,
+                output=temporary,
+                policy=policy,
+                users=list(users),
+            )
+            resolved = list(executor.map(resolve, written))
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+    shutil.rmtree(output, ignore_errors=True)
+    os.replace(temporary, output)
+    return pd.DataFrame(report), pd.DataFrame(resolved)
+
+
+def read_config(path: str) -> tuple:
+    """Read the id columns from a crow2 config file.
+
+    Parameters
+    ----------
+    path : str
+        A config file laid out as crow2/config_flow.ini.
+
+    Returns
+    -------
+    tuple
+        The record id column and cluster id column.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config["id_variables"]["record_id"], config["id_variables"]["cluster_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("folders", nargs="+", help="folders of clerical files")
+    parser.add_argument("output", help="the folder to write the merged dataset to")
+    parser.add_argument("--config", help="take the id columns from a crow2 config file")
+    parser.add_argument("--record-id", default="record_id")
+    parser.add_argument("--cluster-id", default="cluster_id")
+    parser.add_argument("--policy", choices=POLICIES, default="latest")
+    parser.add_argument("--users", nargs="+", default=[], help="for --policy user")
+    parser.add_argument(
+        "--columns", nargs="+", default=[], help="other columns to keep"
+    )
+    parser.add_argument("--buckets", type=int, default=16)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    record_id, cluster_id = args.record_id, args.cluster_id
+    if args.config:
+        record_id, cluster_id = read_config(args.config)
+    files, buckets = merge_done(
+        args.folders,
+        args.output,
+        record_id,
+        cluster_id,
+        policy=args.policy,
+        users=args.users,
+        columns=args.columns,
+        buckets=args.buckets,
+        workers=args.workers,
+    )
+    print(
+        files.groupby("user").agg(
+            files=("file", "size"), decisions=("decisions", "sum")
+        )
+    )
+    print(
+        f"{len(files)} done files merged: {buckets.records.sum()} records, "
+        f"{buckets.conflicts.sum()} decided differently in different files"
+    )
+
+
+if __name__ == "__main__":
+    main()
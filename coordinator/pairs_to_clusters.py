@@ -0,0 +1,206 @@
+"""
+Convert a pairwise file of candidate record pairs into a cluster file.
+
+In a pairwise file each row is a pair of records, one from each of two
+datasets, with the columns of each given by the [column_file_info_and_order]
+section of the pairwise config (crow1/pairwise_config.ini, or the same
+sections of crow2/config_flow.ini). A record that is a candidate for many
+records is in many pairs, and a matcher sees it once for each.
+
+The records of both sides are de-duplicated, a record being the same one
+wherever its dataset and values (or, with --ids, its id column) are the
+same, and the pairs are united into clusters with a union-find (see
+crow_core.graph): records joined by a chain of candidate pairs are in the
+same cluster. The cluster file has a row per record, its columns named by
+[column_headers_and_order], with record_id, cluster_id and dataset columns,
+ready for the cluster version of either front-end.
+
+    python coordinator/pairs_to_clusters.py pairs.csv clusters.csv \\
+        --config crow1/pairwise_config.ini
+    python coordinator/pairs_to_clusters.py pairs clusters --config crow2/config_flow.ini \\
+        --ids id_a id_b
+
+Decisions already made in the pairwise file are not carried over.
+"""
+
+import argparse
+import configparser
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import connected_components, file_columns, write_file  # noqa: E402
+from prepare_files import clerical_file_format, read_clerical_file  # noqa: E402
+
+
+def pairwise_columns(config: configparser.ConfigParser) -> tuple:
+    """Read the columns of each side of a pair from a pairwise config.
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        A config with [column_headers_and_order] and
+        [column_file_info_and_order] sections.
+
+    Returns
+    -------
+    tuple
+        The column headers, in display order, and for each of the two
+        datasets, in config order, the file column for each header, or
+        None if it has none.
+
+    Raises
+    ------
+    ValueError
+        If the columns are not of exactly two datasets.
+    """
+    orders = {}
+    for title in config.options("column_headers_and_order"):
+        header, order = (
+            config["column_headers_and_order"][title].replace(" ", "").split(",")
+        )
+        orders[order] = header
+    headers = [orders[order] for order in sorted(orders, key=int)]
+
+    columns_by_dataset = {}
+    for title in config.options("column_file_info_and_order"):
+        column, dataset, order = (
+            config["column_file_info_and_order"][title].replace(" ", "").split(",")
+        )
+        columns = columns_by_dataset.setdefault(dataset, [None] * len(headers))
+        columns[headers.index(orders[order])] = column
+    if len(columns_by_dataset) != 2:
+        datasets = list(columns_by_dataset)
+        raise ValueError(f"a pairwise file has two datasets, not {datasets}")
+    return headers, columns_by_dataset
+
+
+def side_records(
+    pairs: pd.DataFrame, headers: list, columns: list, id_column: str | None = None
+) -> tuple:
+    """Get the records of one side of the pairs, each once.
+
+    Parameters
+    ----------
+    pairs : pd.DataFrame
+        The pairwise file.
+    headers : list
+        The column headers (see pairwise_columns).
+    columns : list
+        The file column of the side for each header, or None.
+    id_column : str, optional
+        The side's record id column; if None, records with the same values
+        in every column are the same record.
+
+    Returns
+    -------
+    tuple
+        The number of the record of each pair, from 0, and the records (a
+        DataFrame of their headers, and record_id if id_column is given),
+        one row per number.
+    """
+    side = pd.DataFrame(
+        {
+            header: pairs[column] if column is not None else ""
+            for header, column in zip(headers, columns)
+        }
+    )
+    if id_column is not None:
+        side["record_id"] = pairs[id_column].astype(str)
+        numbers = pd.factorize(side["record_id"])[0]
+    else:
+        numbers = side.groupby(headers, sort=False, dropna=False).ngroup().to_numpy()
+    first = np.unique(numbers, return_index=True)[1]
+    return numbers, side.iloc[first].reset_index(drop=True)
+
+
+def pairs_to_clusters(
+    pairs: pd.DataFrame,
+    headers: list,
+    columns_by_dataset: dict,
+    ids: tuple | None = None,
+) -> pd.DataFrame:
+    """Unite the candidate pairs of a pairwise file into clusters of records.
+
+    Parameters
+    ----------
+    pairs : pd.DataFrame
+        The pairwise file.
+    headers, columns_by_dataset
+        From pairwise_columns.
+    ids : tuple, optional
+        The record id column of each side; if None, records are told apart
+        by their values and numbered within their dataset.
+
+    Returns
+    -------
+    pd.DataFrame
+        A row per record: its headers, record_id, cluster_id (numbered from
+        1 in order of the first pair of each cluster), dataset and the
+        number of pairs it was in, sorted by cluster.
+    """
+    sides = []
+    offset = 0
+    for side, (dataset, columns) in enumerate(columns_by_dataset.items()):
+        id_column = ids[side] if ids else None
+        numbers, records = side_records(pairs, headers, columns, id_column)
+        if id_column is None:
+            records["record_id"] = [f"{dataset}_{n}" for n in range(len(records))]
+        records["dataset"] = dataset
+        records["pairs"] = np.bincount(numbers, minlength=len(records))
+        sides.append((numbers + offset, records))
+        offset += len(records)
+    (left, records_a), (right, records_b) = sides
+    roots = connected_components(left, right, offset)
+
+    records = pd.concat([records_a, records_b], ignore_index=True)
+    # clusters numbered in the order of the pairs, so the file reads as the
+    # pairs did.
+    first_pair = np.full(offset, len(pairs))
+    np.minimum.at(first_pair, roots[left], np.arange(len(pairs)))
+    records["cluster_id"] = np.unique(first_pair[roots], return_inverse=True)[1] + 1
+    order = np.lexsort((np.arange(offset), first_pair[roots]))
+    records = records.iloc[order].reset_index(drop=True)
+    return records[[*headers, "record_id", "cluster_id", "dataset", "pairs"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("pairs", help="the pairwise file")
+    parser.add_argument("output", help="the cluster file to write")
+    parser.add_argument(
+        "--config", required=True, help="a pairwise config, for the columns"
+    )
+    parser.add_argument(
+        "--ids",
+        nargs=2,
+        metavar=("ID_A", "ID_B"),
+        help="the record id column of each side, in config order",
+    )
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    headers, columns_by_dataset = pairwise_columns(config)
+
+    wanted = [c for columns in columns_by_dataset.values() for c in columns if c]
+    wanted += list(args.ids or [])
+    available = file_columns(args.pairs, clerical_file_format(args.pairs))
+    missing = [column for column in wanted if column not in available]
+    if missing:
+        sys.exit(f"columns {missing} not in {args.pairs}")
+    pairs = read_clerical_file(args.pairs, list(dict.fromkeys(wanted)))
+    clusters = pairs_to_clusters(pairs, headers, columns_by_dataset, args.ids)
+    write_file(clusters, args.output, file_format=clerical_file_format(args.output))
+
+    sizes = clusters["cluster_id"].value_counts()
+    print(
+        f"{len(pairs)} pairs of {2 * len(pairs)} records: {len(clusters)} "
+        f"records in {len(sizes)} clusters (largest {sizes.max()} records)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""
+Check a folder of clerical files, and prepare them for review, in parallel.
+
+Each file is checked as the front-ends check a file when a matcher opens it
+(the record and cluster id columns and display columns are there, every
+record has ids and the record ids are unique) and against a size limit, so
+a bad file is found before it is handed out rather than by a matcher part
+way through a shift.
+
+With --output or --in-place, the files that pass are also prepared: the
+columns crow2 adds when a file is first opened (Match, Comment,
+Sequential_Cluster_Id and Sequential_Record_Id) are added and the records
+sorted into review order, so opening the file skips that work. A folder of
+parquet files keeps its part files and partitions: the columns are joined
+onto each part file and its records left in their order. Files already in
+progress or done are only checked.
+
+    python coordinator/prepare_files.py clerical --config crow2/config_flow.ini
+    python coordinator/prepare_files.py clerical --in-place --report report.csv
+
+The files are checked a process per CPU at a time (--workers) and a line
+for each is printed, with its problems.
+"""
+
+import argparse
+import configparser
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import (  # noqa: E402
+    CROW1_CLUSTER_FORMAT,
+    CROW2_FORMAT,
+    check_clerical_file,
+    file_columns,
+    file_size,
+    read_file,
+    write_file,
+)
+from crow_core.files import FORMATS  # noqa: E402
+
+# The decision columns each version adds to a file, and the value they
+# start with.
+DECISION_COLUMNS = {
+    "crow2": {
+        CROW2_FORMAT.match_col: CROW2_FORMAT.undecided,
+        CROW2_FORMAT.comment_col: "",
+    },
+    "crow1": {CROW1_CLUSTER_FORMAT.match_col: CROW1_CLUSTER_FORMAT.undecided},
+}
+
+# Files the front-ends have renamed once a matcher has opened them.
+REVIEWED_MARKERS = ("inprogress", "done")
+
+
+def list_clerical_files(folder: str) -> list:
+    """List the clerical files in a folder.
+
+    Parameters
+    ----------
+    folder : str
+        The folder; files are CSV, parquet or Arrow IPC files, files
+        without an extension (as crow2 names parquet files) or folders of
+        parquet files.
+
+    Returns
+    -------
+    list
+        The paths of the files, sorted.
+    """
+    paths = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.startswith((".", "_")) or name.endswith((".tmp", ".old")):
+            continue
+        if name.endswith(".decisions") or name.endswith(".saved"):
+            # the deltas and save lock of another file (see crow_core.deltas).
+            continue
+        if os.path.isdir(path) or not Path(name).suffix:
+            paths.append(path)
+        elif Path(name).suffix.lower() in FORMATS:
+            paths.append(path)
+    return paths
+
+
+def clerical_file_format(path: str) -> str:
+    """Get the format of a clerical file; parquet if it has no extension.
+
+    Parameters
+    ----------
+    path : str
+        The clerical file.
+
+    Returns
+    -------
+    str
+        "csv", "parquet" or "arrow".
+    """
+    return FORMATS.get(Path(path).suffix.lower(), "parquet")
+
+
+def read_clerical_file(path: str, columns: list | None = None) -> pd.DataFrame:
+    """Read a clerical file, with CSV values as text so they are kept as is.
+
+    Parameters
+    ----------
+    path : str
+        The clerical file (see list_clerical_files).
+    columns : list, optional
+        The columns to read; defaults to every column.
+
+    Returns
+    -------
+    pd.DataFrame
+        The clerical file.
+    """
+    file_format = clerical_file_format(path)
+    if file_format == "csv":
+        return pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False)
+    return read_file(path, columns, file_format)
+
+
+def prepared_columns(version: str) -> list:
+    """Get the columns preparing a file for a version gives it.
+
+    Parameters
+    ----------
+    version : str
+        "crow2" or "crow1".
+
+    Returns
+    -------
+    list
+        The decision columns and, for crow2, the sequential ids.
+    """
+    columns = list(DECISION_COLUMNS[version])
+    if version == "crow2":
+        columns += ["Sequential_Cluster_Id", "Sequential_Record_Id"]
+    return columns
+
+
+def is_prepared(data: pd.DataFrame, version: str, ordered: bool = True) -> bool:
+    """Check whether a file already has the columns and order of a prepared one.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file.
+    version : str
+        "crow2" or "crow1".
+    ordered : bool, optional
+        Whether the records must be in review order too; a folder of
+        parquet files keeps its own order.
+
+    Returns
+    -------
+    bool
+        True if preparing the file would not change it.
+    """
+    if any(column not in data.columns for column in prepared_columns(version)):
+        return False
+    if version == "crow1":
+        return True
+    # numbers, also when a CSV file is read as text.
+    sequential = data[["Sequential_Cluster_Id", "Sequential_Record_Id"]].apply(
+        pd.to_numeric, errors="coerce"
+    )
+    if not ordered:
+        return not sequential.isna().any().any()
+    return (
+        not sequential.isna().any().any()
+        and sequential["Sequential_Cluster_Id"].is_monotonic_increasing
+        and sequential["Sequential_Record_Id"].is_monotonic_increasing
+    )
+
+
+def prepare_clerical_file(
+    data: pd.DataFrame, record_id: str, cluster_id: str, version: str = "crow2"
+) -> pd.DataFrame:
+    """Add the columns a front-end adds when a file is first opened.
+
+    Columns the file already has are kept, so no decision is lost.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file.
+    record_id : str
+        The record id column.
+    cluster_id : str
+        The cluster id column.
+    version : str, optional
+        "crow2" (the default) or "crow1".
+
+    Returns
+    -------
+    pd.DataFrame
+        The file with the decision columns and, for crow2, the sequential
+        ids, its records sorted by cluster in order of first appearance.
+    """
+    data = data.copy()
+    for column, value in DECISION_COLUMNS[version].items():
+        if column not in data.columns:
+            data[column] = value
+    if version == "crow1":
+        order = np.argsort(pd.factorize(data[cluster_id])[0], kind="stable")
+        return data.iloc[order].reset_index(drop=True)
+    for column in ("Sequential_Cluster_Id", "Sequential_Record_Id"):
+        if column not in data.columns:
+            continue
+        # numbers, also when a CSV file is read as text.
+        data[column] = pd.to_numeric(data[column], errors="coerce")
+        if data[column].isna().any():
+            data = data.drop(columns=column)
+    if "Sequential_Cluster_Id" not in data.columns:
+        data["Sequential_Cluster_Id"] = pd.factorize(data[cluster_id])[0]
+    # records in review order, so crow2 need not sort them when it opens the
+    # file; the record ids are then numbered in that order.
+    data = data.sort_values("Sequential_Cluster_Id", kind="stable")
+    data = data.reset_index(drop=True)
+    if "Sequential_Record_Id" not in data.columns:
+        data["Sequential_Record_Id"] = np.arange(len(data))
+    else:
+        data = data.sort_values(
+            ["Sequential_Cluster_Id", "Sequential_Record_Id"], kind="stable"
+        ).reset_index(drop=True)
+    return data
+
+
+def check_file(
+    path: str,
+    record_id: str,
+    cluster_id: str,
+    columns: list,
+    max_mb: float = 0,
+    output: str | None = None,
+    version: str = "crow2",
+) -> dict:
+    """Check a clerical file and, if it passes, prepare it.
+
+    Parameters
+    ----------
+    path : str
+        The clerical file.
+    record_id : str
+        The record id column.
+    cluster_id : str
+        The cluster id column.
+    columns : list
+        The display columns the file must have.
+    max_mb : float, optional
+        The largest the file may be, in megabytes; 0 for no limit.
+    output : str, optional
+        The folder to write the prepared file to, which may be its own; if
+        None, the file is only checked.
+    version : str, optional
+        "crow2" (the default) or "crow1", the version to prepare it for.
+
+    Returns
+    -------
+    dict
+        The file, its size, records and clusters, its status ("invalid",
+        "ok", "prepared" or "ready", if it already was) and its problems.
+    """
+    result = {"file": path, "size_mb": file_size(path) / 2**20}
+    problems = []
+    if max_mb and result["size_mb"] > max_mb:
+        problems.append(f"file is bigger than {max_mb:g}MB")
+    file_format = clerical_file_format(path)
+    try:
+        available = file_columns(path, file_format)
+        # every column if the file is to be written again, else only those
+        # checked.
+        read_columns = None
+        if output is None:
+            wanted = [record_id, cluster_id, *columns]
+            read_columns = [column for column in available if column in wanted]
+        data = read_clerical_file(path, read_columns)
+    except Exception as error:
+        problems.append(f"cannot be read: {error}")
+        return {**result, "status": "invalid", "problems": "; ".join(problems)}
+    problems += check_clerical_file(data, record_id, cluster_id, columns)
+    result["records"] = len(data)
+    if cluster_id in data.columns:
+        result["clusters"] = data[cluster_id].nunique()
+    if problems:
+        return {**result, "status": "invalid", "problems": "; ".join(problems)}
+    reviewed = any(marker in Path(path).name.lower() for marker in REVIEWED_MARKERS)
+    if output is None or reviewed:
+        return {**result, "status": "ok", "problems": ""}
+    target = os.path.join(output, os.path.basename(path))
+    # a folder of parquet files (e.g. partitioned region=North/part-0.parquet)
+    # is written a part file at a time, the prepared columns joined on by
+    # record id, so it keeps its layout; crow2 sorts its records on opening.
+    folder = os.path.isdir(path)
+    if is_prepared(data, version, ordered=not folder):
+        if os.path.abspath(target) == os.path.abspath(path):
+            return {**result, "status": "ready", "problems": ""}
+    else:
+        data = prepare_clerical_file(data, record_id, cluster_id, version)
+    if folder:
+        write_file(
+            data,
+            target,
+            source=path,
+            key=record_id,
+            columns=prepared_columns(version),
+            file_format=file_format,
+        )
+    else:
+        write_file(data, target, file_format=file_format)
+    return {**result, "status": "prepared", "problems": ""}
+
+
+def prepare_files(
+    folder: str,
+    record_id: str,
+    cluster_id: str,
+    columns: list = (),
+    max_mb: float = 0,
+    output: str | None = None,
+    version: str = "crow2",
+    workers: int | None = None,
+) -> pd.DataFrame:
+    """Check, and prepare, every clerical file in a folder in parallel.
+
+    Parameters
+    ----------
+    folder : str
+        The folder of clerical files (see list_clerical_files).
+    record_id, cluster_id, columns, max_mb, output, version
+        As for check_file.
+    workers : int, optional
+        The number of files checked at once; defaults to one per CPU.
+
+    Returns
+    -------
+    pd.DataFrame
+        A row for each file (see check_file).
+    """
+    paths = list_clerical_files(folder)
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+    check = partial(
+        check_file,
+        record_id=record_id,
+        cluster_id=cluster_id,
+        columns=list(columns),
+        max_mb=max_mb,
+        output=output,
+        version=version,
+    )
+    with ProcessPoolExecutor(workers) as executor:
+        results = list(executor.map(check, paths))
+    report = pd.DataFrame(
+        results,
+        columns=["file", "size_mb", "records", "clusters", "status", "problems"],
+    )
+    return report.astype({"records": "Int64", "clusters": "Int64"})
+
+
+def read_config(path: str) -> tuple:
+    """Read the id and display columns from a crow2 config file.
+
+    Parameters
+    ----------
+    path : str
+        A config file laid out as crow2/config_flow.ini.
+
+    Returns
+    -------
+    tuple
+        The record id column, cluster id column and display columns.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    return (
+        config["id_variables"]["record_id"],
+        config["id_variables"]["cluster_id"],
+        list(config["display_columns"].values()),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("folder", help="the folder of clerical files")
+    parser.add_argument(
+        "--config", help="take the id and display columns from a crow2 config file"
+    )
+    parser.add_argument("--record-id", default="record_id")
+    parser.add_argument("--cluster-id", default="cluster_id")
+    parser.add_argument("--columns", nargs="+", default=[], help="display columns")
+    parser.add_argument(
+        "--max-mb", type=float, default=512, help="largest file size (0: no limit)"
+    )
+    prepare = parser.add_mutually_exclusive_group()
+    prepare.add_argument("--output", help="write the prepared files to this folder")
+    prepare.add_argument(
+        "--in-place", action="store_true", help="prepare the files where they are"
+    )
+    parser.add_argument("--version", choices=list(DECISION_COLUMNS), default="crow2")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--report", help="also write the report to this csv file")
+    args = parser.parse_args()
+    record_id, cluster_id, columns = args.record_id, args.cluster_id, args.columns
+    if args.config:
+        record_id, cluster_id, columns = read_config(args.config)
+    report = prepare_files(
+        args.folder,
+        record_id,
+        cluster_id,
+        columns,
+        max_mb=args.max_mb,
+        output=args.folder if args.in_place else args.output,
+        version=args.version,
+        workers=args.workers,
+    )
+    if args.report:
+        report.to_csv(args.report, index=False)
+    with pd.option_context("display.max_colwidth", 200, "display.width", 200):
+        print(report.to_string(index=False, float_format="{:.1f}".format))
+    invalid = (report.status == "invalid").sum()
+    print(f"{len(report)} files checked, {invalid} invalid")
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
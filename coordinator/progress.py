@@ -0,0 +1,102 @@
+"""
+Show the progress of a project from the footers of its clerical files.
+
+Each save of either front-end writes the records and clusters decided, the
+user and the time into the file's parquet (or Arrow IPC) metadata, or into
+its latest delta (see crow_core.progress). Only those footers are read, in
+parallel, so the progress of every file in a folder is shown in about a
+second without reading any records, wherever the folder is:
+
+    python coordinator/progress.py clerical
+    python coordinator/progress.py hdfs://namenode/user/project/clerical --csv progress.csv
+    python coordinator/progress.py s3://bucket/project/clerical --workers 32
+
+A file saved before its progress was written (and any CSV file) shows only
+the status of its name: a done file counts as fully decided and one not
+started as not at all, but how far an in progress file has got is unknown
+until it is next saved. Clusters are only counted once a file is saved, so
+the clusters done are given over the files saved since then.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import project_progress, summarise_progress  # noqa: E402
+from crow_core.progress import STATUSES, WORKERS  # noqa: E402
+
+
+def open_folder(folder: str) -> tuple:
+    """Connect to the file system of a folder given as a path or a URI.
+
+    Parameters
+    ----------
+    folder : str
+        A local folder, or a URI pyarrow can open (hdfs://, s3://; s3a://
+        is read as s3://).
+
+    Returns
+    -------
+    tuple
+        The file system (None for a local folder) and the folder's path in
+        it.
+    """
+    if "://" not in folder:
+        return None, folder
+    from pyarrow import fs
+
+    if folder.startswith("s3a://"):
+        folder = "s3://" + folder[len("s3a://") :]
+    return fs.FileSystem.from_uri(folder)
+
+
+def percent(part: int, whole: int) -> str:
+    """Format part of whole as a percentage, or "-" if whole is 0."""
+    return f"{100 * part / whole:.1f}%" if whole else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("folder", help="the folder of clerical files, or its URI")
+    parser.add_argument("--csv", help="write the progress of each file to a csv file")
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS, help="footers read at once"
+    )
+    args = parser.parse_args()
+    filesystem, folder = open_folder(args.folder)
+    table = project_progress(folder, filesystem, args.workers)
+    if table.empty:
+        sys.exit(f"no clerical files in {args.folder}")
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+
+    shown = table.assign(file=table["file"].map(lambda path: Path(path).name))
+    print(shown.to_string(index=False))
+    summary = summarise_progress(table)
+    statuses = ", ".join(f"{summary[status]} {status}" for status in STATUSES)
+    print(f"\n{summary['files']} files: {statuses}")
+    if summary["total_records"]:
+        print(
+            f"records decided: {summary['decided_records']} of "
+            f"{summary['total_records']} "
+            f"({percent(summary['decided_records'], summary['total_records'])})"
+        )
+    else:
+        print("records decided: not known for any file yet")
+    if summary["clusters_known"]:
+        print(
+            f"clusters done: {summary['done_clusters']} of "
+            f"{summary['total_clusters']} "
+            f"({percent(summary['done_clusters'], summary['total_clusters'])}), "
+            f"in the {summary['clusters_known']} files saved since progress "
+            "was recorded"
+        )
+    else:
+        print("clusters done: not recorded yet; each file records them when saved")
+    if summary["unknown"]:
+        print(f"{summary['unknown']} files have no progress recorded yet")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Resolve the decisions of a project into a final entity id for every record.
+
+Each record's decision is the records it was matched with (crow2's
+stringified lists and crow1's comma-joined ids are both read, see
+crow_core.decisions). The decisions are read as a graph of records, an edge
+from each record to each record it was matched with, and the connected
+components found with a union-find (see crow_core.graph): each component is
+an entity, and its id is the smallest record id in it.
+
+    python coordinator/resolve_entities.py results entities
+    python coordinator/resolve_entities.py hdfs_copy crow1_files entities.csv \\
+        --config crow2/config_flow.ini --problems problems.csv
+
+The decisions are read from the dataset merge_done.py writes (a folder of
+bucket=N folders), or from the done files in folders of clerical files; a
+record decided in more than one file then joins every entity it was put in,
+so merge them first to choose between the decisions.
+
+Decisions should be transitive: if a matcher puts a with b, and b with c,
+then a is with c and every record of an entity lists the same records. A
+record whose decision lists fewer records than its entity has is flagged
+"not transitive" (e.g. a says [a, b] and b says [b, c], or a matches b but b
+is marked no match), one matched to records that are in none of the files
+"unknown ids", and one not yet decided "undecided". --problems writes every
+record of the entities with a problem, with its decision, for review.
+
+The output has a row per record: record_id, resolved_entity_id,
+entity_size and problem ("" for none), as parquet or, for a .csv name, CSV.
+"""
+
+import argparse
+import configparser
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import connected_components, file_columns, iter_batches  # noqa: E402
+from crow_core.decisions import detect_format, parse_matches  # noqa: E402
+from merge_done import is_done  # noqa: E402
+from prepare_files import (  # noqa: E402
+    clerical_file_format,
+    list_clerical_files,
+    read_clerical_file,
+)
+
+# The problems a record can have, the worst last; each record gets its worst.
+PROBLEMS = ("", "undecided", "not transitive", "unknown ids")
+
+
+def is_merged(path: str) -> bool:
+    """Check whether a folder is a dataset written by merge_done.py.
+
+    Parameters
+    ----------
+    path : str
+        A folder, or a file.
+
+    Returns
+    -------
+    bool
+        True if it has bucket=N folders.
+    """
+    return os.path.isdir(path) and any(
+        name.startswith("bucket=") for name in os.listdir(path)
+    )
+
+
+def decision_sources(paths: list) -> list:
+    """List the merged datasets and done files to read decisions from.
+
+    Parameters
+    ----------
+    paths : list
+        Datasets written by merge_done.py, folders of clerical files (of
+        which the done files are read) or clerical files.
+
+    Returns
+    -------
+    list
+        The datasets and files.
+    """
+    sources = []
+    for path in paths:
+        if is_merged(path) or not os.path.isdir(path):
+            sources.append(path)
+        else:
+            sources += [file for file in list_clerical_files(path) if is_done(file)]
+    return sources
+
+
+def read_decisions(path: str, record_id: str, cluster_id: str):
+    """Read the record ids, cluster ids and parsed decisions of a source.
+
+    Parameters
+    ----------
+    path : str
+        A dataset written by merge_done.py, or a clerical file.
+    record_id : str
+        The record id column of a clerical file.
+    cluster_id : str
+        The cluster id column of a clerical file.
+
+    Returns
+    -------
+    pyarrow.Table
+        record_id and cluster_id as strings and matches as lists of strings
+        (see crow_core.decisions.parse_matches).
+    """
+    import pyarrow as pa
+
+    columns = ["record_id", "cluster_id", "matches"]
+    if is_merged(path):
+        batches = iter_batches(path, columns, file_format="parquet")
+        table = pa.Table.from_batches(batches)
+    else:
+        available = file_columns(path, clerical_file_format(path))
+        data = read_clerical_file(
+            path,
+            [c for c in available if c in (record_id, cluster_id, "Match")],
+        )
+        decision_format = detect_format(data)
+        matches = parse_matches(data[decision_format.match_col], decision_format)
+        table = pa.table(
+            {
+                "record_id": pa.array(data[record_id].astype(str), pa.string()),
+                "cluster_id": pa.array(data[cluster_id].astype(str), pa.string()),
+                "matches": pa.array(matches),
+            }
+        )
+    return table.select(columns).cast(
+        pa.schema(
+            {
+                "record_id": pa.string(),
+                "cluster_id": pa.string(),
+                "matches": pa.large_list(pa.string()),
+            }
+        )
+    )
+
+
+def resolve_entities(decisions) -> tuple:
+    """Resolve decisions into an entity for every record.
+
+    Parameters
+    ----------
+    decisions : pyarrow.Table
+        From read_decisions; a record may have more than one row.
+
+    Returns
+    -------
+    tuple
+        Two pyarrow.Tables: a row per record, sorted by record id, with
+        record_id, resolved_entity_id, entity_size and problem; and the
+        decisions, each with the resolved_entity_id of its record and its
+        own problem.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    ids = decisions["record_id"].combine_chunks()
+    matches = decisions["matches"].combine_chunks()
+    matched = pc.list_flatten(matches)
+    rows = pc.list_parent_indices(matches).to_numpy()
+
+    # the records are numbered in order of their ids, so the smallest
+    # number in an entity is its smallest id.
+    encoded = pc.dictionary_encode(pa.concat_arrays([ids, matched]))
+    order = pc.sort_indices(encoded.dictionary).to_numpy()
+    nodes = encoded.dictionary.take(order)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    numbers = rank[encoded.indices.to_numpy()]
+    record, target = numbers[: len(ids)], numbers[len(ids) :]
+    roots = connected_components(record[rows], target, len(nodes))
+    sizes = np.bincount(roots, minlength=len(nodes))
+
+    # a transitive decision lists every record of its entity (itself too,
+    # if left out); a record matched to none is an entity of one.
+    is_record = np.zeros(len(nodes), dtype=bool)
+    is_record[record] = True
+    itself = np.bincount(rows, target == record[rows], minlength=len(ids)) > 0
+    listed = pc.list_value_length(matches).fill_null(0).to_numpy() + ~itself
+    problem = np.where(listed != sizes[roots[record]], 2, 0)
+    problem[matches.is_null().to_numpy(zero_copy_only=False)] = 1
+    unknown = np.bincount(rows, ~is_record[target], minlength=len(ids)) > 0
+    problem[unknown] = 3
+
+    # each record its worst problem over the rows that decide it.
+    worst = np.zeros(len(nodes), dtype=np.int8)
+    np.maximum.at(worst, record, problem.astype(np.int8))
+    records = np.flatnonzero(is_record)
+    entities = pa.table(
+        {
+            "record_id": nodes.take(records),
+            "resolved_entity_id": nodes.take(roots[records]),
+            "entity_size": sizes[roots[records]],
+            "problem": pa.DictionaryArray.from_arrays(
+                worst[records], pa.array(PROBLEMS)
+            ),
+        }
+    )
+    decisions = decisions.append_column(
+        "resolved_entity_id", nodes.take(roots[record])
+    ).append_column("problem", pa.array(PROBLEMS).take(problem))
+    return entities, decisions
+
+
+def write_table(table, path: str):
+    """Write a pyarrow table as parquet, or CSV for a .csv name, atomically.
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        The table.
+    path : str
+        The file to write.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    temporary = f"{path}.tmp"
+    if clerical_file_format(path) == "csv":
+        problem = table.schema.get_field_index("problem")
+        if problem >= 0:
+            table = table.set_column(
+                problem, "problem", table["problem"].cast(pa.string())
+            )
+        pv.write_csv(table, temporary)
+    else:
+        pq.write_table(table, temporary)
+    os.replace(temporary, path)
+
+
+def problem_records(decisions):
+    """Get every decision of the entities with a problem, for review.
+
+    Parameters
+    ----------
+    decisions : pyarrow.Table
+        The decisions from resolve_entities.
+
+    Returns
+    -------
+    pd.DataFrame
+        resolved_entity_id, record_id, cluster_id, the decision (the ids
+        matched, joined by ", ", or "no match") and its problem, sorted by
+        entity.
+    """
+    import pyarrow.compute as pc
+
+    entity = decisions["resolved_entity_id"]
+    bad = pc.unique(pc.filter(entity, pc.not_equal(decisions["problem"], "")))
+    data = decisions.filter(pc.is_in(entity, value_set=bad))
+    data = data.set_column(
+        data.schema.get_field_index("matches"),
+        "matches",
+        pc.if_else(
+            pc.equal(pc.list_value_length(data["matches"]), 0),
+            "no match",
+            pc.binary_join(data["matches"], ", "),
+        ),
+    )
+    data = data.sort_by(
+        [("resolved_entity_id", "ascending"), ("record_id", "ascending")]
+    )
+    return data.select(
+        ["resolved_entity_id", "record_id", "cluster_id", "matches", "problem"]
+    ).to_pandas()
+
+
+def read_config(path: str) -> tuple:
+    """Read the id columns from a crow2 config file.
+
+    Parameters
+    ----------
+    path : str
+        A config file laid out as crow2/config_flow.ini.
+
+    Returns
+    -------
+    tuple
+        The record id column and cluster id column.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config["id_variables"]["record_id"], config["id_variables"]["cluster_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "decisions",
+        nargs="+",
+        help="merged datasets from merge_done.py, folders of clerical files or files",
+    )
+    parser.add_argument("output", help="the file to write the entity ids to")
+    parser.add_argument("--config", help="take the id columns from a crow2 config file")
+    parser.add_argument("--record-id", default="record_id")
+    parser.add_argument("--cluster-id", default="cluster_id")
+    parser.add_argument(
+        "--problems", help="write the decisions of entities with problems to a csv file"
+    )
+    args = parser.parse_args()
+    record_id, cluster_id = args.record_id, args.cluster_id
+    if args.config:
+        record_id, cluster_id = read_config(args.config)
+
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    sources = decision_sources(args.decisions)
+    if not sources:
+        sys.exit(f"no decisions in {args.decisions}")
+    decisions = pa.concat_tables(
+        read_decisions(source, record_id, cluster_id) for source in sources
+    )
+    entities, decisions = resolve_entities(decisions)
+    write_table(entities, args.output)
+    if args.problems:
+        problem_records(decisions).to_csv(args.problems, index=False)
+
+    counts = entities["problem"].value_counts().to_pylist()
+    counts = {count["values"]: count["counts"] for count in counts}
+    print(
+        f"{entities.num_rows} records from {len(sources)} files resolved into "
+        f"{pc.count_distinct(entities['resolved_entity_id'])} entities"
+    )
+    for name in PROBLEMS[1:]:
+        print(f"{name:>15}: {counts.get(name, 0)} records")
+
+
+if __name__ == "__main__":
+    main()
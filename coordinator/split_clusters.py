@@ -0,0 +1,255 @@
+"""
+Split oversized clusters into sub-clusters of similar records.
+
+A blocking mistake upstream can put hundreds of records in one cluster, too
+many for a matcher to compare and for either front-end to show quickly.
+Each cluster of more than --max-size records is split using a similarity
+graph over the display columns: two of its records are joined if they agree
+on at least --min-agree of the columns (values compared as auto-resolution
+compares them: trimmed, lower case, blank and -9 never agreeing), and each
+connected component (see crow_core.graph) is a sub-cluster. A component
+still too large is split again needing one more column to agree, and one
+agreeing on every column is cut into pieces of --max-size records.
+
+    python coordinator/split_clusters.py linked_001 linked_001_split \\
+        --config crow2/config_flow.ini --max-size 30
+    python coordinator/split_clusters.py file.csv file_split.csv \\
+        --record-id Resident_ID --cluster-id Cluster_Number --columns First_Name Last_Name
+
+The records of a split cluster get cluster ids of the original id and the
+number of the sub-cluster (1234_1, 1234_2, ...), and every record keeps its
+original cluster id in an Original_Cluster_Id column, so decisions can be
+traced back. The sub-clusters of a cluster are kept together, where the
+cluster was in the file.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import connected_components, write_file  # noqa: E402
+from crow_core.auto_resolve import normalise  # noqa: E402
+from prepare_files import (  # noqa: E402
+    clerical_file_format,
+    read_clerical_file,
+    read_config,
+)
+
+# The column the original cluster ids are kept in.
+ORIGINAL_CLUSTER_ID = "Original_Cluster_Id"
+
+# The most pairs of records compared at once.
+PAIRS_PER_BLOCK = 5_000_000
+
+
+def similar_pairs(codes: np.ndarray, min_agree: int) -> tuple:
+    """Find the pairs of records that agree on enough columns.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        A row per record and a column per compared column, of codes from
+        crow_core.auto_resolve.normalise (-1 for missing).
+    min_agree : int
+        The fewest columns a pair must agree on.
+
+    Returns
+    -------
+    tuple
+        The first and second record of each pair, and the number of
+        columns it agrees on.
+    """
+    size = len(codes)
+    rows_per_block = max(1, PAIRS_PER_BLOCK // max(size, 1))
+    firsts, seconds, scores = [], [], []
+    for start in range(0, size, rows_per_block):
+        block = codes[start : start + rows_per_block]
+        agree = np.zeros((len(block), size), dtype=np.int16)
+        for column in range(codes.shape[1]):
+            agree += (block[:, column, None] == codes[None, :, column]) & (
+                block[:, column, None] >= 0
+            )
+        # each pair once, the first record before the second.
+        agree[np.arange(len(block))[:, None] + start >= np.arange(size)] = -1
+        first, second = np.nonzero(agree >= min_agree)
+        firsts.append((first + start).astype(np.int32))
+        seconds.append(second.astype(np.int32))
+        scores.append(agree[first, second])
+    if not firsts:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    return np.concatenate(firsts), np.concatenate(seconds), np.concatenate(scores)
+
+
+def split_cluster(codes: np.ndarray, max_size: int, min_agree: int) -> np.ndarray:
+    """Split the records of an oversized cluster into sub-clusters.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        The cluster's records (see similar_pairs).
+    max_size : int
+        The most records in a sub-cluster.
+    min_agree : int
+        The fewest columns records must agree on to be in one sub-cluster.
+
+    Returns
+    -------
+    np.ndarray
+        The sub-cluster of each record, numbered from 0 in order of each
+        sub-cluster's first record.
+    """
+    size, num_columns = codes.shape
+    first, second, score = similar_pairs(codes, min_agree)
+    labels = np.zeros(size, dtype=np.int64)
+    # (records, the columns they must agree on) still to split.
+    pending = [(np.arange(size), min_agree)]
+    next_label = 0
+    while pending:
+        records, needed = pending.pop()
+        if len(records) <= max_size:
+            labels[records] = next_label
+            next_label += 1
+            continue
+        if needed > num_columns:
+            # as alike as they can be: pieces of max_size, in file order.
+            pieces = np.arange(len(records)) // max_size
+            labels[records] = next_label + pieces
+            next_label += pieces[-1] + 1
+            continue
+        inside = np.zeros(size, dtype=bool)
+        inside[records] = True
+        kept = inside[first] & (score >= needed)
+        number = np.full(size, -1)
+        number[records] = np.arange(len(records))
+        roots = connected_components(
+            number[first[kept]], number[second[kept]], len(records)
+        )
+        for root in np.unique(roots):
+            pending.append((records[roots == root], needed + 1))
+    # sub-clusters numbered in order of their first record.
+    return pd.factorize(labels)[0]
+
+
+def split_clusters(
+    data: pd.DataFrame,
+    cluster_id: str,
+    columns: list,
+    max_size: int = 30,
+    min_agree: int | None = None,
+) -> tuple:
+    """Split every cluster of a clerical file bigger than max_size.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file.
+    cluster_id : str
+        The cluster id column.
+    columns : list
+        The columns to compare records on, e.g. the display columns.
+    max_size : int, optional
+        The most records in a cluster (default 30).
+    min_agree : int, optional
+        The fewest columns two records must agree on to be put in one
+        sub-cluster; defaults to half the columns, rounded up.
+
+    Returns
+    -------
+    tuple
+        The file with the split clusters' records given sub-cluster ids
+        and kept together, and an ORIGINAL_CLUSTER_ID column; and a
+        DataFrame of the clusters split, with their size, the number of
+        sub-clusters and the size of the largest.
+    """
+    if min_agree is None:
+        min_agree = (len(columns) + 1) // 2
+    clusters, cluster_values = pd.factorize(data[cluster_id])
+    sizes = np.bincount(clusters, minlength=len(cluster_values))
+    oversized = np.flatnonzero(sizes > max_size)
+    data = data.copy()
+    data[ORIGINAL_CLUSTER_ID] = data[cluster_id]
+    if not len(oversized):
+        return data, pd.DataFrame(
+            columns=[cluster_id, "records", "sub_clusters", "largest"]
+        )
+
+    codes = np.column_stack([normalise(data[column]) for column in columns])
+    sub_clusters = np.zeros(len(data), dtype=np.int64)
+    report = []
+    new_ids = data[cluster_id].astype(str).to_numpy(dtype=object)
+    by_cluster = np.argsort(clusters, kind="stable")
+    starts = np.cumsum(sizes) - sizes
+    for cluster in oversized:
+        rows = by_cluster[starts[cluster] : starts[cluster] + sizes[cluster]]
+        labels = split_cluster(codes[rows], max_size, min_agree)
+        sub_clusters[rows] = labels
+        new_ids[rows] = [f"{cluster_values[cluster]}_{label + 1}" for label in labels]
+        report.append(
+            {
+                cluster_id: cluster_values[cluster],
+                "records": len(rows),
+                "sub_clusters": labels.max() + 1,
+                "largest": np.bincount(labels).max(),
+            }
+        )
+    data[cluster_id] = new_ids
+    # the review order crow2 numbered the records in no longer holds.
+    data = data.drop(
+        columns=["Sequential_Cluster_Id", "Sequential_Record_Id"], errors="ignore"
+    )
+    # each cluster's records together and in place, by sub-cluster.
+    first_row = np.full(len(cluster_values), len(data))
+    np.minimum.at(first_row, clusters, np.arange(len(data)))
+    order = np.lexsort((np.arange(len(data)), sub_clusters, first_row[clusters]))
+    return data.iloc[order].reset_index(drop=True), pd.DataFrame(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("file", help="the clerical file")
+    parser.add_argument("output", help="the clerical file to write")
+    parser.add_argument(
+        "--config", help="take the id and display columns from a crow2 config file"
+    )
+    parser.add_argument("--record-id", default="record_id")
+    parser.add_argument("--cluster-id", default="cluster_id")
+    parser.add_argument(
+        "--columns", nargs="+", default=[], help="the columns to compare records on"
+    )
+    parser.add_argument("--max-size", type=int, default=30)
+    parser.add_argument(
+        "--min-agree",
+        type=int,
+        help="the fewest columns similar records agree on (default: half)",
+    )
+    args = parser.parse_args()
+    record_id, cluster_id, columns = args.record_id, args.cluster_id, args.columns
+    if args.config:
+        record_id, cluster_id, columns = read_config(args.config)
+    columns = [c for c in columns if c not in (record_id, cluster_id)]
+    if not columns:
+        sys.exit("no columns to compare records on; give --columns or --config")
+
+    data = read_clerical_file(args.file)
+    missing = [c for c in [cluster_id, *columns] if c not in data.columns]
+    if missing:
+        sys.exit(f"columns {missing} not in {args.file}")
+    data, report = split_clusters(
+        data, cluster_id, columns, args.max_size, args.min_agree
+    )
+    write_file(data, args.output, file_format=clerical_file_format(args.output))
+    if len(report):
+        print(report.to_string(index=False))
+    print(
+        f"{len(report)} clusters of more than {args.max_size} records split into "
+        f"{report['sub_clusters'].sum()} sub-clusters"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Split a linked dataset into clerical files of about equal review effort.
+
+Whole clusters are packed into the files, so no cluster is split between
+matchers, and balanced by the effort of reviewing them: a cluster of n
+records has n records to decide and n(n-1)/2 pairs of them to compare, so
+one cluster of 50 takes far longer than 25 pairs. Clusters are placed
+largest first, each on the file with the least effort so far.
+
+The dataset is read twice, a batch of rows at a time: once for the size of
+each cluster, then again to write each batch's rows to the files they were
+given to, all files at once. Memory therefore depends on the number of
+clusters, not records, and a 50 million record linkage splits in minutes.
+
+    python coordinator/split_files.py linked.parquet clerical --files 20
+    python coordinator/split_files.py linked.parquet crow1 --files 8 --format csv
+
+The files keep the record id, cluster id and display columns (every column
+by default) in CROW's layout; the front-ends add the decision columns when a
+file is first opened.
+"""
+
+import argparse
+import configparser
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import file_columns, iter_batches  # noqa: E402
+
+EXTENSIONS = {"parquet": "", "csv": ".csv", "arrow": ".arrow"}
+
+
+def cluster_effort(sizes: np.ndarray, pair_weight: float = 1.0) -> np.ndarray:
+    """Estimate the effort of reviewing clusters from their sizes.
+
+    Parameters
+    ----------
+    sizes : np.ndarray
+        The number of records in each cluster.
+    pair_weight : float, optional
+        The effort of comparing a pair of records, relative to deciding a
+        record.
+
+    Returns
+    -------
+    np.ndarray
+        The records plus the weighted pairs within each cluster.
+    """
+    sizes = np.asarray(sizes, dtype=np.float64)
+    return sizes + pair_weight * sizes * (sizes - 1) / 2
+
+
+def count_clusters(
+    path: str, cluster_id: str, file_format: str | None = None
+) -> pd.Series:
+    """Count the records in each cluster, reading the dataset in batches.
+
+    Parameters
+    ----------
+    path : str
+        The linked dataset.
+    cluster_id : str
+        The cluster id column.
+    file_format : str, optional
+        "csv", "parquet" or "arrow"; defaults to the file's extension.
+
+    Returns
+    -------
+    pd.Series
+        The number of records, indexed by cluster id.
+
+    Raises
+    ------
+    ValueError
+        If a record has no cluster id.
+    """
+    counts = []
+    for batch in iter_batches(path, [cluster_id], file_format):
+        clusters = batch.column(0).to_pandas()
+        if clusters.isna().any() or (clusters == "").any():
+            raise ValueError(f"{path} has records with no {cluster_id}")
+        counts.append(clusters.value_counts(sort=False))
+    if not counts:
+        return pd.Series(dtype=np.int64)
+    counts = pd.concat(counts)
+    return counts.groupby(level=0, sort=False).sum()
+
+
+def _fill(loads: np.ndarray, effort: float, count: int) -> np.ndarray:
+    """Share count clusters of the same effort out between files.
+
+    Gives the same numbers per file as placing them one at a time on the
+    least loaded file, without a step per cluster: the files below the
+    level they can all be brought up to get enough to reach it, and the
+    few left over go one at a time.
+    """
+    order = np.argsort(loads, kind="stable")
+    ordered = loads[order]
+    # the level the count clusters raise the m least loaded files to, for
+    # each m; the right m is the last whose level is above its files.
+    levels = (count * effort + np.cumsum(ordered)) / np.arange(1, len(loads) + 1)
+    filled = int(np.flatnonzero(levels > ordered).max()) + 1
+    level = levels[filled - 1]
+    taken = np.zeros(len(loads), dtype=np.int64)
+    taken[order[:filled]] = np.floor((level - ordered[:filled]) / effort)
+    while taken.sum() > count:
+        # rounding; take one back from the file it left highest.
+        taken[np.argmax(np.where(taken > 0, loads + taken * effort, -np.inf))] -= 1
+    for _ in range(count - taken.sum()):
+        taken[np.argmin(loads + taken * effort)] += 1
+    return taken
+
+
+def assign_clusters(efforts: np.ndarray, num_files: int) -> np.ndarray:
+    """Pack clusters into files, balancing the effort of each file.
+
+    Clusters are placed largest first, each on the file with the least
+    effort so far; the many clusters of the same size (e.g. pairs) are
+    placed together.
+
+    Parameters
+    ----------
+    efforts : np.ndarray
+        The effort of each cluster (see cluster_effort).
+    num_files : int
+        The number of files.
+
+    Returns
+    -------
+    np.ndarray
+        The file (0 to num_files - 1) each cluster is placed in.
+    """
+    efforts = np.asarray(efforts, dtype=np.float64)
+    files = np.zeros(len(efforts), dtype=np.int64)
+    loads = np.zeros(num_files)
+    values, groups = np.unique(-efforts, return_inverse=True)
+    clusters = np.argsort(groups, kind="stable")
+    starts = np.searchsorted(groups[clusters], np.arange(len(values) + 1))
+    for group, value in enumerate(values):
+        members = clusters[starts[group] : starts[group + 1]]
+        taken = _fill(loads, -value, len(members))
+        files[members] = np.repeat(np.arange(num_files), taken)
+        loads += taken * -value
+    return files
+
+
+class _Output:
+    """A clerical file written a batch of rows at a time."""
+
+    def __init__(self, path: str, file_format: str, schema) -> None:
+        import pyarrow as pa
+        import pyarrow.csv as csv
+        import pyarrow.parquet as pq
+
+        self.path = path
+        # written under a temporary name, so a failed split leaves no file
+        # that looks complete.
+        self.temporary = f"{path}.tmp"
+        if file_format == "parquet":
+            self.writer = pq.ParquetWriter(self.temporary, schema)
+        elif file_format == "csv":
+            self.writer = csv.CSVWriter(self.temporary, schema)
+        else:
+            self.writer = pa.ipc.new_file(
+                self.temporary, schema, options=pa.ipc.IpcWriteOptions(compression=None)
+            )
+
+    def write(self, table) -> None:
+        """Add rows to the file."""
+        self.writer.write_table(table)
+
+    def close(self) -> None:
+        """Finish the file and move it into place."""
+        self.writer.close()
+        os.replace(self.temporary, self.path)
+
+
+def split_file(
+    path: str,
+    output: str,
+    num_files: int,
+    record_id: str,
+    cluster_id: str,
+    columns: list | None = None,
+    name: str | None = None,
+    file_format: str = "parquet",
+    input_format: str | None = None,
+    pair_weight: float = 1.0,
+    workers: int | None = None,
+) -> pd.DataFrame:
+    """Split a linked dataset into clerical files balanced by review effort.
+
+    Parameters
+    ----------
+    path : str
+        The linked dataset: a CSV, parquet or Arrow IPC file, or a folder
+        of parquet files.
+    output : str
+        The folder to write the clerical files to.
+    num_files : int
+        The number of clerical files.
+    record_id : str
+        The record id column.
+    cluster_id : str
+        The cluster id column.
+    columns : list, optional
+        The display columns to keep; defaults to every column.
+    name : str, optional
+        The start of each file name, followed by its number; defaults to
+        the name of the dataset.
+    file_format : str, optional
+        "parquet" (the default, named without an extension as crow2
+        expects), "csv" or "arrow".
+    input_format : str, optional
+        The format of the dataset; defaults to its extension.
+    pair_weight : float, optional
+        The effort of comparing a pair of records, relative to deciding a
+        record (see cluster_effort).
+    workers : int, optional
+        The number of files written at once; defaults to one per CPU.
+
+    Returns
+    -------
+    pd.DataFrame
+        For each file written, its path and its clusters, records, pairs
+        and effort.
+
+    Raises
+    ------
+    ValueError
+        If a column is not in the dataset, or a record has no cluster id.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    available = file_columns(path, input_format)
+    columns = available if columns is None else list(columns)
+    columns = [record_id, cluster_id] + [
+        column for column in columns if column not in (record_id, cluster_id)
+    ]
+    missing = [column for column in columns if column not in available]
+    if missing:
+        raise ValueError(f"{path} has no columns {missing}")
+
+    sizes = count_clusters(path, cluster_id, input_format)
+    if sizes.empty:
+        raise ValueError(f"{path} has no records")
+    efforts = cluster_effort(sizes.to_numpy(), pair_weight)
+    files = assign_clusters(efforts, num_files)
+    cluster_ids = pa.array(sizes.index.to_numpy())
+
+    name = name or Path(str(path).rstrip("/")).stem
+    os.makedirs(output, exist_ok=True)
+    paths = [
+        os.path.join(output, f"{name}_{number:03d}{EXTENSIONS[file_format]}")
+        for number in range(1, num_files + 1)
+    ]
+    outputs = []
+    with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+        for batch in iter_batches(path, columns, input_format):
+            table = pa.Table.from_batches([batch])
+            if not outputs:
+                outputs = [_Output(file, file_format, table.schema) for file in paths]
+            clusters = pc.index_in(
+                table.column(cluster_id).cast(cluster_ids.type), value_set=cluster_ids
+            )
+            batch_files = files[clusters.to_numpy(zero_copy_only=False)]
+            # the rows of each file together, in cluster order.
+            order = np.lexsort((clusters.to_numpy(zero_copy_only=False), batch_files))
+            table = table.take(pa.array(order))
+            bounds = np.searchsorted(batch_files[order], np.arange(num_files + 1))
+            writes = [
+                executor.submit(
+                    outputs[file].write,
+                    table.slice(bounds[file], bounds[file + 1] - bounds[file]),
+                )
+                for file in range(num_files)
+                if bounds[file + 1] > bounds[file]
+            ]
+            for write in writes:
+                write.result()
+        list(executor.map(_Output.close, outputs))
+
+    sizes = sizes.to_numpy()
+    return pd.DataFrame(
+        {
+            "path": paths,
+            "clusters": np.bincount(files, minlength=num_files),
+            "records": np.bincount(files, sizes, minlength=num_files).astype(int),
+            "pairs": np.bincount(
+                files, sizes * (sizes - 1) // 2, minlength=num_files
+            ).astype(int),
+            "effort": np.bincount(files, efforts, minlength=num_files),
+        }
+    )
+
+
+def read_config(path: str) -> tuple:
+    """Read the id and display columns from a crow2 config file.
+
+    Parameters
+    ----------
+    path : str
+        A config file laid out as crow2/config_flow.ini.
+
+    Returns
+    -------
+    tuple
+        The record id column, cluster id column and display columns.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    return (
+        config["id_variables"]["record_id"],
+        config["id_variables"]["cluster_id"],
+        list(config["display_columns"].values()),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("input", help="the linked dataset (parquet, csv or arrow)")
+    parser.add_argument("output", help="the folder to write the clerical files to")
+    parser.add_argument("--files", type=int, required=True, help="number of files")
+    parser.add_argument(
+        "--config", help="take the id and display columns from a crow2 config file"
+    )
+    parser.add_argument("--record-id", default="record_id")
+    parser.add_argument("--cluster-id", default="cluster_id")
+    parser.add_argument(
+        "--columns", nargs="+", help="display columns to keep (default: all)"
+    )
+    parser.add_argument("--name", help="start of the file names (default: input's)")
+    parser.add_argument("--format", choices=list(EXTENSIONS), default="parquet")
+    parser.add_argument("--pair-weight", type=float, default=1.0)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    record_id, cluster_id, columns = args.record_id, args.cluster_id, args.columns
+    if args.config:
+        record_id, cluster_id, columns = read_config(args.config)
+    summary = split_file(
+        args.input,
+        args.output,
+        args.files,
+        record_id,
+        cluster_id,
+        columns,
+        name=args.name,
+        file_format=args.format,
+        pair_weight=args.pair_weight,
+        workers=args.workers,
+    )
+    print(summary.to_string(index=False))
+    effort = summary.effort
+    print(f"largest file has {effort.max() / effort.mean():.3f}x the mean effort")
+
+
+if __name__ == "__main__":
+    main()
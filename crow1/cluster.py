@@ -39,8 +39,47 @@ import sys
 import tkinter
 from tkinter import filedialog, ttk
 
-import numpy as np
-import pandas as pd
+# the review engine shared with CROW2 lives in crow_core, next to this folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crow_core import (  # noqa: E402
+    CROW1_CLUSTER_FORMAT,
+    FILE_TYPES,
+    CheckpointWriter,
+    ReviewSession,
+    auto_resolve,
+    check_clerical_file,
+    encode_categories,
+    file_columns,
+    parse_order,
+    parse_rules,
+    prioritise,
+    progress_metadata,
+    read_file,
+    write_file,
+)
+
+
+def get_used_columns(config):
+    """
+    returns the columns of the clerical file the application uses: the ids,
+    the columns displayed or compared by auto-resolution, the column the
+    review order is taken from and the decision columns. The others are left
+    on disk and joined back on at save.
+    """
+    used = [
+        config["record_id_col"]["record_id"],
+        config["cluster_id_number"]["cluster_id"],
+    ]
+    used += [
+        config["columnfile_info_and_order"][column_title].strip()
+        for column_title in config.options("columnfile_info_and_order")
+    ]
+    used += [
+        column.strip()
+        for column in config.get("auto_resolution", "columns", fallback="").split(",")
+    ]
+    used.append(config.get("review_order", "column", fallback="").strip())
+    return used + CROW1_CLUSTER_FORMAT.decision_columns()
 
 
 class IntroWindow:
@@ -134,9 +173,6 @@ class ClericalApp:
         self.filename_done = filename_done
         self.filename_old = filename_old
 
-        # list of record IDs that have not been matched yet
-        self.not_matched_yet = []
-
         # create protocol for if user presses the 'X' (top right)
         root.protocol("WM_DELETE_WINDOW", self.on_exit)
 
@@ -151,46 +187,64 @@ class ClericalApp:
 
             self.matching_previously_began = 0
 
-        # convert all columns apart from Match and Comments (if specified) to string
-        for col_header in working_file.columns:
-            if col_header in ("Match", "Comments"):
-                pass
-            else:
-                # convert to string
-                working_file[col_header] = working_file[col_header].astype(str)
-                # remove nan values
-                for i in range(len(working_file)):
-                    # should this be 'NaN' after casting to str?
-                    if working_file[col_header][i] == "nan":
-                        working_file.at[i, col_header] = ""
+        # convert all columns apart from Match and Comments (if specified) to string;
+        # columns with few distinct values (e.g. Source, Sex) are stored once
+        # per value as categories, the rest as strings. missing values are blank.
+        text_columns = [
+            col_header
+            for col_header in working_file.columns
+            if col_header not in ("Match", "Comments")
+        ]
+        encoded = encode_categories(working_file, text_columns, missing="")
+        for col_header in text_columns:
+            if col_header not in encoded:
+                working_file[col_header] = (
+                    working_file[col_header].astype(str).replace("nan", "")
+                )
 
         working_file.fillna("", inplace=True)
 
-        # a counter of the number of checkpoint saves.
+        # a counter of the number of checkpoint saves, the number of clusters
+        # between them, and the background thread they are saved on so the
+        # window does not freeze.
         self.checkpointcounter = 0
+        self.records_per_checkpoint = int(
+            config["custom_settings"]["num_records_checkpoint"]
+        )
+        self.checkpoints = CheckpointWriter(self.write_checkpoint)
 
-        # create a sequential cluster id number from the cluster id variable
+        # the review engine holds the match decisions and the cluster index;
+        # the comments column is only kept if the commentbox is specified.
         cluster_var = config["cluster_id_number"]["cluster_id"]
-        working_file["cluster_sequential_number"] = pd.factorize(
-            working_file[cluster_var]
-        )[0]
+        decision_format = CROW1_CLUSTER_FORMAT
+        if not int(config["custom_settings"]["commentbox"]):
+            decision_format = decision_format._replace(comment_col=None)
+        self.review = ReviewSession(
+            working_file,
+            config["record_id_col"]["record_id"],
+            cluster_var,
+            decision_format,
+        )
+
+        # create a sequential cluster id number from the cluster id variable
+        working_file["cluster_sequential_number"] = self.review.cluster_codes
 
-        # list of cluster numbers over which to iterate
-        clusters_to_iterate = list(working_file["cluster_sequential_number"].unique())
+        # decide the clusters that need no clerical review, if specified
+        self.auto_resolve_clusters()
 
-        # counter variable for iterating through the CM file
-        # For multiple records version use cluster ids
+        # put the clusters left in order of priority, if specified
+        self.order_clusters()
 
         # get the starting cluster id:
-        self.cluster_index = self.get_starting_cluster_id()
+        starting_cluster = self.get_starting_cluster_id()
+        self.matching_completed = starting_cluster is None
+        self.cluster_index = starting_cluster or 0
 
-        # create a variable to indicate the lumber of cluster id's
-        self.num_clusters = len(clusters_to_iterate)
+        # create a variable to indicate the lumber of cluster id's to review
+        self.num_clusters = self.review.queue_length
 
         # get a list of the indices of the records contained within the current cluster.
-        self.display_indexes = working_file.index[
-            working_file["cluster_sequential_number"] == self.cluster_index
-        ].to_list()
+        self.display_indexes = self.get_display_indexes()
 
         # create a variable that indicates the length of the current cluster
         self.len_current_cluster = len(
@@ -227,16 +281,124 @@ class ClericalApp:
         self.draw_recordframe(config, working_file)
         self.draw_button_frame()
         self.draw_tool_frame()
+        self.update_save_status()
+
+    @property
+    def cluster_index(self):
+        """
+        The sequential number of the cluster being matched, kept by the review engine.
+        """
+        return self.review.index
+
+    @cluster_index.setter
+    def cluster_index(self, value):
+        self.review.index = value
 
     def get_starting_cluster_id(self):
         """
         returns the cluster id of the first cluster that does not have a value in the match field.
         """
-        for i in working_file.index:
-            if working_file.loc[i, "Match"] == "":
-                return working_file.loc[i, "cluster_sequential_number"]
-            else:
-                pass
+        return self.review.first_undecided()
+
+    def auto_resolve_clusters(self):
+        """
+        decides the clusters that need no clerical review with the rules in the
+        [auto_resolution] section of the config (if there is one), takes them out
+        of the clusters to review, and saves the file so the decisions are kept.
+        """
+        rules = parse_rules(config.get("auto_resolution", "rules", fallback=""))
+        if not rules:
+            return
+
+        columns = [
+            column.strip()
+            for column in config.get("auto_resolution", "columns", fallback="").split(
+                ","
+            )
+            if column.strip()
+        ]
+        # default to every column displayed
+        if not columns:
+            columns = [
+                config["columnfile_info_and_order"][column_title].strip()
+                for column_title in config.options("columnfile_info_and_order")
+            ]
+
+        counts = auto_resolve(self.review, columns=columns, rules=rules)
+        print("\n Clusters decided automatically:", counts)
+        if any(counts.values()):
+            self.save(self.filename_old)
+            self.checkpointcounter += 1
+
+    def order_clusters(self):
+        """
+        puts the clusters to review in the order set in the [review_order] section
+        of the config (if there is one), e.g. the most uncertain match scores first,
+        rather than the order of the file.
+        """
+        order = parse_order(config.get("review_order", "order", fallback=""))
+        if order == "file":
+            return
+        column = config.get("review_order", "column", fallback="").strip() or None
+        threshold = float(config.get("review_order", "threshold", fallback="0.5"))
+        prioritise(self.review, order, column, threshold)
+
+    def save(self, filename):
+        """
+        saves the decisions to the file, once any checkpoint being saved in the
+        background is saved.
+        """
+        self.checkpoints.flush()
+        self.write_checkpoint(
+            self.review.snapshot(["cluster_sequential_number"]),
+            filename,
+            self.review.progress(),
+        )
+
+    def save_checkpoint(self, filename):
+        """
+        saves a copy of the decisions so far to the file in the background, so
+        the window carries on while it is written.
+        """
+        self.checkpoints.submit(
+            self.review.snapshot(["cluster_sequential_number"]),
+            filename,
+            self.review.progress(),
+        )
+
+    def write_checkpoint(self, decisions, filename, progress=None):
+        """
+        writes decisions (from ReviewSession.snapshot) to the file, joining
+        them back on to the columns that were not loaded. progress (from
+        ReviewSession.progress, taken with the snapshot) is written into the
+        file's metadata, for coordinator/progress.py.
+        """
+        write_file(
+            decisions,
+            filename,
+            source=filename,
+            key=self.review.record_id,
+            columns=self.review.decision_columns + ["cluster_sequential_number"],
+            metadata=None
+            if progress is None
+            else progress_metadata(progress, getpass.getuser()),
+        )
+
+    def update_save_status(self):
+        """
+        shows whether a checkpoint is being saved, and checks again soon.
+        """
+        self.save_status.config(text=self.checkpoints.status)
+        root.after(500, self.update_save_status)
+
+    def get_display_indexes(self):
+        """
+        returns the indices of the records in the current cluster; empty once
+        the last cluster has been passed.
+        """
+        if self.review.at_end:
+            return []
+        return self.review.cluster_rows().tolist()
 
     def draw_button_frame(self):
         # =====  button_frame - for match/non-match/back buttons
@@ -270,11 +432,24 @@ class ClericalApp:
         self.back_button.grid(
             row=self.len_current_cluster, column=3, columnspan=1, padx=10, pady=10
         )
+        self.redo_button = tkinter.Button(
+            self.button_frame,
+            text="Redo",
+            font=f"Helvetica {self.text_size}",
+            command=lambda: self.redo(),
+        )
+        self.redo_button.grid(
+            row=self.len_current_cluster, column=4, columnspan=1, padx=10, pady=10
+        )
 
         # disable back button if no previous clusters exist
         if self.cluster_index == 0 and self.current_num_cluster_decisions() == 0:
             self.back_button.config(state=tkinter.DISABLED)
 
+        # disable redo button if nothing has been undone
+        if not self.review.can_redo:
+            self.redo_button.config(state=tkinter.DISABLED)
+
         # Add in the comment widget based on config option
         if int(config["custom_settings"]["commentbox"]):
             # create comments column if one doesn't exist
@@ -351,6 +526,12 @@ class ClericalApp:
         )
         self.save_button.pack(side=tkinter.RIGHT, padx=5)
 
+        # whether a checkpoint is being saved
+        self.save_status = ttk.Label(
+            self.tool_frame, text=self.checkpoints.status, foreground="grey"
+        )
+        self.save_status.pack(side=tkinter.RIGHT, padx=5)
+
         # highlighter
         self.highlighter_button = tkinter.Checkbutton(
             self.tool_frame,
@@ -363,8 +544,8 @@ class ClericalApp:
         self.highlighter_button.pack(side=tkinter.LEFT, padx=5)
 
     def draw_recordframe(self, config, working_file):
-        # try to calculate and display remaining # clusters for matching
-        try:
+        # calculate and display remaining # clusters for matching
+        if not self.matching_completed:
             self.counter_matches = ttk.Label(
                 self.record_frame,
                 text=f"{self.cluster_index + 1} / {self.num_clusters} Clusters",
@@ -379,7 +560,7 @@ class ClericalApp:
             )
 
         # except when matching is completed
-        except TypeError:
+        else:
             tkinter.messagebox.showinfo(
                 title="Matching completed",
                 message="Please select a different file to clerically match",
@@ -495,7 +676,7 @@ class ClericalApp:
                     self.columns_to_compare.append(col_header[0])
 
                 # if match column not populated yet, keep checkbutton clickable
-                if working_file.loc[display_i, "Match"] == "":
+                if not self.review.is_decided(display_i):
                     exec(f"self.checkbutton{v}.config(state=tkinter.NORMAL)")
 
                 # else make it unclickable
@@ -543,7 +724,11 @@ class ClericalApp:
             self.comment_entry.delete(0, tkinter.END)
 
         # disable back button if no previous clusters exist
-        if self.cluster_index == 0 and self.current_num_cluster_decisions() == 0:
+        if (
+            self.cluster_index == 0
+            and self.current_num_cluster_decisions() == 0
+            and not self.review.can_undo
+        ):
             self.back_button.config(state=tkinter.DISABLED)
         else:
             self.back_button.config(state="normal")
@@ -614,17 +799,12 @@ class ClericalApp:
         current_num_cluster_decisions: integer
 
         """
-        # list containing all record IDs for records marked as matches in current cluster
-        current_cluster_decisions = [
-            working_file.loc[i, "Match"] for i in self.display_indexes
-        ]
+        # no cluster is displayed once the last one has been passed
+        if self.review.at_end:
+            return 0
 
         # counting records as a match if there's something in their corresponding match column
-        current_num_cluster_decisions = len(
-            [record for record in current_cluster_decisions if record != ""]
-        )
-
-        return current_num_cluster_decisions
+        return self.review.num_decided_in_cluster()
 
     def update_df(self, event):
         """
@@ -640,97 +820,63 @@ class ClericalApp:
         None.
 
         """
-        # create a list of checkboxes ticked by the user
-        checkboxes_selected = self.match_string.split(",")
+        # create a list of the record ids ticked by the user
+        checkboxes_selected = [
+            record for record in self.match_string.split(",") if record
+        ]
+
+        # if commentbox specified in config, store its contents with the decisions
+        comment = None
+        if int(config["custom_settings"]["commentbox"]):
+            comment = self.comment_entry.get()
 
         # if match button pressed
         if event == 1:
-            # for each record in the current cluster
-            for i in self.display_indexes:
-                # if 1 or 0 records are selected, present user with warning
-                if len(checkboxes_selected) <= 2:
-                    tkinter.messagebox.showwarning(
-                        message="Two or more records must be selected to make a match"
-                    )
-
-                    break
-
-                # otherwise if the match column is currently empty
-                if working_file.loc[i, "Match"] == "":
-                    # if a record is selected by checkbutton
-                    if (
-                        working_file[config["record_id_col"]["record_id"]][i]
-                        in self.match_string
-                    ):
-                        # append currently selected records' record ids to the match column
-                        working_file.loc[i, "Match"] = self.match_string
-
-                        # remove matched records in cluster from list of those not yet matched
-                        try:
-                            self.not_matched_yet.remove(i)
-
-                        # for cases where matched records have already been removed (big clusters)
-                        except ValueError:
-                            pass
+            # if 1 or 0 records are selected, present user with warning
+            if len(checkboxes_selected) < 2:
+                tkinter.messagebox.showwarning(
+                    message="Two or more records must be selected to make a match"
+                )
+                return
 
-                        # if commentbox specified in config
-                        if int(config["custom_settings"]["commentbox"]):
-                            # for each row where checkbox selected, append the commentbox contents
-                            working_file.loc[i, "Comments"] = self.comment_entry.get()
-
-                    # append those not selected by checkbutton to list of those not yet matched
-                    else:
-                        self.not_matched_yet.append(i)
-                else:
-                    pass
+            # add the selected records' record ids to their match column
+            self.review.match_records(checkboxes_selected, comment)
 
             # if there are 1 or 0 records remaining without matching decisions
-            if (len(self.display_indexes) - self.current_num_cluster_decisions()) <= 1:
+            if self.review.num_undecided_in_cluster() <= 1:
                 # for this remaining record, mark as a non-match
-                for i in self.not_matched_yet:
-                    working_file.loc[i, "Match"] = "No match in cluster"
+                self.review.non_match_remaining()
 
         # if non-match button clicked
         else:
             # mark each record in cluster that has a null match decision as a non-match
-            for i in self.display_indexes:
-                if working_file.loc[i, "Match"] == "":
-                    working_file.loc[i, "Match"] = "No match in cluster"
-
-                    # if commentbox specified in config
-                    if int(config["custom_settings"]["commentbox"]):
-                        working_file.loc[i, "Comments"] = self.comment_entry.get()
+            self.review.non_match_remaining(comment)
 
     def go_back(self):
         """
-        A function that goes back to the previous record.
+        A function that goes back to the previous record, undoing the last
+        decision made (each press undoes one more).
 
         Returns
         -------
         None.
 
         """
-        # get the number of decisions made in current cluster
-        num_decisions = self.current_num_cluster_decisions()
+        # undo the last decision; this moves to the cluster it was made in
+        if not self.review.undo():
+            # no decisions made since the file was opened: go back a
+            # cluster IF there are no decisions in current cluster
+            if self.current_num_cluster_decisions() == 0:
+                self.review.back()
 
-        # update cluster_index IF there are no decisions in current cluster
-        if num_decisions == 0:
-            self.cluster_index -= 1
-            self.display_indexes = working_file.index[
-                working_file["cluster_sequential_number"] == self.cluster_index
-            ].to_list()
+            # reset new (previous record) to empty strings
+            self.review.clear()
 
-        # reset new (previous record) to empty strings
-        for i in self.display_indexes:
-            working_file.loc[i, "Match"] = ""
-            working_file.loc[i, "Comments"] = ""
+        self.display_indexes = self.get_display_indexes()
 
         # clean the match string
         self.match_string = ""
 
-        # clear list of not matched yet
-        self.not_matched_yet.clear()
-
         # spdate the gui
         self.update_gui(config, working_file)
 
@@ -744,6 +890,32 @@ class ClericalApp:
         except AttributeError:
             pass
 
+    def redo(self):
+        """
+        A function that makes the last decision undone by the back button again,
+        moving on to the next cluster if it completed its cluster.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not self.review.redo():
+            return
+
+        # clean the match string
+        self.match_string = ""
+
+        if self.review.is_cluster_done():
+            self.review.advance()
+        self.display_indexes = self.get_display_indexes()
+        self.len_current_cluster = len(self.display_indexes)
+        self.tags_container = {}
+
+        # Check if reached the end of the script
+        if not self.check_matching_done():
+            self.update_gui(config, working_file)
+
     def check_matching_done(self):
         """
         This function checks if the number of iterations is greater than the number of
@@ -787,15 +959,17 @@ class ClericalApp:
 
         """
         try:
+            # wait for any checkpoint being saved before renaming the file
+            self.checkpoints.flush()
             # Check whether matching has now finished (i.e. they have completed all records)
             if self.cluster_index == (self.num_clusters):
                 # if matching is now complete rename the file
                 os.rename(self.filename_old, self.filename_done)
-                working_file.to_csv(self.filename_done, index=False)
+                self.save(self.filename_done)
 
             else:
                 # If not it yet finished save it using the old file name
-                working_file.to_csv(self.filename_old, index=False)
+                self.save(self.filename_old)
 
             # close down the app
             root.destroy()
@@ -962,9 +1136,6 @@ class ClericalApp:
         # reset match string so different pairings can be made in that cluster
         self.match_string = ""
 
-        # clear the list of records in cluster remaining unmatched
-        self.not_matched_yet.clear()
-
         # if match button has been clicked and there are still unmatched records in cluster
         if (
             len(self.display_indexes) > self.current_num_cluster_decisions()
@@ -975,15 +1146,18 @@ class ClericalApp:
         # if no more matches can be made in cluster OR no more matches button is clicked
         else:
             # update the cluster_index and display indexes to reference the new cluster
-            self.cluster_index += 1
-            self.display_indexes = working_file.index[
-                working_file["cluster_sequential_number"] == self.cluster_index
-            ].to_list()
+            self.review.advance()
+            self.display_indexes = self.get_display_indexes()
             self.len_current_cluster = len(self.display_indexes)
 
             stp_gui = self.check_matching_done()
             self.tags_container = {}
 
+            # save a checkpoint every num_records_checkpoint clusters
+            if not stp_gui and self.cluster_index % self.records_per_checkpoint == 0:
+                self.save_checkpoint(self.filename_old)
+                self.checkpointcounter += 1
+
             # Check if reached the end of the script
             if stp_gui:
                 pass
@@ -1029,12 +1203,15 @@ class ClericalApp:
         if tkinter.messagebox.askyesno(
             "Exit", "Are you sure you want to exit WITHOUT saving?"
         ):
+            # let any checkpoint being saved finish before renaming the file
+            self.checkpoints.flush()
             # check if this is the first time they are accessing it
             if not self.matching_previously_began & self.checkpointcounter == 0:
                 # then rename the file removing their initial and 'inProgress' tag
                 os.rename(
                     self.filename_old,
-                    "_".join(self.filename_old.split("_")[0:-2]) + ".csv",
+                    "_".join(self.filename_old.split("_")[0:-2])
+                    + os.path.splitext(self.filename_old)[1],
                 )
 
             # close down the application
@@ -1057,7 +1234,7 @@ if __name__ == "__main__":
     initdir = config["matching_files_details"]["file_pathway"]
 
     # specify file types - this will only show these files when the dialog box opens up
-    filetypes = (("csv files", "*.csv"),)
+    filetypes = FILE_TYPES
 
     # grab user credentials
     user = getpass.getuser()
@@ -1129,9 +1306,17 @@ if __name__ == "__main__":
             message="This clerical sample is open in another program. Please close this and restart CROW."
         )
 
-    # ---- load in the required csv file as a pandas dataframe (can also do this for excel docs...)
+    # ---- load in the columns used of the csv, parquet or arrow file as a pandas dataframe
     try:
-        working_file = pd.read_csv(renamed_file)
+        used_columns = get_used_columns(config)
+        working_file = read_file(
+            renamed_file,
+            columns=[
+                column
+                for column in file_columns(renamed_file)
+                if column in used_columns
+            ],
+        )
 
     except FileNotFoundError or NameError:
         sys.exit(
@@ -1140,22 +1325,15 @@ if __name__ == "__main__":
 
     # data validation step
 
-    record_id = config["record_id_col"]["record_id"]
-
-    working_file["duplicated_record"] = np.where(
-        working_file[record_id].duplicated(), 1, 0
+    # (the same checks as coordinator/prepare_files.py, which can check a
+    # folder of files before they are handed out)
+    problems = check_clerical_file(
+        working_file,
+        config["record_id_col"]["record_id"],
+        config["cluster_id_number"]["cluster_id"],
     )
-
-    duplicates = working_file[working_file["duplicated_record"] == 1][
-        record_id
-    ].tolist()
-
-    if len(working_file) != len(working_file[record_id].unique()):
-        raise ValueError(f"the record ID(s): {duplicates} is not unique!")
-
-    del (record_id, duplicates)
-
-    working_file = working_file.drop(columns="duplicated_record")
+    if problems:
+        raise ValueError(f"{renamed_file}: {'; '.join(problems)}")
 
     # END OF STEP 2
 
@@ -1166,6 +1344,7 @@ if __name__ == "__main__":
     mainWindow = ClericalApp(root, working_file, filepath_done, renamed_file, config)
     root.mainloop()
 
+    working_file = mainWindow.review.to_frame()
     print(
         "\n Number of records matched:",
         str(
@@ -13,15 +13,63 @@ forget to save this file as read-only.
 
 import configparser
 import getpass
+import sys
 import tkinter as tk
 from pathlib import Path
 from tkinter import filedialog, messagebox, ttk
 
 import pandas as pd
 
+# The review engine shared with CROW2 lives in crow_core, next to this
+# folder.
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import (  # noqa: E402
+    CROW1_PAIRWISE_FORMAT,
+    FILE_TYPES,
+    CheckpointWriter,
+    Progress,
+    ReviewSession,
+    auto_resolve,
+    encode_categories,
+    file_columns,
+    parse_order,
+    parse_rules,
+    prioritise,
+    progress_metadata,
+    read_file,
+    write_file,
+)
+
+
+def get_used_columns(config: configparser.ConfigParser) -> list:
+    """Get the columns of the clerical file the application uses.
+
+    These are the columns displayed, the column the review order is
+    taken from and the decision columns; the others are left on disk
+    and joined back on at save.
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        The configuration file.
+
+    Returns
+    -------
+    list
+        The column names.
+    """
+    used = [
+        config["column_file_info_and_order"][column_file_title]
+        .replace(" ", "")
+        .split(",")[0]
+        for column_file_title in config.options("column_file_info_and_order")
+    ]
+    used.append(config.get("review_order", "column", fallback="").strip())
+    return used + CROW1_PAIRWISE_FORMAT.decision_columns()
+
 
 class IntroWindow(tk.Tk):
-    """The window that prompts the user to choose a CSV file."""
+    """The window that prompts the user to choose a clerical file."""
 
     def __init__(self, initial_directory: str) -> None:
         """Initialise the IntroWindow class."""
@@ -32,7 +80,7 @@ class IntroWindow(tk.Tk):
 
         # Initialise some variables.
         self.initial_directory = initial_directory
-        self.csv_path = None
+        self.file_path = None
 
         # Create the frame to hold the introductory message and the file
         # choice button.
@@ -44,25 +92,25 @@ class IntroWindow(tk.Tk):
             self.intro_frame,
             text=(
                 "Welcome to the clerical matching application.\n"
-                'Please click "open CSV file" below to select a\n'
-                "CSV file and begin clerically reviewing."
+                'Please click "open file" below to select a CSV,\n'
+                "parquet or Arrow file and begin clerically reviewing."
             ),
         )
         self.intro_text.pack(padx=20, pady=20)
 
         # Create the file choice button and pack it into the frame.
-        self.open_csv_button = ttk.Button(
-            self.intro_frame, text="open CSV file", command=self.open_csv_file
+        self.open_file_button = ttk.Button(
+            self.intro_frame, text="open file", command=self.open_file
         )
-        self.open_csv_button.pack(pady=(0, 20), ipadx=15)
+        self.open_file_button.pack(pady=(0, 20), ipadx=15)
 
-    def open_csv_file(self) -> None:
+    def open_file(self) -> None:
         """Open a file dialog window and close the intro window."""
-        csv_path = filedialog.askopenfilename(
-            initialdir=self.initial_directory, filetypes=[("CSV files", "*.csv")]
+        file_path = filedialog.askopenfilename(
+            initialdir=self.initial_directory, filetypes=FILE_TYPES
         )
-        if csv_path:
-            self.csv_path = csv_path
+        if file_path:
+            self.file_path = file_path
 
         # Close down IntroWindow.
         self.destroy()
@@ -110,8 +158,10 @@ class ClericalApp(tk.Tk):
         self.working_file = working_file
         self.num_records = len(working_file)
 
-        # Initialise checkpoint counter.
+        # Initialise checkpoint counter, and the background thread the
+        # checkpoints are saved on so the window does not freeze.
         self.checkpoint_counter = 0
+        self.checkpoints = CheckpointWriter(self.write_checkpoint)
 
         # Initialise text variables.
         self.text_size = 10
@@ -133,6 +183,24 @@ class ClericalApp(tk.Tk):
         # Add the columns necessary for clerical review.
         self.add_review_columns()
 
+        # The review engine holds the match decisions and the index of
+        # the record pair under review. Each record pair is reviewed on
+        # its own, so is identified by its row position.
+        decision_format = CROW1_PAIRWISE_FORMAT
+        if not int(config["custom_settings"]["comment_box"]):
+            decision_format = decision_format._replace(comment_col=None)
+        self.review = ReviewSession(working_file, None, None, decision_format)
+
+        # Decide the record pairs that need no clerical review, if
+        # specified, put the rest in order of priority, if specified,
+        # and count the record pairs left to review.
+        self.auto_resolve_pairs()
+        self.order_pairs()
+        self.num_records = self.review.queue_length
+        if self.num_records == 0:
+            self.finish_without_review()
+            return
+
         # Initiate the starting index so that it will go from latest
         # record counter variable for iterating through the CSV file.
         self.record_index = self.get_starting_index()
@@ -144,6 +212,153 @@ class ClericalApp(tk.Tk):
         self.draw_tool_frame()
         self.draw_record_frame()
         self.draw_button_frame()
+        self.update_save_status()
+
+    @property
+    def record_index(self) -> int:
+        """The index of the record pair under review."""
+        return self.review.index
+
+    @record_index.setter
+    def record_index(self, value: int) -> None:
+        self.review.index = value
+
+    @property
+    def record_row(self) -> int:
+        """The row of the record pair under review in the working file."""
+        return self.review.cluster
+
+    def auto_resolve_pairs(self) -> None:
+        """Decide the record pairs that need no clerical review.
+
+        Uses the rules in the [auto_resolution] section of the
+        configuration file, if there is one. The record pairs decided
+        are not shown to the reviewer, and the file is saved so that
+        the decisions are kept.
+        """
+        rules = parse_rules(config.get("auto_resolution", "rules", fallback=""))
+        if not rules:
+            return
+
+        # The columns to compare, by column header; default to all.
+        headers = [
+            header.strip()
+            for header in config.get("auto_resolution", "columns", fallback="").split(
+                ","
+            )
+            if header.strip()
+        ]
+        orders = {}
+        for column_title in config.options("column_headers_and_order"):
+            header, order = (
+                config["column_headers_and_order"][column_title]
+                .replace(" ", "")
+                .split(",")
+            )
+            if not headers or header in headers:
+                orders[order] = []
+
+        # Pair up the columns of each record with the same order.
+        for column_file_title in config.options("column_file_info_and_order"):
+            column, _, order = (
+                config["column_file_info_and_order"][column_file_title]
+                .replace(" ", "")
+                .split(",")
+            )
+            if order in orders:
+                orders[order].append(column)
+        column_pairs = [
+            (columns[0], columns[1]) for columns in orders.values() if len(columns) == 2
+        ]
+
+        counts = auto_resolve(self.review, column_pairs=column_pairs, rules=rules)
+        print("\n Record pairs decided automatically:", counts)
+        if any(counts.values()):
+            self.save(self.filename_old)
+            self.checkpoint_counter += 1
+
+    def order_pairs(self) -> None:
+        """Put the record pairs to review in order of priority.
+
+        Uses the order in the [review_order] section of the
+        configuration file, if there is one, e.g. the most uncertain
+        match scores first; otherwise the order of the file.
+        """
+        order = parse_order(config.get("review_order", "order", fallback=""))
+        if order == "file":
+            return
+        column = config.get("review_order", "column", fallback="").strip() or None
+        threshold = float(config.get("review_order", "threshold", fallback="0.5"))
+        prioritise(self.review, order, column, threshold)
+
+    def save(self, filename: str) -> None:
+        """Save the decisions to a file, once any checkpoint is saved.
+
+        The decisions are joined back on, by row, to the columns that
+        were not loaded.
+
+        Parameters
+        ----------
+        filename : str
+            The file to save to.
+        """
+        self.checkpoints.flush()
+        self.write_checkpoint(self.review.snapshot(), filename, self.review.progress())
+
+    def save_checkpoint(self, filename: str) -> None:
+        """Save a copy of the decisions so far to a file, in the background.
+
+        Parameters
+        ----------
+        filename : str
+            The file to save to.
+        """
+        self.checkpoints.submit(
+            self.review.snapshot(), filename, self.review.progress()
+        )
+
+    def write_checkpoint(
+        self,
+        decisions: pd.DataFrame,
+        filename: str,
+        progress: Progress | None = None,
+    ) -> None:
+        """Write decisions to a file, joined on to the columns not loaded.
+
+        Parameters
+        ----------
+        decisions : pd.DataFrame
+            The decision columns, from ReviewSession.snapshot.
+        filename : str
+            The file to save to.
+        progress : Progress, optional
+            From ReviewSession.progress, taken with the snapshot; written
+            into the file's metadata, for coordinator/progress.py.
+        """
+        write_file(
+            decisions,
+            filename,
+            source=filename,
+            columns=self.review.decision_columns,
+            metadata=None
+            if progress is None
+            else progress_metadata(progress, getpass.getuser()),
+        )
+
+    def update_save_status(self) -> None:
+        """Show whether a checkpoint is being saved, and check again soon."""
+        self.save_status.configure(text=self.checkpoints.status)
+        self.after(500, self.update_save_status)
+
+    def finish_without_review(self) -> None:
+        """Save the file as DONE when every record pair was decided automatically."""
+        Path(self.filename_old).rename(self.filename_done)
+        self.save(self.filename_done)
+        messagebox.showinfo(
+            title="Matching completed",
+            message="Every record pair was decided automatically.",
+        )
+        self.after(0, self.destroy)
 
     def on_exit(self) -> None:
         """Ask the user if they want to exit without saving."""
@@ -151,12 +366,16 @@ class ClericalApp(tk.Tk):
         if messagebox.askyesno(
             title="Exit", message="Are you sure you want to exit WITHOUT saving?"
         ):
+            # Let any checkpoint being saved finish before renaming.
+            self.checkpoints.flush()
+
             # Check if this is the first time they are accessing it.
             if not self.matching_previously_began and self.checkpoint_counter == 0:
                 # Then rename the file removing their initial and
                 # 'inProgress' tag.
                 Path(self.filename_old).rename(
-                    "_".join(self.filename_old.split("_")[0:-2]) + ".csv"
+                    "_".join(self.filename_old.split("_")[0:-2])
+                    + Path(self.filename_old).suffix
                 )
 
             # Close the application.
@@ -169,18 +388,7 @@ class ClericalApp(tk.Tk):
         if {"match"}.issubset(self.working_file.columns):
             # Convert all columns apart from "match" and "comments" (if
             # specified) to string.
-            for col_header in self.working_file.columns:
-                if col_header in ("match", "comments"):
-                    pass
-                else:
-                    # Convert to string.
-                    self.working_file[col_header] = self.working_file[
-                        col_header
-                    ].astype(str)
-                    # Remove nan values.
-                    for i in range(len(self.working_file)):
-                        if self.working_file[col_header][i] == "nan":
-                            self.working_file.at[i, col_header] = ""
+            self.text_columns()
 
             self.working_file.fillna("", inplace=True)
 
@@ -196,30 +404,37 @@ class ClericalApp(tk.Tk):
 
             # Convert all columns apart from "match" and "comments" (if
             # specified) to string.
-            for col_header in self.working_file.columns:
-                if col_header in ("match", "comments"):
-                    pass
-                else:
-                    # Convert to string.
-                    self.working_file[col_header] = self.working_file[
-                        col_header
-                    ].astype(str)
-                    # Remove nan values.
-                    for i in range(len(self.working_file)):
-                        if self.working_file[col_header][i] == "nan":
-                            self.working_file.at[i, col_header] = ""
+            self.text_columns()
 
             self.working_file.fillna("", inplace=True)
 
             self.matching_previously_began = 0
 
+    def text_columns(self) -> None:
+        """Convert all columns apart from "match" and "comments" to string.
+
+        Columns with few distinct values (e.g. the dataset names or sex)
+        are stored as categories, each value once; the rest as strings.
+        Missing values are blank.
+        """
+        text_columns = [
+            col_header
+            for col_header in self.working_file.columns
+            if col_header not in ("match", "comments")
+        ]
+        encoded = encode_categories(self.working_file, text_columns, missing="")
+        for col_header in text_columns:
+            if col_header not in encoded:
+                self.working_file[col_header] = (
+                    self.working_file[col_header].astype(str).replace("nan", "")
+                )
+
     def get_starting_index(self) -> int:
         """Get the index of the first unreviewed record pair.
 
-        Scan the 'match' column of the working file and return the index
-        of the first record pair that has not yet been reviewed (i.e.
-        the value is not 0 or 1). If all record pairs have been
-        reviewed, return the index of the last row.
+        Return the index of the first record pair that has not yet been
+        reviewed (i.e. has no value in the 'match' column). If all record
+        pairs have been reviewed, return the index of the last row.
 
         Returns
         -------
@@ -227,19 +442,14 @@ class ClericalApp(tk.Tk):
             The index of the first unreviewed record pair, or the last
             index if all are reviewed.
         """
-        # Get the index of the 'match' column.
-        column_index = -2 if int(config["custom_settings"]["comment_box"]) else -1
-
-        # Cycle through the 'match' column to find the first record pair
-        # that has not been reviewed.
-        for index in range(self.num_records):
-            match_value = working_file.iloc[index, column_index]
-            if match_value not in (1, 0):
-                return index
+        # Find the first record pair that has not been reviewed.
+        index = self.review.first_undecided()
 
         # If no unreviewed record pairs are found, return the last
         # index.
-        return self.num_records - 1
+        if index is None:
+            return self.num_records - 1
+        return index
 
     def draw_tool_frame(self) -> None:
         """Draw the tool_frame."""
@@ -303,6 +513,11 @@ class ClericalApp(tk.Tk):
             command=self.save_and_close,
         )
         self.save_button.grid(row=0, column=8, columnspan=1, sticky="e", padx=5, pady=5)
+        # Whether a checkpoint is being saved.
+        self.save_status = ttk.Label(
+            self.tool_frame, text=self.checkpoints.status, foreground="grey"
+        )
+        self.save_status.grid(row=0, column=9, sticky="w", padx=5, pady=5)
 
     def draw_record_frame(self) -> None:
         """Draw the record frame."""
@@ -421,12 +636,12 @@ class ClericalApp(tk.Tk):
             )
             # Enter in the text from the df.
             exec(
-                f'self.{col_header[0]}.insert("1.0", working_file["{col_header[0]}"][self.record_index])'
+                f'self.{col_header[0]}.insert("1.0", working_file["{col_header[0]}"][self.record_row])'
             )
             # Configure Text so that it is a specified width, font and
             # can't be interacted with.
             exec(
-                f'self.{col_header[0]}.config(width=len(working_file["{col_header[0]}"][self.record_index])+10, font=f"Helvetica {self.text_size} {self.text_bold}", state="disabled")'
+                f'self.{col_header[0]}.config(width=len(working_file["{col_header[0]}"][self.record_row])+10, font=f"Helvetica {self.text_size} {self.text_bold}", state="disabled")'
             )
 
             # Cycle through each dataset name to know which row to put
@@ -501,6 +716,27 @@ class ClericalApp(tk.Tk):
         )
         self.back_button.grid(row=0, column=2, columnspan=1, padx=15, pady=10)
 
+        # Undo and Redo buttons, for the decisions made since the file was
+        # opened.
+        self.undo_button = tk.Button(
+            self.button_frame,
+            text="Undo",
+            font=f"Helvetica {self.text_size}",
+            command=self.undo,
+        )
+        self.undo_button.grid(row=0, column=3, columnspan=1, padx=15, pady=10)
+        if not self.review.can_undo:
+            self.undo_button.configure(state="disabled")
+        self.redo_button = tk.Button(
+            self.button_frame,
+            text="Redo",
+            font=f"Helvetica {self.text_size}",
+            command=self.redo,
+        )
+        self.redo_button.grid(row=0, column=4, columnspan=1, padx=15, pady=10)
+        if not self.review.can_redo:
+            self.redo_button.configure(state="disabled")
+
         # Add in the comment widget based on config option.
         if int(config["custom_settings"]["comment_box"]):
             # Create comments column if one doesn't exist.
@@ -560,10 +796,8 @@ class ClericalApp(tk.Tk):
                     # For each character between the first row label and
                     # the rows underneath it.
                     for char_comparison, char_highlight in zip(
-                        working_file[self.data_row_to_compare[key][0]][
-                            self.record_index
-                        ],
-                        working_file[f"{vals}"][self.record_index],
+                        working_file[self.data_row_to_compare[key][0]][self.record_row],
+                        working_file[f"{vals}"][self.record_row],
                     ):
                         # If the comparison char is not the same as the
                         # highlighter char.
@@ -580,11 +814,11 @@ class ClericalApp(tk.Tk):
                             if count == min(
                                 len(
                                     working_file[self.data_row_to_compare[key][0]][
-                                        self.record_index
+                                        self.record_row
                                     ]
                                 )
                                 - 1,
-                                len(working_file[f"{vals}"][self.record_index]) - 1,
+                                len(working_file[f"{vals}"][self.record_row]) - 1,
                             ):
                                 container.append(count + 1)
                                 # Pass this start and end values to the
@@ -611,18 +845,16 @@ class ClericalApp(tk.Tk):
                     # If length of the comparator is less highlighter
                     # make it yellow as well.
                     if len(
-                        working_file[self.data_row_to_compare[key][0]][
-                            self.record_index
-                        ]
-                    ) < len(working_file[f"{vals}"][self.record_index]):
+                        working_file[self.data_row_to_compare[key][0]][self.record_row]
+                    ) < len(working_file[f"{vals}"][self.record_row]):
                         char_consistent.append(
                             [
                                 len(
                                     working_file[self.data_row_to_compare[key][0]][
-                                        self.record_index
+                                        self.record_row
                                     ]
                                 ),
-                                len(working_file[f"{vals}"][self.record_index]),
+                                len(working_file[f"{vals}"][self.record_row]),
                             ]
                         )
 
@@ -721,10 +953,14 @@ class ClericalApp(tk.Tk):
         match_res : int - boolean.
             Adds a 1 or a 0 in the column.
         """
-        working_file.at[self.record_index, "match"] = match_res
-
+        comment = None
         if int(config["custom_settings"]["comment_box"]):
-            working_file.at[self.record_index, "comments"] = self.comment_entry.get()
+            comment = self.comment_entry.get()
+
+        if match_res:
+            self.review.match_records([self.record_row], comment)
+        else:
+            self.review.non_match_records([self.record_row], comment)
 
     def save_at_checkpoint(self) -> None:
         """Backup the data at a given interval.
@@ -737,8 +973,8 @@ class ClericalApp(tk.Tk):
         if (self.record_index % self.records_per_checkpoint == 0) and (
             self.record_index < self.num_records
         ):
-            # Checkpoint it by saving it.
-            working_file.to_csv(self.filename_old, index=False)
+            # Checkpoint it by saving it, in the background.
+            self.save_checkpoint(self.filename_old)
             # Increase checkpoint counter.
             self.checkpoint_counter += 1
 
@@ -747,9 +983,10 @@ class ClericalApp(tk.Tk):
         elif (self.record_index % self.records_per_checkpoint == 0) and (
             self.record_index == self.num_records
         ):
-            # Save it as DONE.
+            # Save it as DONE, once the last checkpoint is saved.
+            self.checkpoints.flush()
             Path(self.filename_old).rename(self.filename_done)
-            working_file.to_csv(self.filename_done, index=False)
+            self.save_checkpoint(self.filename_done)
             self.checkpoint_counter += 1
 
     def check_matching_done(self) -> int:
@@ -782,20 +1019,24 @@ class ClericalApp(tk.Tk):
         return 0
 
     def save_and_close(self) -> None:
-        """Save the DataFrame and close the window."""
+        """Save the DataFrame and close the window.
+
+        Waits for any checkpoint being saved in the background first.
+        """
+        self.checkpoints.flush()
         # Check whether matching has now finished (i.e. they have
         # completed all records).
         if self.record_index == (self.num_records):
             # If matching is now complete rename the file.
             if self.num_records % self.records_per_checkpoint != 0:
                 Path(self.filename_old).rename(self.filename_done)
-                working_file.to_csv(self.filename_done, index=False)
+                self.save(self.filename_done)
             elif self.num_records % self.records_per_checkpoint == 0:
-                working_file.to_csv(self.filename_done, index=False)
+                self.save(self.filename_done)
 
         else:
             # If not it yet finished save it using the old file name.
-            working_file.to_csv(self.filename_old, index=False)
+            self.save(self.filename_old)
 
         # Close down the app.
         self.destroy()
@@ -834,21 +1075,14 @@ class ClericalApp(tk.Tk):
             self.update_gui()
 
     def go_back(self) -> None:
-        """Go back to the previous record pair."""
+        """Go back to the previous record pair, keeping its decision."""
         # If they have reached the end of matching.
         if self.record_index == self.num_records:
-            # Take away the "Matching Finished" message.
-            self.match_done.grid_forget()
-            # Reactivate the buttons.
-            self.match_button.configure(state="normal")
-            self.non_match_button.configure(state="normal")
+            self.reopen()
             # Update the record_index.
             self.record_index = self.record_index - 1
             # Update the overall GUI.
             self.update_gui()
-            # Rename the file back to in progress.
-            if self.num_records % self.records_per_checkpoint == 0:
-                Path(self.filename_done).rename(self.filename_old)
         # If they are part way through matching.
         elif self.record_index > 0:
             # Update the record_index.
@@ -858,6 +1092,42 @@ class ClericalApp(tk.Tk):
         elif self.record_index == 0:
             pass
 
+    def reopen(self) -> None:
+        """Leave the end of matching, to go back to a record pair."""
+        # Take away the "Matching Finished" message.
+        self.match_done.grid_forget()
+        # Reactivate the buttons.
+        self.match_button.configure(state="normal")
+        self.non_match_button.configure(state="normal")
+        # Rename the file back to in progress.
+        if self.num_records % self.records_per_checkpoint == 0:
+            self.checkpoints.flush()
+            Path(self.filename_done).rename(self.filename_old)
+
+    def undo(self) -> None:
+        """Undo the last decision made and go back to its record pair."""
+        at_end = self.record_index == self.num_records
+        if not self.review.undo():
+            return
+        if at_end:
+            self.reopen()
+        self.update_gui()
+
+    def redo(self) -> None:
+        """Redo the last decision undone with the undo button."""
+        if not self.review.redo():
+            return
+
+        # Move on from the record pair, as when the decision was made.
+        self.record_index += 1
+
+        # Check if at checkpoint.
+        self.save_at_checkpoint()
+
+        # Update the GUI labels, unless that was the last record pair.
+        if not self.check_matching_done():
+            self.update_gui()
+
     def change_text_size(self, size_change: int) -> None:
         """Increase or decrease the size of the text.
 
@@ -896,42 +1166,42 @@ if __name__ == "__main__":
     intro_window = IntroWindow(initial_directory)
     intro_window.mainloop()
 
-    if intro_window.csv_path:
+    if intro_window.file_path:
         # Check if the user running it has selected this file before (this
         # means they have done some of the matching already and are coming
         # back to it).
-        if "inProgress" in intro_window.csv_path.split("/")[-1]:
+        if "inProgress" in intro_window.file_path.split("/")[-1]:
             # If it is the same user.
-            if user in intro_window.csv_path.split("/")[-1]:
+            if user in intro_window.file_path.split("/")[-1]:
                 # Do not rename the file.
-                renamed_file = intro_window.csv_path
+                renamed_file = intro_window.file_path
 
                 # Create the filepath name for when the file is finished.
                 filepath_done = f"{'/'.join(renamed_file.split('/')[:-1])}/{renamed_file.split('/')[-1][0:-15]}_DONE.{renamed_file.split('/')[-1].split('.')[-1]}"
 
             else:
                 # Rename the file to contain the additional user.
-                renamed_file = f"{'/'.join(intro_window.csv_path.split('/')[:-1])}/{intro_window.csv_path.split('/')[-1].split('.')[0][0:-11]}_{user}_inProgress.{intro_window.csv_path.split('/')[-1].split('.')[-1]}"
-                Path(rf"{intro_window.csv_path}").rename(rf"{renamed_file}")
+                renamed_file = f"{'/'.join(intro_window.file_path.split('/')[:-1])}/{intro_window.file_path.split('/')[-1].split('.')[0][0:-11]}_{user}_inProgress.{intro_window.file_path.split('/')[-1].split('.')[-1]}"
+                Path(rf"{intro_window.file_path}").rename(rf"{renamed_file}")
 
                 # Create the filepath name for when the file is finished.
                 filepath_done = f"{'/'.join(renamed_file.split('/')[:-1])}/{renamed_file.split('/')[-1][0:-15]}_DONE.{renamed_file.split('/')[-1].split('.')[-1]}"
 
         # If a user is picking this file again and it is done.
-        elif "DONE" in intro_window.csv_path.split("/")[-1]:
+        elif "DONE" in intro_window.file_path.split("/")[-1]:
             # If it is the same user.
-            if user in intro_window.csv_path.split("/")[-1]:
+            if user in intro_window.file_path.split("/")[-1]:
                 # Do not change filepath done - keep it as it is.
-                filepath_done = intro_window.csv_path
+                filepath_done = intro_window.file_path
 
                 # Rename the file.
-                renamed_file = f"{'/'.join(intro_window.csv_path.split('/')[:-1])}/{intro_window.csv_path.split('/')[-1][0:-9]}_inProgress.{intro_window.csv_path.split('/')[-1].split('.')[-1]}"
-                Path(rf"{intro_window.csv_path}").rename(rf"{renamed_file}")
+                renamed_file = f"{'/'.join(intro_window.file_path.split('/')[:-1])}/{intro_window.file_path.split('/')[-1][0:-9]}_inProgress.{intro_window.file_path.split('/')[-1].split('.')[-1]}"
+                Path(rf"{intro_window.file_path}").rename(rf"{renamed_file}")
             else:
                 # If it is a different user: Rename the file to include the
                 # additional user.
-                renamed_file = f"{'/'.join(intro_window.csv_path.split('/')[:-1])}/{intro_window.csv_path.split('/')[-1].split('.')[0][0:-5]}_{user}_inProgress.{intro_window.csv_path.split('/')[-1].split('.')[-1]}"
-                Path(rf"{intro_window.csv_path}").rename(rf"{renamed_file}")
+                renamed_file = f"{'/'.join(intro_window.file_path.split('/')[:-1])}/{intro_window.file_path.split('/')[-1].split('.')[0][0:-5]}_{user}_inProgress.{intro_window.file_path.split('/')[-1].split('.')[-1]}"
+                Path(rf"{intro_window.file_path}").rename(rf"{renamed_file}")
 
                 # Create the filepath done.
                 filepath_done = f"{'/'.join(renamed_file.split('/')[:-1])}/{renamed_file.split('/')[-1][0:-15]}_DONE.{renamed_file.split('/')[-1].split('.')[-1]}"
@@ -940,19 +1210,29 @@ if __name__ == "__main__":
             # Resave this file with the user ID at the end so no one else
             # selects it rename it with '_inProgress' and their entered
             # initials.
-            renamed_file = f"{'/'.join(intro_window.csv_path.split('/')[:-1])}/{intro_window.csv_path.split('/')[-1].split('.')[0]}_{user}_inProgress.{intro_window.csv_path.split('/')[-1].split('.')[-1]}"
-            Path(rf"{intro_window.csv_path}").rename(rf"{renamed_file}")
+            renamed_file = f"{'/'.join(intro_window.file_path.split('/')[:-1])}/{intro_window.file_path.split('/')[-1].split('.')[0]}_{user}_inProgress.{intro_window.file_path.split('/')[-1].split('.')[-1]}"
+            Path(rf"{intro_window.file_path}").rename(rf"{renamed_file}")
 
             # Create the filepath name for when the file is finished.
             filepath_done = f"{'/'.join(renamed_file.split('/')[:-1])}/{renamed_file.split('/')[-1][0:-15]}_DONE.{renamed_file.split('/')[-1].split('.')[-1]}"
 
-        # Load in the required csv file as a pandas DataFrame.
-        working_file = pd.read_csv(renamed_file)
+        # Load in the columns used of the csv, parquet or arrow file as a
+        # pandas DataFrame.
+        used_columns = get_used_columns(config)
+        working_file = read_file(
+            renamed_file,
+            columns=[
+                column
+                for column in file_columns(renamed_file)
+                if column in used_columns
+            ],
+        )
 
         # Run the clerical matching app.
         app = ClericalApp(working_file, filepath_done, renamed_file, config)
         app.mainloop()
 
+        working_file = app.review.to_frame()
         print(
             "\n Number of records matched:",
             str(len(working_file[working_file.match != ""])),
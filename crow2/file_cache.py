@@ -0,0 +1,175 @@
+"""
+A local cache of the files downloaded from hdfs.
+
+Each download is kept in the cache folder under a key made from its hdfs
+path, size and modification time, so opening a file that has not changed
+since it was last downloaded (by anyone on this machine, or before a
+restart) skips the download; a changed file gets a new key and is
+downloaded again.
+
+The cache has a size budget. Each use of an entry updates its modification
+time, and when a download takes the cache over budget the least recently
+used entries are removed. Sessions are given hard links to the cached files
+rather than the entries themselves, so removing an entry never pulls a file
+from under a session that is using it. Downloads are made to a temporary
+name and renamed into place, so two processes downloading the same file at
+once each end up with a complete entry.
+
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+
+
+def cache_key(remote_path, size, modified):
+    """
+    A function to get the cache key of a version of a remote file.
+
+    Parameters: remote_path - the hdfs path (String)
+                size - the size of the file, in bytes (Int)
+                modified - the modification time of the file (Int)
+    Returns: key (String)
+    """
+    version = f"{remote_path}\n{size}\n{modified}"
+    return hashlib.sha256(version.encode()).hexdigest()
+
+
+def entry_size(path):
+    """
+    A function to get the size on disk of a cache entry (file or folder).
+
+    Parameters: path (String)
+    Returns: size, in bytes (Int)
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(folder, name))
+        for folder, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def remove_entry(path):
+    """
+    A function to remove a cache entry (file or folder), if it still exists.
+
+    Parameters: path (String)
+    Returns: None
+    """
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        # removed by another process.
+        pass
+
+
+def evict(cache_folder, budget, keep=None):
+    """
+    A function to remove the least recently used entries until the cache is
+    within its budget.
+
+    Parameters: cache_folder (String)
+                budget - the size of the cache, in bytes (Int)
+                keep - an entry never to remove (String)
+    Returns: None
+    """
+    entries = []
+    for name in os.listdir(cache_folder):
+        path = os.path.join(cache_folder, name)
+        # skip downloads in progress.
+        if name.startswith("."):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), entry_size(path), path))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        remove_entry(path)
+        total -= size
+
+
+def lookup(remote_path, size, modified, cache_folder):
+    """
+    A function to get the cache entry of a version of a remote file, and
+    mark it as used.
+
+    Parameters: remote_path - the hdfs path (String)
+                size - the size of the file, in bytes (Int)
+                modified - the modification time of the file (Int)
+                cache_folder (String)
+    Returns: path of the cache entry, or None if it is not cached (String)
+    """
+    path = os.path.join(cache_folder, cache_key(remote_path, size, modified))
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # not cached, or evicted by another process.
+        return None
+    return path
+
+
+def fetch(remote_path, size, modified, download, cache_folder, budget):
+    """
+    A function to get the cache entry of a remote file, downloading it if
+    this version of it is not in the cache.
+
+    Parameters: remote_path - the hdfs path (String)
+                size - the size of the file, in bytes (Int)
+                modified - the modification time of the file (Int)
+                download - called with a local path to download the file to
+                (Function)
+                cache_folder (String)
+                budget - the size of the cache, in bytes (Int)
+    Returns: path of the cache entry (String)
+             hit - whether the file was already in the cache (Boolean)
+    """
+    path = lookup(remote_path, size, modified, cache_folder)
+    if path is not None:
+        return path, True
+
+    os.makedirs(cache_folder, exist_ok=True)
+    path = os.path.join(cache_folder, cache_key(remote_path, size, modified))
+    temporary = os.path.join(cache_folder, f".{uuid.uuid4().hex}")
+    download(temporary)
+    if not os.path.exists(temporary):
+        raise FileNotFoundError(f"could not download {remote_path}")
+    try:
+        os.rename(temporary, path)
+    except OSError:
+        # another process downloaded it first; keep theirs.
+        remove_entry(temporary)
+    evict(cache_folder, budget, keep=path)
+    return path, False
+
+
+def link(path, destination):
+    """
+    A function to give a session its own hard links to the files of a cache
+    entry, copying them if hard links are not possible.
+
+    Parameters: path - the cache entry (String)
+                destination (String)
+    Returns: None
+    """
+
+    def link_file(source, target):
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+    if os.path.isdir(path):
+        shutil.copytree(path, destination, copy_function=link_file)
+    else:
+        link_file(path, destination)
@@ -6,16 +6,15 @@ This is the main script to run the application.
 import configparser
 import logging
 import os
-import re
-import shutil
-import subprocess
+import time
 from datetime import datetime
 from multiprocessing import Process
 
-from flask import Flask, render_template, request, session
+from flask import Flask, Response, abort, g, render_template, request, session
 from flask_session import Session
 
-import version2_flask.helper_functions as hf
+import helper_functions as hf
+import metrics
 
 start_time = datetime.now()
 
@@ -25,30 +24,9 @@ rec_id = config["id_variables"]["record_id"]
 clust_id = config["id_variables"]["cluster_id"]
 user = os.environ["HADOOP_USER_NAME"]
 
-# Setting up some files if not already done.
-# creating a tmp file
-temp_folder = f"{config['filespaces']['local_space']}"
-
-if not os.path.exists(temp_folder):
-    os.mkdir(temp_folder)
-
-# creating a user specific temp file within tmp.
-user_temp_folder = f"{config['filespaces']['local_space']}{user}"
-
-if not os.path.exists(user_temp_folder):
-    os.mkdir(user_temp_folder)
-
-# clear temp/user folder
-for filename in os.listdir(user_temp_folder):
-    file_path = os.path.join(user_temp_folder, filename)
-    try:
-        if os.path.isfile(file_path) or os.path.islink(file_path):
-            os.unlink(file_path)
-        elif os.path.isdir(file_path):
-            shutil.rmtree(file_path)
-    except FileNotFoundError:
-        print("temp folder does not exist or is empty")
-######################
+# NOTE: importing this module must not touch the filespace, so that WSGI
+# workers can import (or fork from) it cheaply. The tmp and user temp
+# folders are set up by the launcher; see run_app() below and wsgi.py.
 
 app = Flask(__name__)
 # generate a random string for key.
@@ -56,22 +34,53 @@ key2 = str(os.urandom(24))
 app.config["SECRET_KEY"] = key2
 app.config["SESSION_PERMANENT"] = False
 app.config["SESSION_TYPE"] = "filesystem"
-app.config["SESSION_FILE_DIR"] = f"{config['filespaces']['local_space']}{user}"
+app.config["SESSION_FILE_DIR"] = hf.get_user_temp_folder()
 logging.getLogger("werkzeug").disabled = True
 
 Session(app)
 
 
+@app.before_request
+def start_request_timer():
+    """
+    Records when the request started, for the request timing.
+    """
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    """
+    Records how long the request took, by endpoint.
+    """
+    if "request_start" in g:
+        metrics.observe(
+            "crow_request_seconds",
+            time.perf_counter() - g.request_start,
+            endpoint=str(request.endpoint),
+        )
+    return response
+
+
+# the templates rendered by the app; compiled up front by warm_templates().
+TEMPLATES = [
+    "welcome_page.html",
+    "new_session.html",
+    "cluster_version.html",
+    "pairwise_version.html",
+    "about_page.html",
+    "progress_page.html",
+]
+
+
 @app.route("/", methods=["GET", "POST"])
 def welcome_page():
     """
     This page acts as a menu for the user
     """
     session["font_choice"] = f"font-family:{request.form.get('font_choice')}"
-    session_keys = list(session)
-    for i in session_keys:
-        if i != "font_choice":
-            session.pop(i)
+    # the file open in this session, if any, is closed.
+    hf.clear_session()
     return render_template("welcome_page.html", font_choice=session["font_choice"])
 
 
@@ -82,22 +91,12 @@ def new_session():
     """
     # code to remove session variables except for font choice
     # this is to ensure if the page is returned to in the same session- variables are cleared
-    # to avoid conflicts/saving over wrong files.
-    session_keys = list(session)
-    for i in session_keys:
-        if i != "font_choice":
-            session.pop(i)
+    # to avoid conflicts/saving over wrong files. The file's review is dropped
+    # from memory too.
+    hf.clear_session()
 
     # using hadoop commands- get list of files in folder from hdfs
-    process = subprocess.Popen(
-        ["hadoop", "fs", "-ls", "-C", config["filespaces"]["hdfs_folder"]],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    std_out, std_error = process.communicate()
-    std_out2 = list(str(std_out).split("\\n"))
-    # fix for error where first file in the folder has b' due to hadoop commands
-    std_out2 = [re.sub(r"^b'", "", i) for i in std_out2]
+    std_out2 = hf.list_clerical_files(config["filespaces"]["hdfs_folder"])
     button = request.form.get("hdfs")
     config_status = request.form.get("config")
     version = request.form.get("version")
@@ -125,103 +124,113 @@ def index():
 
     # if file not opened in session before
     if "full_path" not in session:
-        (
-            local_file,
-            local_in_prog_path,
-            local_filepath_done,
-            hdfs_in_prog_path,
-            hdfs_filepath_done,
-        ) = hf.new_file_actions()
+        with metrics.timer("crow_cluster_version_phase_seconds", phase="load"):
+            (
+                review,
+                local_in_prog_path,
+                local_filepath_done,
+                hdfs_in_prog_path,
+                hdfs_filepath_done,
+            ) = hf.new_file_actions()
         # start the save thread to move in progress file back to hdfs.
-        s_thread = Process(
-            target=save_thread,
-            args=(
+        local_file = review.to_frame()
+        metrics.run_in_background(
+            save_thread,
+            (
                 local_in_prog_path,
                 hdfs_in_prog_path,
                 local_file,
                 local_filepath_done,
                 hdfs_filepath_done,
+                review.is_done(),
+                hf.get_changes(review, local_file, local_in_prog_path),
+                review.progress(),
             ),
         )
-        s_thread.start()
 
     # if file already opened in session
     else:
-        (
-            local_file,
-            local_in_prog_path,
-            local_filepath_done,
-            hdfs_in_prog_path,
-            hdfs_filepath_done,
-        ) = hf.reload_page()
+        with metrics.timer("crow_cluster_version_phase_seconds", phase="reload"):
+            (
+                review,
+                local_in_prog_path,
+                local_filepath_done,
+                hdfs_in_prog_path,
+                hdfs_filepath_done,
+            ) = hf.reload_page()
 
     ############ session variables and toggles#############
 
-    hf.set_session_variables(local_file)
-
-    ###if matching done.
-    if hf.check_matching_done(local_file):
-        local_file.to_parquet(local_filepath_done)
-    else:
-        local_file.to_parquet(local_in_prog_path)
+    hf.set_session_variables(review)
 
     ##############################Button Code###############################
     ##Code to control the actions on each button press.
     # if match button pressed; add the record Id's of the
     # selected records to the match column as an embedded list
 
-    match_error = ""
-    if request.form.get("Match") == "Match":
-        match_error = hf.make_match(local_file, match_error)
-        # save if at a backup_save checkpoint.
-    #        hf.backup_save(save_thread,local_in_prog_path,hdfs_in_prog_path,\
-    #                                              local_file, local_filepath_done,\
-    #                                              hdfs_filepath_done)
-
-    elif request.form.get("Non-Match") == "Non-Match":
-        hf.make_non_match(local_file)
-        # save if at a backup_save checkpoint.
-    #        hf.backup_save(save_thread,local_in_prog_path,hdfs_in_prog_path,\
-    #                                              local_file, local_filepath_done,\
-    #                                              hdfs_filepath_done)
-
-    # if Clear-Cluster pressed; replace the match column for cluster with '[]'
-    if request.form.get("Clear-Cluster") == "Clear-Cluster":
-        hf.clear_cluster(local_file)
-
-    # if back button pressed; set session['index'] back to move to previous cluster (Unless index=0)
+    with metrics.timer("crow_cluster_version_phase_seconds", phase="decision"):
+        match_error = ""
+        if request.form.get("Match") == "Match":
+            match_error = hf.make_match(review, match_error)
+            # save if at a backup_save checkpoint.
+        #        hf.backup_save(save_thread,local_in_prog_path,hdfs_in_prog_path,\
+        #                                              local_file, local_filepath_done,\
+        #                                              hdfs_filepath_done)
+
+        elif request.form.get("Non-Match") == "Non-Match":
+            hf.make_non_match(review)
+            # save if at a backup_save checkpoint.
+        #        hf.backup_save(save_thread,local_in_prog_path,hdfs_in_prog_path,\
+        #                                              local_file, local_filepath_done,\
+        #                                              hdfs_filepath_done)
+
+        # if Clear-Cluster pressed; replace the match column for cluster with '[]'
+        if request.form.get("Clear-Cluster") == "Clear-Cluster":
+            hf.clear_cluster(review)
+
+    # if back button pressed; move to previous cluster (Unless index=0)
     if request.form.get("back") == "back":
-        if int(session["index"]) > 0:
-            session["index"] = session["index"] - 1
+        review.back()
+
+    # if undo pressed; restore the last decision and move to its cluster
+    if request.form.get("undo") == "undo":
+        review.undo()
+
+    # if redo pressed; make the last undone decision again and move on
+    if request.form.get("redo") == "redo" and review.redo():
+        hf.advance_cluster(review)
+
+    # keep the local working set up to date with the decisions just made
+    with metrics.timer("crow_cluster_version_phase_seconds", phase="local_write"):
+        hf.write_working_changes(review, local_in_prog_path)
 
     # if save pressed...save file to hdfs
     if request.form.get("save") == "save":
-        s_thread = Process(
-            target=save_thread,
-            args=(
+        local_file = review.to_frame()
+        metrics.run_in_background(
+            save_thread,
+            (
                 local_in_prog_path,
                 hdfs_in_prog_path,
                 local_file,
                 local_filepath_done,
                 hdfs_filepath_done,
+                review.is_done(),
+                hf.get_changes(review, local_file, local_in_prog_path),
+                review.progress(),
             ),
         )
-        s_thread.start()
 
     # set select select all and highlighter toggles
     hf.reset_toggles()
 
     ####################Things to display code#########################
 
-    # extract a df dor the current cluster
-    data_f = local_file.loc[local_file["Sequential_Cluster_Id"] == session["index"]]
-
-    # select columns; split into column headers and data
-    # possible copy set warning place
+    # select columns of the current cluster; split into column headers and data
     display_cols_list = [
         config["display_columns"][i] for i in config["display_columns"]
     ] + ["Match", "Comment"]
-    df_display = data_f[display_cols_list].copy()
+    df_display = review.cluster_frame(display_cols_list)
     # extract a list of columns that are highlighted.
     # this is so that match, comment etc columns are not impacted by highlighter.
     highlight_cols = [config["display_columns"][i] for i in config["display_columns"]]
@@ -230,46 +239,179 @@ def index():
 
     ################HIGHLIGHTER###############
 
-    hf.highlighter_func(highlight_cols, df_display)
+    with metrics.timer("crow_cluster_version_phase_seconds", phase="highlight"):
+        hf.highlighter_func(highlight_cols, df_display)
     columns = df_display.columns
     data = df_display.values
 
     #############OTHER THINGS TO DISPLAY#######
 
     # get number of clusters and message to display.
-    num_clusters = str(local_file.Sequential_Cluster_Id.nunique())
+    num_clusters = str(review.queue_length)
     display_message = config["message_for_matchers"]["message_to_display"]
     id_col_index = df_display.columns.get_loc(rec_id)
-    # cast local_file back to json
-    session["working_file"] = local_file.to_json()
+    # keep the review for the next request
+    with metrics.timer("crow_cluster_version_phase_seconds", phase="session_write"):
+        hf.store_review(review)
     match_col_index = df_display.columns.get_loc("Match")
 
     # check if cluster done
-    cur_cluster_done = hf.check_cluster_done(local_file)
+    cur_cluster_done = hf.check_cluster_done(review)
 
     # set continuation message
-    done_message = hf.set_continuation_message(local_file, cur_cluster_done)
+    done_message = hf.set_continuation_message(review, cur_cluster_done)
 
     # some variables for html
     button_left, button_right = hf.set_position_vars(columns)
 
-    return render_template(
-        "cluster_version.html",
-        data=data,
-        columns=columns,
-        cluster_number=str(int(session["index"] + 1)),
-        button_left=button_left,
-        button_right=button_right,
-        num_clusters=num_clusters,
-        display_message=display_message,
-        done_message=done_message,
-        id_col_index=id_col_index,
-        select_all=session["select_all"],
-        highlight_differences=session["highlight_differences"],
-        font_choice=session["font_choice"],
-        match_error=match_error,
-        match_col_index=match_col_index,
-    )
+    with metrics.timer("crow_cluster_version_phase_seconds", phase="render"):
+        page = render_template(
+            "cluster_version.html",
+            data=data,
+            columns=columns,
+            cluster_number=str(int(session["index"] + 1)),
+            button_left=button_left,
+            button_right=button_right,
+            num_clusters=num_clusters,
+            display_message=display_message,
+            done_message=done_message,
+            id_col_index=id_col_index,
+            select_all=session["select_all"],
+            highlight_differences=session["highlight_differences"],
+            font_choice=session["font_choice"],
+            match_error=match_error,
+            match_col_index=match_col_index,
+        )
+    return page
+
+
+@app.route("/pairwise_version", methods=["GET", "POST"])
+def pairwise():
+    """
+    This is the page where pairwise clerical happens; a page of record pairs
+    is shown, and all of its decisions submitted, at a time.
+    """
+    # When pairwise version button pressed.
+    # Clear session variables except for font choice
+    if request.form.get("version") == "Pairwise Version":
+        hf.clear_session()
+
+    # if file not opened in session before
+    if "full_path" not in session:
+        with metrics.timer("crow_pairwise_version_phase_seconds", phase="load"):
+            (
+                review,
+                local_in_prog_path,
+                local_filepath_done,
+                hdfs_in_prog_path,
+                hdfs_filepath_done,
+            ) = hf.new_file_actions(pairwise=True)
+        # start the save thread to move in progress file back to hdfs.
+        local_file = review.to_frame()
+        metrics.run_in_background(
+            save_thread,
+            (
+                local_in_prog_path,
+                hdfs_in_prog_path,
+                local_file,
+                local_filepath_done,
+                hdfs_filepath_done,
+                review.is_done(),
+                hf.get_changes(review, local_file, local_in_prog_path, pairwise=True),
+                review.progress(),
+            ),
+        )
+
+    # if file already opened in session
+    else:
+        with metrics.timer("crow_pairwise_version_phase_seconds", phase="reload"):
+            (
+                review,
+                local_in_prog_path,
+                local_filepath_done,
+                hdfs_in_prog_path,
+                hdfs_filepath_done,
+            ) = hf.reload_page()
+
+    hf.set_session_variables(review)
+
+    ##############################Button Code###############################
+    # if submit pressed; make the decisions for every pair on the page
+    with metrics.timer("crow_pairwise_version_phase_seconds", phase="decision"):
+        if request.form.get("submit_page") == "submit_page":
+            hf.make_page_decisions(review)
+        # the other buttons post the page's choices too; keep them rather than
+        # dropping them when moving off the page, saving or highlighting
+        elif any(
+            request.form.get(button) == button
+            for button in ("back", "next", "save", "highlight_differences")
+        ):
+            hf.make_page_decisions(review, advance=False)
+
+    # if back or next pressed; move to the previous or next page
+    if request.form.get("back") == "back":
+        hf.move_page(review, -1)
+    if request.form.get("next") == "next":
+        hf.move_page(review, 1)
+
+    # if undo pressed; restore the last page of decisions and move to it
+    if request.form.get("undo") == "undo":
+        review.undo()
+
+    # if redo pressed; make the last undone page of decisions again and move on
+    if request.form.get("redo") == "redo" and review.redo():
+        hf.advance_page(review)
+
+    # keep the local working set up to date with the decisions just made
+    with metrics.timer("crow_pairwise_version_phase_seconds", phase="local_write"):
+        hf.write_working_changes(review, local_in_prog_path)
+
+    # if save pressed...save file to hdfs
+    if request.form.get("save") == "save":
+        local_file = review.to_frame()
+        metrics.run_in_background(
+            save_thread,
+            (
+                local_in_prog_path,
+                hdfs_in_prog_path,
+                local_file,
+                local_filepath_done,
+                hdfs_filepath_done,
+                review.is_done(),
+                hf.get_changes(review, local_file, local_in_prog_path, pairwise=True),
+                review.progress(),
+            ),
+        )
+
+    # set highlighter toggle
+    hf.reset_toggles()
+
+    ####################Things to display code#########################
+
+    with metrics.timer("crow_pairwise_version_phase_seconds", phase="highlight"):
+        headers, pairs = hf.get_page_pairs(review)
+    start, stop = hf.get_page(review)
+    display_message = config["message_for_matchers"]["message_to_display"]
+    done_message = hf.set_pairwise_message(review)
+    # keep the review for the next request
+    with metrics.timer("crow_pairwise_version_phase_seconds", phase="session_write"):
+        hf.store_review(review)
+
+    with metrics.timer("crow_pairwise_version_phase_seconds", phase="render"):
+        page = render_template(
+            "pairwise_version.html",
+            headers=headers,
+            pairs=pairs,
+            first_pair=start + 1,
+            last_pair=stop,
+            num_pairs=review.queue_length,
+            progress=review.progress(),
+            display_message=display_message,
+            done_message=done_message,
+            highlight_differences=session["highlight_differences"],
+            font_choice=session["font_choice"],
+        )
+    return page
 
 
 @app.route("/about_page", methods=["GET", "POST"])
@@ -280,57 +422,143 @@ def about():
     return render_template("about_page.html")
 
 
-########################
-
-########################
+@app.route("/progress_page", methods=["GET", "POST"])
+def progress_page():
+    """
+    This page shows the coordinator how far the review of every file in the
+    hdfs folder has got, read from the files' metadata alone
+    """
+    files, summary = hf.get_project_progress()
+    return render_template(
+        "progress_page.html",
+        # missing values as None, for the template.
+        files=files.astype(object).where(files.notna(), None).to_dict("records"),
+        summary=summary,
+        hdfs_folder=config["filespaces"]["hdfs_folder"],
+        font_choice=session.get("font_choice", ""),
+    )
 
-if __name__ == "__main__":
 
-    def save_thread(
-        local_in_prog_path,
-        hdfs_in_prog_path,
-        local_file,
-        local_filepath_done,
-        hdfs_filepath_done,
-    ):
-        """
-        A fumctiom to save to hdfs
-        """
-        print("save initiated")
-        hf.remove_hadoop(session["full_path"])
-        hf.remove_hadoop(hdfs_in_prog_path)
-        hf.remove_hadoop(hdfs_filepath_done)
-        if os.path.exists(local_in_prog_path):
-            os.remove(local_in_prog_path)
-        else:
-            pass
-
-        if os.path.exists(local_filepath_done):
-            os.remove(local_filepath_done)
-        else:
-            pass
-
-        if hf.check_matching_done(local_file):
-            local_file.to_parquet(local_filepath_done)
-            hf.save_hadoop(local_filepath_done, hdfs_filepath_done)
-
-        else:
-            local_file.to_parquet(local_in_prog_path)
-            hf.save_hadoop(local_in_prog_path, hdfs_in_prog_path)
+@app.route("/metrics", methods=["GET"])
+def metrics_page():
+    """
+    Serves the timing histograms in the Prometheus text format, to local
+    requests only.
+    """
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        abort(403)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def save_thread(
+    local_in_prog_path,
+    hdfs_in_prog_path,
+    local_file,
+    local_filepath_done,
+    hdfs_filepath_done,
+    matching_done=None,
+    changes=None,
+    progress=None,
+):
+    """
+    A fumctiom to save to hdfs; matching_done says whether every record has
+    a decision, and is worked out from the Match column if not given.
+    changes, from hf.get_changes, are the decisions changed since the last
+    save, saved as a delta next to the in progress file; if None the full
+    file is saved. progress, from review.progress, is written into the
+    metadata of what is saved, for the progress page.
+    """
+    print("save initiated")
+    started = time.time_ns()
+    # the file may have been read straight from hdfs; copy it locally before
+    # it is removed there
+    hf.materialise_source()
+
+    if changes is not None:
+        hf.upload_changes(
+            changes, local_in_prog_path, hdfs_in_prog_path, started, progress
+        )
         print("Saving Complete")
+        return
+
+    if matching_done is None:
+        matching_done = hf.check_matching_done(local_file)
+    # the full file, with the decisions joined back on, in place of the file
+    # opened and any in progress or done file
+    pairwise = session.get("version") == "pairwise"
+    if matching_done:
+        hf.upload_full_file(
+            local_file,
+            local_filepath_done,
+            hdfs_filepath_done,
+            started,
+            pairwise,
+            progress,
+        )
 
-    def run_app():
-        """
-        A function to run the main app
-        """
-        print(
-            'App is running, press icon in top corner to launch application.\n\
-              It may take a few seconds for the "CROW clerical tool" icon to appear.\n\
-              if you cannot see it, look again in a few seconds'
+    else:
+        hf.upload_full_file(
+            local_file,
+            local_in_prog_path,
+            hdfs_in_prog_path,
+            started,
+            pairwise,
+            progress,
         )
+    print("Saving Complete")
+
+
+def warm_templates():
+    """
+    A function to compile every template once, up front, so that the first
+    request to each page does not pay for parsing it. With
+    TEMPLATES_AUTO_RELOAD off the compiled templates are then cached for the
+    lifetime of the process.
+
+    Parameters: None
+    Returns: None
+    """
+    for template in TEMPLATES:
+        app.jinja_env.get_template(template)
+
 
-        app.config["TEMPLATES_AUTO_RELOAD"] = True
-        app.run(host="127.0.0.1", port=int(os.environ["CDSW_APP_PORT"]))
+def prepare_app(dev_mode=False):
+    """
+    A function to get the app ready to serve requests; sets up the user temp
+    folder, the timing log and the template caching behaviour.
+
+    Parameters: dev_mode - re-check templates on every request when True (Boolean)
+    Returns: None
+    """
+    hf.prepare_user_temp_folder()
+    # the timings are also written as structured log lines.
+    logging.basicConfig(format="%(asctime)s %(name)s %(message)s")
+    metrics.logger.setLevel(logging.INFO)
+    app.config["TEMPLATES_AUTO_RELOAD"] = dev_mode
+    app.jinja_env.auto_reload = dev_mode
+    if not dev_mode:
+        warm_templates()
+
+
+def run_app():
+    """
+    A function to run the main app on the flask development server
+    """
+    print(
+        'App is running, press icon in top corner to launch application.\n\
+          It may take a few seconds for the "CROW clerical tool" icon to appear.\n\
+          if you cannot see it, look again in a few seconds'
+    )
+
+    app.run(host="127.0.0.1", port=int(os.environ["CDSW_APP_PORT"]))
+
+
+########################
+
+########################
+
+if __name__ == "__main__":
+    prepare_app(dev_mode=True)
 
     ra = Process(target=run_app)
     ra.start()
@@ -347,15 +575,7 @@ if __name__ == "__main__":
     ra.terminate()
 
     # clear the users temp folder.
-    for filename in os.listdir(user_temp_folder):
-        file_path = os.path.join(user_temp_folder, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except FileNotFoundError:
-            print("temp folder does not exist or is empty")
+    hf.clear_user_temp_folder()
 
     print(
         "Session has timed out. Please re-start your session \n and re-run the script to continue"
@@ -0,0 +1,25 @@
+"""
+gunicorn settings for the application.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is imported once in the master and forked into the workers
+(preload_app), so the workers share the imported modules and the compiled
+templates. The worker and thread counts come from the [server] section of
+config_flow.ini.
+"""
+
+import os
+
+from wsgi import get_server_settings
+
+threads, workers = get_server_settings()
+bind = f"127.0.0.1:{os.environ.get('CDSW_APP_PORT', '8080')}"
+preload_app = True
+
+
+def on_starting(server):
+    """Set up the temp folders and template cache before forking workers."""
+    from flask_new_flow import prepare_app
+
+    prepare_app(dev_mode=False)
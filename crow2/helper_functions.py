@@ -3,17 +3,56 @@ Functions used in the main application
 
 """
 
-import ast
 import configparser
+import fcntl
 import os
+import re
 import shutil
 import subprocess
-from multiprocessing import Process
-
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 from flask import request, session
 from markupsafe import Markup
 
+import file_cache
+import metrics
+
+# the review engine shared with crow1 lives in crow_core, next to this folder.
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import (  # noqa: E402
+    CATEGORY_RATIO,
+    CROW2_FORMAT,
+    CROW2_PAIRWISE_FORMAT,
+    ReviewSession,
+    auto_resolve,
+    decision_changes,
+    delta_sequence,
+    deltas_folder,
+    encode_categories,
+    file_columns,
+    parse_partitions,
+    parse_order,
+    parse_rules,
+    prioritise,
+    progress_metadata,
+    project_progress,
+    read_deltas,
+    read_file,
+    summarise_progress,
+    write_delta,
+    write_file,
+)
+from crow_core.deltas import DELTAS_SUFFIX, ROW_KEY  # noqa: E402
+from crow_core.progress import COLUMNS, file_status  # noqa: E402
+
 user = os.environ["HADOOP_USER_NAME"]
 config = configparser.ConfigParser()
 config.read("config_flow.ini")
@@ -21,42 +60,25 @@ rec_id = config["id_variables"]["record_id"]
 clust_id = config["id_variables"]["cluster_id"]
 user = os.environ["HADOOP_USER_NAME"]
 
+# the open ReviewSessions of this process, by session["review_key"], the
+# least recently used first; past max_open_reviews (a custom setting,
+# default 8) the least recently used is dropped, and reloaded from its
+# working set if its browser session comes back.
+review_sessions = OrderedDict()
+review_sessions_lock = threading.Lock()
+max_open_reviews = int(config.get("custom_setting", "max_open_reviews", fallback="8"))
+
 
-def advance_cluster(dataframe):
+def advance_cluster(review):
     """
-    1)A Function to: determine the number of matches made in a given cluster
-    2)If 1 or 0 unmatcher records in cluster remain; progress to the next cluster.
+    A Function to progress to the next cluster if every record in the current
+    cluster has a decision against it.
 
-    Parameters: None
+    Parameters: review (ReviewSession)
     Returns: None
 
     """
-    num_in_cluster = len(
-        dataframe.loc[dataframe["Sequential_Cluster_Id"] == session["index"]]
-    )
-
-    list_decided = [
-        set(ast.literal_eval(i))
-        for i in dataframe.loc[dataframe["Sequential_Cluster_Id"] == session["index"]][
-            "Match"
-        ]
-    ]
-
-    uni_set_decided = {x for item in list_decided for x in item}
-
-    num_decided = len(uni_set_decided)
-    if (num_in_cluster - num_decided) == 0:
-        for r_id in [
-            x
-            for x in dataframe.loc[
-                dataframe["Sequential_Cluster_Id"] == session["index"]
-            ][rec_id]
-            if x not in uni_set_decided
-        ]:
-            dataframe.loc[dataframe[rec_id] == r_id, "Match"] = (
-                f"['No Match In Cluster For {r_id}']"
-            )
-        session["index"] = int(session["index"]) + 1
+    review.advance_if_done()
 
 
 def check_matching_done(dataframe):
@@ -134,6 +156,47 @@ def get_save_paths(origin_file_path, origin_file_path_fl):
     return in_prog_path, filepath_done
 
 
+@metrics.timed("crow_storage_call_seconds", call="ls")
+def list_hadoop(hdfs_folder):
+    """
+    A function to list the files in a hdfs folder
+
+    Parameters: hdfs_folder(string); location of hdfs folder
+    Returns: list of file paths (List)
+
+    """
+    process = subprocess.Popen(
+        ["hadoop", "fs", "-ls", "-C", hdfs_folder],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    std_out, std_error = process.communicate()
+    std_out2 = list(str(std_out).split("\\n"))
+    # fix for error where first file in the folder has b' due to hadoop commands
+    return [re.sub(r"^b'", "", i) for i in std_out2]
+
+
+def list_clerical_files(hdfs_folder):
+    """
+    A function to list the clerical files in a hdfs folder, leaving out the
+    decisions folders saved next to them (see crow_core.deltas), files still
+    being written and the trailing quote of the listing.
+
+    Parameters: hdfs_folder(string); location of hdfs folder
+    Returns: list of file paths (List)
+    """
+    files = []
+    for path in list_hadoop(hdfs_folder):
+        name = path.rstrip("/").split("/")[-1]
+        if not name.strip("'") or name.startswith((".", "_")):
+            continue
+        if name.endswith((DELTAS_SUFFIX, ".tmp", ".old")):
+            continue
+        files.append(path)
+    return files
+
+
+@metrics.timed("crow_storage_call_seconds", call="get")
 def get_hadoop(hdfs_path, local_path):
     """
     A function to take a copy a file from hdfs to the local filespace
@@ -149,6 +212,227 @@ def get_hadoop(hdfs_path, local_path):
     process.communicate()
 
 
+@metrics.timed("crow_storage_call_seconds", call="stat")
+def stat_hadoop(hdfs_path):
+    """
+    A function to get the size and modification time of a file (or folder
+    of files) in hdfs.
+
+    Parameters: hdfs_path(string); location of hdfs file
+    Returns: size in bytes (Int) and modification time (Int), or None if
+             the file could not be found
+    """
+    process = subprocess.run(
+        ["hadoop", "fs", "-stat", "%b %Y %F", hdfs_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+    if process.returncode != 0:
+        return None
+    size, modified, file_type = process.stdout.split(maxsplit=2)
+    if file_type.strip() == "directory":
+        # a folder of partitions; its size is the size of its files.
+        process = subprocess.run(
+            ["hadoop", "fs", "-du", "-s", hdfs_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+        if process.returncode != 0:
+            return None
+        size = process.stdout.split()[0]
+    return int(size), int(modified)
+
+
+def get_cache_folder():
+    """
+    A function to get the folder downloaded files are cached in, from the
+    cache_space filespace (default: a cache folder in the local space).
+
+    Parameters: None
+    Returns: cache_folder (String)
+    """
+    return config.get(
+        "filespaces",
+        "cache_space",
+        fallback=os.path.join(config["filespaces"]["local_space"], "cache"),
+    ).strip()
+
+
+def get_cache_budget():
+    """
+    A function to get the size of the download cache, in bytes, from the
+    cache_size_mb custom setting (default 10GB; 0 turns the cache off).
+
+    Parameters: None
+    Returns: budget (Int)
+    """
+    return int(config.get("custom_setting", "cache_size_mb", fallback="10240")) * (
+        1024 * 1024
+    )
+
+
+def get_hadoop_version(hdfs_path):
+    """
+    A function to get the version of a file in hdfs the cache of downloads
+    knows it by.
+
+    Parameters: hdfs filepath(string); location of hdfs file
+    Returns: size in bytes (Int) and modification time (Int), or None if
+             the cache is off or the file could not be found
+    """
+    if get_cache_budget() <= 0:
+        return None
+    return stat_hadoop(hdfs_path)
+
+
+def fetch_hadoop(hdfs_path, local_path, version=None):
+    """
+    A function to copy a file from hdfs to the local filespace, through the
+    local cache of downloads: a file unchanged since it was cached is not
+    downloaded again.
+
+    Parameters: hdfs filepath(string); location of hdfs file
+                local_path(string); location of filepath to store data locally
+                version - from get_hadoop_version, if already known (Tuple)
+    Returns: None
+    """
+    if version is None:
+        version = get_hadoop_version(hdfs_path)
+    if version is None:
+        get_hadoop(hdfs_path, local_path)
+        return
+    size, modified = version
+    with metrics.timer("crow_storage_call_seconds", call="cache"):
+        cached, hit = file_cache.fetch(
+            hdfs_path,
+            size,
+            modified,
+            lambda temporary: get_hadoop(hdfs_path, temporary),
+            get_cache_folder(),
+            get_cache_budget(),
+        )
+        file_cache.link(cached, local_path)
+    print(f"{'cached' if hit else 'downloaded'} {hdfs_path}")
+
+
+# the file systems pyarrow could not connect to, in this process.
+unreachable_file_systems = set()
+
+
+def connect_hdfs(hdfs_path):
+    """
+    A function to connect pyarrow to the file system of a file in hdfs, for
+    reading it directly without copying it locally, if the stream_load
+    custom setting is on and pyarrow can connect (it needs libhdfs for
+    hdfs://, and credentials for s3a://).
+
+    Parameters: hdfs filepath(string); location of hdfs file
+    Returns: filesystem (pyarrow FileSystem) and the path of the file in it
+             (String), or None if it cannot be read directly
+    """
+    if not int(config.get("custom_setting", "stream_load", fallback="1")):
+        return None
+    from pyarrow import fs
+
+    # pyarrow knows s3a:// as s3://
+    uri = re.sub(r"^s3a://", "s3://", hdfs_path)
+    # the scheme and host (or bucket)
+    file_system = "/".join(uri.split("/")[:3])
+    if file_system in unreachable_file_systems:
+        return None
+    try:
+        filesystem, path = fs.FileSystem.from_uri(uri)
+        if filesystem.get_file_info(path).type == fs.FileType.NotFound:
+            return None
+    except (OSError, ValueError) as error:
+        print(f"reading {hdfs_path} through a local copy: {error}".splitlines()[0])
+        unreachable_file_systems.add(file_system)
+        return None
+    return filesystem, path
+
+
+def load_working_set(pairwise=False):
+    """
+    A function to load the working columns of the file chosen (and only the
+    partitions chosen), from the cache of downloads if it is there, and
+    otherwise straight from hdfs, a row group at a time. The full file is
+    then only copied locally when the first save needs it (see
+    materialise_source). If hdfs cannot be read directly, the file is
+    downloaded first. Decisions saved as deltas next to the file are merged
+    on either way.
+
+    Parameters: pairwise - the file is of record pairs (Boolean)
+    Returns: local_file (pandas dataframe)
+    """
+    hdfs_path = session["full_path"]
+    source_path = get_source_path()
+    remove_local(source_path)
+    remove_local(deltas_folder(source_path))
+    version = get_hadoop_version(hdfs_path)
+    cached = version is not None and file_cache.lookup(
+        hdfs_path, *version, get_cache_folder()
+    )
+    remote = None if cached else connect_hdfs(hdfs_path)
+    if remote is None:
+        fetch_hadoop(hdfs_path, source_path, version)
+        fetch_decisions(hdfs_path, source_path)
+        return read_working_set(source_path, pairwise)
+    filesystem, path = remote
+    with metrics.timer("crow_storage_call_seconds", call="stream"):
+        return read_working_set(path, pairwise, filesystem)
+
+
+def materialise_source():
+    """
+    A function to copy the full file locally (through the cache of
+    downloads) for the saves to join the decisions onto, if it was read
+    straight from hdfs and has not been copied yet. Called by a save before
+    it removes the file from hdfs.
+
+    Parameters: None
+    Returns: None
+    """
+    source_path = get_source_path()
+    if os.path.exists(source_path):
+        return
+    temporary = f"{source_path}.{uuid.uuid4().hex}"
+    fetch_hadoop(session["full_path"], temporary)
+    fetch_decisions(session["full_path"], temporary)
+    try:
+        # the deltas first, so the file is never there without them.
+        os.rename(deltas_folder(temporary), deltas_folder(source_path))
+    except FileNotFoundError:
+        # there are none.
+        pass
+    except OSError:
+        remove_local(deltas_folder(temporary))
+    try:
+        os.rename(temporary, source_path)
+    except OSError:
+        # another save copied it first.
+        remove_local(temporary)
+
+
+def fetch_decisions(hdfs_path, local_path):
+    """
+    A function to copy the decisions saved as deltas next to a file in hdfs
+    (see crow_core.deltas) to the same place next to its local copy, where
+    reading and writing the local copy will merge them on. They are small
+    and change with every save, so are not cached.
+
+    Parameters: hdfs filepath(string); location of hdfs file
+                local_path(string); location of the local copy of the file
+    Returns: None
+    """
+    if stat_hadoop(deltas_folder(hdfs_path)) is not None:
+        get_hadoop(deltas_folder(hdfs_path), deltas_folder(local_path))
+
+
+@metrics.timed("crow_storage_call_seconds", call="put")
 def save_hadoop(local_path, hdfs_path):
     """
     A function to take a copy a file from local folder to hdfs
@@ -163,6 +447,7 @@ def save_hadoop(local_path, hdfs_path):
     process.communicate()
 
 
+@metrics.timed("crow_storage_call_seconds", call="rm")
 def remove_hadoop(hdfs_path):
     file_test = subprocess.run(
         f"hdfs dfs -test -f {hdfs_path}",
@@ -189,6 +474,44 @@ def remove_hadoop(hdfs_path):
         # build in some error handling
 
 
+@metrics.timed("crow_storage_call_seconds", call="mkdir")
+def make_hadoop_folder(hdfs_folder):
+    """
+    A function to make a folder in hdfs, and any folders above it, if it
+    does not exist.
+
+    Parameters: hdfs_folder(string)
+    Returns: None
+    """
+    process = subprocess.Popen(["hadoop", "fs", "-mkdir", "-p", hdfs_folder])
+    process.communicate()
+
+
+def remove_decisions(hdfs_path, before=None):
+    """
+    A function to remove the decisions saved as deltas next to a file in
+    hdfs: all of them, or only those of saves started before a time (which
+    a full save started then has in it).
+
+    Parameters: hdfs filepath(string); location of hdfs file
+                before - from time.time_ns (Int)
+    Returns: None
+    """
+    folder = deltas_folder(hdfs_path)
+    if before is None:
+        remove_hadoop(folder)
+        return
+    deltas = [path for path in list_hadoop(folder) if delta_sequence(path) is not None]
+    older = [path for path in deltas if delta_sequence(path) < before]
+    if older and len(older) == len(deltas):
+        remove_hadoop(folder)
+    elif older:
+        # in one command, as each hadoop command starts a JVM.
+        with metrics.timer("crow_storage_call_seconds", call="rm"):
+            process = subprocess.Popen(["hadoop", "fs", "-rm", *older])
+            process.communicate()
+
+
 def validate_columns(df):
     """
     Checks for a given dataframe, if the record_id and cluster id columns
@@ -213,6 +536,65 @@ def validate_columns(df):
         )
 
 
+def get_pairwise_columns():
+    """
+    A function to read the columns of the pairwise version from the
+    [column_headers_and_order] and [column_file_info_and_order] sections of
+    the config.
+
+    Parameters: None
+    Returns: headers - column headers, in display order (List)
+             columns_by_dataset - for each dataset, in config order, the file
+             column for each header, or None if it has none (Dict)
+    """
+    orders = {}
+    for column_title in config["column_headers_and_order"]:
+        header, order = (
+            config["column_headers_and_order"][column_title].replace(" ", "").split(",")
+        )
+        orders[order] = header
+    headers = [orders[order] for order in sorted(orders, key=int)]
+
+    columns_by_dataset = {}
+    for column_file_title in config["column_file_info_and_order"]:
+        column, dataset, order = (
+            config["column_file_info_and_order"][column_file_title]
+            .replace(" ", "")
+            .split(",")
+        )
+        columns = columns_by_dataset.setdefault(dataset, [None] * len(headers))
+        columns[headers.index(orders[order])] = column
+    return headers, columns_by_dataset
+
+
+def validate_pairwise_columns(df):
+    """
+    Checks for a given dataframe, that every column in the
+    [column_file_info_and_order] section of the config is present, and that
+    there are two datasets to compare. Relevant errors are then raised.
+
+    Parameters: df (Pandas Dataframe )
+
+    Returns: None
+    """
+    headers, columns_by_dataset = get_pairwise_columns()
+    if len(columns_by_dataset) != 2:
+        raise Exception(
+            "the pairwise version needs columns from two datasets; "
+            "contact your project leader for guidance"
+        )
+    missing = [
+        column
+        for columns in columns_by_dataset.values()
+        for column in columns
+        if column is not None and column not in df.columns
+    ]
+    if missing:
+        raise Exception(
+            f"columns {missing} not in data; contact your project leader for guidance"
+        )
+
+
 def validate_input_data(filepath):
     """
     Checks that the size of the file is smaller than 0.5GB and raises an error if not
@@ -224,32 +606,15 @@ def validate_input_data(filepath):
         raise Exception("Filesize error; file is bigger than 0.5GB")
 
 
-def check_cluster_done(dataframe):
+def check_cluster_done(review):
     """
     A function to check if every record in a cluster has a decision against it.
 
-    Parameters: dataframe
+    Parameters: review (ReviewSession)
     Returns: Boolean (True if every record in clustere has a decision against it, False otherwise)
 
     """
-    num_in_cluster = len(
-        dataframe.loc[dataframe["Sequential_Cluster_Id"] == session["index"]]
-    )
-
-    list_decided = [
-        set(ast.literal_eval(i))
-        for i in dataframe.loc[dataframe["Sequential_Cluster_Id"] == session["index"]][
-            "Match"
-        ]
-    ]
-
-    uni_set_decided = {x for item in list_decided for x in item}
-
-    num_decided = len(uni_set_decided)
-    if (num_in_cluster - num_decided) == 0:
-        return 1
-    else:
-        return 0
+    return int(review.is_cluster_done())
 
 
 def highlighter_func(highlight_cols, df_display):
@@ -296,7 +661,7 @@ def highlighter_func(highlight_cols, df_display):
             df_display.loc[i, column] = Markup(data_point)
 
 
-def new_file_actions():
+def new_file_actions(pairwise=False):
     """
     Actions when page is loaded for the first time with this file
 
@@ -304,9 +669,10 @@ def new_file_actions():
     2) set new column variables.
     2) set hdfs and local paths for done and inprogress files.
 
-    Parameters: None
+    Parameters: pairwise - open the file as record pairs, in the pairwise
+                version (Boolean)
 
-    Returns: local_file(pandas dataframe)
+    Returns: review(ReviewSession)
              local_in_prog_path (string)
              local_filepath_done (string)
              hdfs_in_prog_path (string)
@@ -318,50 +684,65 @@ def new_file_actions():
     # get the hdfs file paths and file name
     session["full_path"] = str(request.form.get("file_path"))
     session["filename"] = session["full_path"].split("/")[-1]
+    # optionally, only some partitions of a partitioned folder of files
+    session["partitions"] = str(request.form.get("partitions", "")).strip()
 
     # get the temporary file location from config
     temp_local_path = f"{config['filespaces']['local_space'] + session['filename']}"
-    # get the data from hdfs into local location
-    get_hadoop(session["full_path"], temp_local_path)
 
-    # load from local location to a pandas df
-    local_file = pd.read_parquet(temp_local_path)
+    # load the columns used to a pandas df, straight from hdfs or from the
+    # cache of downloads; the full file (which may be a folder of
+    # partitions) is kept locally for the saves, which join the decisions
+    # back onto it
+    local_file = load_working_set(pairwise)
 
     # validate pd columns/raise errors
-    validate_columns(local_file)
-
-    # if temp path is now a directory; remove directory
-    if os.path.isdir(temp_local_path):
-        shutil.rmtree(temp_local_path)
-        # this is a hack to resolve; to_parquet only works with single partition files.
-    # save back to temp path as a one-partition parquet
-    local_file.to_parquet(temp_local_path)
-
-    # create json version of the local file (a flask hack)
-    session["working_file"] = local_file.to_json()
+    if pairwise:
+        validate_pairwise_columns(local_file)
+    else:
+        validate_columns(local_file)
 
     # if there are not already; create the following columns: Match,
     # Comment, Sequential_Cluster_Id, Sequential_Record_Id
 
-    if "Match" not in local_file.columns:
+    # (the pairwise version's match and comments columns are added by its
+    # ReviewSession)
+    if not pairwise and "Match" not in local_file.columns:
         local_file["Match"] = "[]"
 
-    if "Sequential_Cluster_Id" not in local_file.columns:
+    # renumber the sequential ids if some records have none (a partitioned
+    # file reviewed a partition at a time only has them where reviewed)
+    for column in ("Sequential_Cluster_Id", "Sequential_Record_Id"):
+        if column in local_file.columns and local_file[column].isna().any():
+            local_file = local_file.drop(columns=column)
+
+    if not pairwise and "Sequential_Cluster_Id" not in local_file.columns:
         local_file["Sequential_Cluster_Id"] = pd.factorize(local_file[clust_id])[0]
         local_file = local_file.sort_values(by=["Sequential_Cluster_Id"])
 
-    if "Comment" not in local_file.columns:
+    if not pairwise and "Comment" not in local_file.columns:
         local_file["Comment"] = ""
 
-    if "Sequential_Record_Id" not in local_file.columns:
+    if not pairwise and "Sequential_Record_Id" not in local_file.columns:
         local_file["Sequential_Record_Id"] = pd.factorize(local_file[rec_id])[0]
         local_file = local_file.sort_values(by=["Sequential_Record_Id"])
 
-    # get the local filepath in_prog and done paths rename locally to in_prog_path
+    if pairwise:
+        review = build_pairwise_review(local_file)
+    else:
+        review = build_review(local_file)
+    auto_resolve_file(review, pairwise)
+    session["version"] = "pairwise" if pairwise else "cluster"
+    forget_review()
+    session["review_key"] = uuid.uuid4().hex
+    session["review_version"] = 0
+    # the first save is of the full file (see get_changes)
+    session["delta_saves"] = None
+
+    # get the local filepath in_prog and done paths
     local_in_prog_path, local_filepath_done = get_save_paths(
         temp_local_path, temp_local_path.split("/")
     )
-    os.rename(temp_local_path, local_in_prog_path)
 
     # get the hdfs filepath in_prog and done paths and rename in hdfs to in_prog_path
     hdfs_in_prog_path, hdfs_filepath_done = get_save_paths(
@@ -369,7 +750,7 @@ def new_file_actions():
     )
     # return filepaths
     return (
-        local_file,
+        review,
         local_in_prog_path,
         local_filepath_done,
         hdfs_in_prog_path,
@@ -377,27 +758,515 @@ def new_file_actions():
     )
 
 
+def get_source_path():
+    """
+    A function to get the local path of the full file downloaded from hdfs.
+
+    Parameters: None
+    Returns: source_path (String)
+    """
+    return f"{config['filespaces']['local_space'] + session['filename']}_source"
+
+
+def remove_local(path):
+    """
+    A function to remove a local file or folder, if it exists.
+
+    Parameters: path (String)
+    Returns: None
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def get_working_columns(columns, pairwise=False):
+    """
+    A function to choose the columns of a file that are loaded: the ids, the
+    columns displayed or compared by auto-resolution, the column the review
+    order is taken from, and the decision columns. The others stay on disk and are joined back on at save.
+
+    Parameters: columns - the columns of the file (List)
+                pairwise - the file is of record pairs (Boolean)
+    Returns: working columns, in file order (List)
+    """
+    auto_columns = [
+        column.strip()
+        for column in config.get("auto_resolution", "columns", fallback="").split(",")
+    ]
+    if pairwise:
+        _, columns_by_dataset = get_pairwise_columns()
+        used = [
+            column
+            for dataset_columns in columns_by_dataset.values()
+            for column in dataset_columns
+        ]
+        used += CROW2_PAIRWISE_FORMAT.decision_columns()
+    else:
+        used = [rec_id, clust_id, "Sequential_Cluster_Id", "Sequential_Record_Id"]
+        used += [config["display_columns"][i] for i in config["display_columns"]]
+        used += auto_columns + CROW2_FORMAT.decision_columns()
+    used.append(config.get("review_order", "column", fallback="").strip())
+    return [column for column in columns if column in used]
+
+
+def read_working_set(path, pairwise=False, filesystem=None):
+    """
+    A function to load the working columns of the partitions chosen of a
+    parquet file (or folder of parquet files, read in parallel).
+
+    Parameters: path (String)
+                pairwise - the file is of record pairs (Boolean)
+                filesystem - where the file is; local by default (pyarrow
+                FileSystem)
+    Returns: local_file (pandas dataframe)
+    """
+    columns = file_columns(path, "parquet", filesystem)
+    return read_file(
+        path,
+        columns=get_working_columns(columns, pairwise),
+        file_format="parquet",
+        partitions=get_partitions(),
+        filesystem=filesystem,
+    )
+
+
+def upload_full_file(
+    local_file, local_path, hdfs_path, started, pairwise=False, progress=None
+):
+    """
+    A function to save the full file, with the decisions of the working set
+    joined on, to hdfs, in place of the file opened and any in progress or
+    done file (and their deltas). It is written next to the local copy of
+    the working set under a name of its own, so it never clashes with it,
+    or with another save; for a partitioned folder of files it is a folder
+    too.
+
+    Saves run in the background, so two may overlap; the full save started
+    last is the one left in hdfs, whichever finishes first, and deltas of
+    saves started after it are kept.
+
+    Parameters: local_file - the working set (pandas dataframe)
+                local_path - the local in progress or done path (String)
+                hdfs_path - where to save it (String)
+                started - when the save started, from time.time_ns (Int)
+                pairwise - the file is of record pairs (Boolean)
+                progress - from review.progress, written into the file's
+                metadata for the progress page (Progress)
+    Returns: None
+    """
+    upload_path = f"{local_path}_upload_{uuid.uuid4().hex}"
+    try:
+        write_full_file(
+            local_file, upload_path, pairwise, save_metadata(progress, started)
+        )
+        with lock_saves() as saved:
+            last_started = int(saved.read() or 0)
+            if started < last_started:
+                print("a newer save has already been made")
+                return
+            full_path = session["full_path"]
+            for path in {full_path, *get_save_paths(full_path, full_path.split("/"))}:
+                remove_hadoop(path)
+                remove_decisions(path, started if path == hdfs_path else None)
+            save_hadoop(upload_path, hdfs_path)
+            # decisions of partitions not opened, still to be folded in
+            if os.path.isdir(deltas_folder(upload_path)):
+                make_hadoop_folder(deltas_folder(hdfs_path))
+                for name in os.listdir(deltas_folder(upload_path)):
+                    save_hadoop(
+                        os.path.join(deltas_folder(upload_path), name),
+                        f"{deltas_folder(hdfs_path)}/{name}",
+                    )
+            saved.truncate(0)
+            saved.write(str(started))
+    finally:
+        remove_local(upload_path)
+        remove_local(deltas_folder(upload_path))
+
+
+def upload_changes(changes, local_path, hdfs_path, started, progress=None):
+    """
+    A function to save the decisions changed since the last save to hdfs, as
+    a delta next to the in progress file (see crow_core.deltas), rather than
+    the full file: a save costs as much as the decisions made, not the size
+    of the file. Reading the file merges the deltas on.
+
+    Parameters: changes - from get_changes (pandas dataframe)
+                local_path - the local in progress path (String)
+                hdfs_path - the hdfs in progress path (String)
+                started - when the save started, from time.time_ns (Int)
+                progress - from review.progress, written into the delta's
+                metadata for the progress page (Progress)
+    Returns: None
+    """
+    if changes.empty:
+        print("no decisions have changed since the last save")
+        return
+    upload_folder = f"{local_path}_upload_{uuid.uuid4().hex}"
+    try:
+        upload_path = write_delta(
+            changes, upload_folder, started, save_metadata(progress, started)
+        )
+        with lock_saves() as saved:
+            if started < int(saved.read() or 0):
+                # a full save started since has these decisions in it.
+                return
+            make_hadoop_folder(deltas_folder(hdfs_path))
+            save_hadoop(
+                upload_path,
+                f"{deltas_folder(hdfs_path)}/{os.path.basename(upload_path)}",
+            )
+    finally:
+        remove_local(upload_folder)
+
+
+@contextmanager
+def lock_saves():
+    """
+    A function to wait for the other saves of this file to hdfs to finish,
+    and stop any starting until this one has. The file yielded holds when
+    the last full save started.
+
+    Parameters: None
+    Returns: the lock file, open for reading and writing
+    """
+    with open(f"{get_source_path()}.saved", "a+") as saved:
+        fcntl.flock(saved, fcntl.LOCK_EX)
+        saved.seek(0)
+        yield saved
+
+
+def write_working_set(review, local_file, local_path):
+    """
+    A function to write the whole working set to its local copy, which the
+    review is rebuilt from when this process does not have it in memory
+    (see reload_page), and drop the deltas written next to it since. Only
+    done when the file is opened and on full saves.
+
+    Parameters: review (ReviewSession)
+                local_file - the working set, from review.to_frame (pandas
+                dataframe)
+                local_path - the local in progress path (String)
+    Returns: None
+    """
+    # every decision is in the file written
+    review.take_changes()
+    temporary = f"{local_path}.tmp"
+    local_file.to_parquet(temporary)
+    os.replace(temporary, local_path)
+    remove_local(deltas_folder(local_path))
+    session["working_deltas_saved"] = time.time_ns()
+
+
+def write_working_changes(review, local_path):
+    """
+    A function to write the decisions changed by a request to the local copy
+    of the working set, as a small delta next to it (see crow_core.deltas),
+    so a request costs as much as the decisions it made, not the size of the
+    file. Reading the local copy merges the deltas on.
+
+    Parameters: review (ReviewSession)
+                local_path - the local in progress path (String)
+    Returns: None
+    """
+    rows = review.take_changes()
+    if not len(rows):
+        return
+    changes = decision_changes(
+        review.snapshot(rows=rows),
+        np.arange(len(rows)),
+        review.record_id,
+        review.decision_columns,
+    )
+    if review.record_id is None:
+        # keyed by the row of the working set, not of the copy of the rows
+        changes[ROW_KEY] = rows
+    write_delta(changes, deltas_folder(local_path), time.time_ns())
+
+
+def get_changes(review, local_file, local_path, pairwise=False):
+    """
+    A function to choose how a save is made: as a delta of the decisions
+    changed since the last save, or of the full file, which folds the
+    deltas saved so far into it. The full file is saved by the first save,
+    every consolidate_every saves (a custom setting, default 20; 0 saves
+    the full file every time), when matching is done (done files have
+    every decision in them), and for pairwise files opened a partition at
+    a time (whose record pairs have no id to save decisions against).
+
+    The decisions changed since the last save are those of the deltas of
+    the local working set written since (see write_working_changes); a full
+    save writes the whole local working set again.
+
+    Parameters: review (ReviewSession)
+                local_file - the working set, from review.to_frame (pandas
+                dataframe)
+                local_path - the local in progress path (String)
+                pairwise - the review is of record pairs (Boolean)
+    Returns: changes - the record id (or row) and decision columns of each
+             record changed, or None to save the full file (pandas
+             dataframe)
+    """
+    delta_saves = session.get("delta_saves")
+    consolidate_every = int(
+        config.get("custom_setting", "consolidate_every", fallback="20")
+    )
+    if (
+        delta_saves is None
+        or delta_saves >= consolidate_every
+        or review.is_done()
+        or session.get("saved_done")
+        or (pairwise and get_partitions())
+    ):
+        session["delta_saves"] = 0
+        session["saved_done"] = review.is_done()
+        write_working_set(review, local_file, local_path)
+        return None
+    session["delta_saves"] = delta_saves + 1
+    # any changes not yet in a delta, then those written since the last save
+    write_working_changes(review, local_path)
+    read_at = time.time_ns()
+    changes = read_deltas(
+        deltas_folder(local_path), after=session.get("working_deltas_saved")
+    )
+    session["working_deltas_saved"] = read_at
+    if changes is None:
+        return pd.DataFrame()
+    return changes
+
+
+def get_partitions():
+    """
+    A function to get the partitions of a partitioned folder of parquet
+    files chosen on the new session page, e.g. "region=North, batch=3".
+
+    Parameters: None
+    Returns: the values of each partition key; empty for every partition
+             (Dict)
+    """
+    return parse_partitions(session.get("partitions", ""))
+
+
+def save_metadata(progress, started):
+    """
+    A function to make the metadata a save writes into the file (or delta)
+    it saves: the progress of the review, the user and when the save
+    started, read by the progress page (see crow_core.progress).
+
+    Parameters: progress - from review.progress, or None (Progress)
+                started - when the save started, from time.time_ns (Int)
+    Returns: the key-value metadata, or None if there is no progress (Dict)
+    """
+    if progress is None:
+        return None
+    return progress_metadata(progress, user, started / 1e9)
+
+
+def write_full_file(local_file, path, pairwise=False, metadata=None):
+    """
+    A function to write a local file for hdfs: the full file downloaded from
+    hdfs, with the decision and sequential id columns of the working set
+    joined on by record id (by row, in the pairwise version).
+
+    Parameters: local_file - the working set (pandas dataframe)
+                path - where to write it (String)
+                pairwise - the file is of record pairs (Boolean)
+                metadata - key-value metadata to write into the file, from
+                save_metadata (Dict)
+    Returns: None
+    """
+    if pairwise:
+        key, columns = None, CROW2_PAIRWISE_FORMAT.decision_columns()
+    else:
+        key = rec_id
+        columns = CROW2_FORMAT.decision_columns()
+        columns += ["Sequential_Cluster_Id", "Sequential_Record_Id"]
+    write_file(
+        local_file,
+        path,
+        source=get_source_path(),
+        key=key,
+        columns=[column for column in columns if column in local_file.columns],
+        file_format="parquet",
+        partitions=get_partitions(),
+        metadata=metadata,
+    )
+
+
+def get_project_progress():
+    """
+    A function to get the progress of every file in the hdfs folder, for the
+    progress page, from the footers of the files alone (see
+    crow_core.progress), read in parallel straight from hdfs. If hdfs cannot
+    be read directly, only the status of each file's name is known.
+
+    Parameters: None
+    Returns: files - the progress of each file (pandas dataframe)
+             summary - the progress of the project (Dict)
+    """
+    hdfs_folder = config["filespaces"]["hdfs_folder"]
+    remote = connect_hdfs(hdfs_folder)
+    if remote is not None:
+        filesystem, path = remote
+        with metrics.timer("crow_storage_call_seconds", call="footers"):
+            files = project_progress(path, filesystem)
+    else:
+        paths = list_clerical_files(hdfs_folder)
+        files = pd.DataFrame(
+            {"file": paths, "status": [file_status(path) for path in paths]}
+        ).reindex(columns=COLUMNS)
+    return files, summarise_progress(files)
+
+
+def encode_display_columns(local_file, exclude):
+    """
+    A function to store the columns of a file with few distinct values (e.g.
+    the dataset, sex or postcode) as categories, so each value is held once
+    per session rather than once per record. Only the records on screen are
+    converted back to strings, when they are displayed.
+
+    Parameters: local_file (pandas dataframe)
+                exclude - the id and decision columns, which are left as
+                they are (List)
+    Returns: None
+    """
+    encode_categories(
+        local_file,
+        [column for column in local_file.columns if column not in exclude],
+        max_ratio=float(
+            config.get("custom_setting", "category_ratio", fallback=CATEGORY_RATIO)
+        ),
+    )
+
+
+def build_review(local_file):
+    """
+    A function to build the ReviewSession for a file, with its clusters in
+    Sequential_Cluster_Id order, reviewed in the order of [review_order].
+
+    Parameters: local_file (pandas dataframe)
+    Returns: review (ReviewSession)
+    """
+    # files prepared beforehand (see coordinator/prepare_files.py) are
+    # already in this order
+    order = ["Sequential_Cluster_Id", "Sequential_Record_Id"]
+    if not all(local_file[column].is_monotonic_increasing for column in order):
+        local_file = local_file.sort_values(by=order)
+    local_file = local_file.reset_index(drop=True)
+    encode_display_columns(
+        local_file,
+        [rec_id, clust_id, "Sequential_Cluster_Id", "Sequential_Record_Id"]
+        + CROW2_FORMAT.decision_columns(),
+    )
+    review = ReviewSession(local_file, rec_id, clust_id, CROW2_FORMAT)
+    order_review(review)
+    return review
+
+
+def build_pairwise_review(local_file):
+    """
+    A function to build the ReviewSession for a file of record pairs, in file
+    order (or that of [review_order]); each pair is its own cluster.
+
+    Parameters: local_file (pandas dataframe)
+    Returns: review (ReviewSession)
+    """
+    local_file = local_file.reset_index(drop=True)
+    match_col = CROW2_PAIRWISE_FORMAT.match_col
+    if match_col in local_file.columns and pd.api.types.is_numeric_dtype(
+        local_file[match_col]
+    ):
+        # decisions made in the Tkinter version are numbers; store them as
+        # the strings used here.
+        local_file[match_col] = local_file[match_col].map(
+            lambda value: "" if pd.isna(value) else str(int(value))
+        )
+    encode_display_columns(local_file, CROW2_PAIRWISE_FORMAT.decision_columns())
+    review = ReviewSession(local_file, None, None, CROW2_PAIRWISE_FORMAT)
+    order_review(review)
+    return review
+
+
+def order_review(review):
+    """
+    A function to put the clusters of a review in the order set in the
+    [review_order] section of the config (e.g. the most uncertain match
+    scores first), rather than file order. The order is not saved, so it is
+    set again whenever a review is built.
+
+    Parameters: review (ReviewSession)
+    Returns: None
+    """
+    order = parse_order(config.get("review_order", "order", fallback=""))
+    if order == "file":
+        return
+    column = config.get("review_order", "column", fallback="").strip() or None
+    threshold = float(config.get("review_order", "threshold", fallback="0.5"))
+    prioritise(review, order, column, threshold)
+
+
+def auto_resolve_file(review, pairwise=False):
+    """
+    A function to decide the clusters that need no clerical review, with the
+    rules in the [auto_resolution] section of the config, and take them out
+    of the review queue.
+
+    Parameters: review (ReviewSession)
+                pairwise - the review is of record pairs (Boolean)
+    Returns: counts - number of clusters decided by each rule (Dict)
+    """
+    rules = parse_rules(config.get("auto_resolution", "rules", fallback=""))
+    if not rules:
+        return {}
+    columns = [
+        column.strip()
+        for column in config.get("auto_resolution", "columns", fallback="").split(",")
+        if column.strip()
+    ]
+    if pairwise:
+        # compare the two datasets' columns for each header; columns lists
+        # the headers to compare.
+        headers, columns_by_dataset = get_pairwise_columns()
+        columns_a, columns_b = columns_by_dataset.values()
+        column_pairs = [
+            (column_a, column_b)
+            for header, column_a, column_b in zip(headers, columns_a, columns_b)
+            if column_a and column_b and (not columns or header in columns)
+        ]
+        counts = auto_resolve(review, column_pairs=column_pairs, rules=rules)
+        print(f"auto-resolved record pairs: {counts}")
+        return counts
+    if not columns:
+        columns = [
+            config["display_columns"][i]
+            for i in config["display_columns"]
+            if config["display_columns"][i] != rec_id
+        ]
+    counts = auto_resolve(review, columns=columns, rules=rules)
+    print(f"auto-resolved clusters: {counts}")
+    return counts
+
+
 def reload_page():
     """
     Actions when page is reloaded
 
-    1) loads local file from (temp) json
+    1) gets the ReviewSession kept in memory for this session; or, if this
+       process does not have an up to date one (e.g. the app was restarted),
+       rebuilds it from the local working set.
     2) gets hdfs and local paths for done and inprogress files.
 
     Parameters: None
 
-    Returns: local_file - dataframe used by the application(pandas dataframe),
+    Returns: review - the file and decisions used by the application(ReviewSession),
              local_in_prog_path - the temporary filepath in progress files are saved to (String)
              local_filepath_done - the temporary filepath done files are saved to (String)
              hdfs_in_prog_path - the hdfs filepath in progress files are saved to (String)
              hdfs_filepath_done(string) - the hdfs filepath done files are saved to (String)
 
     """
-    # load in pd dataframe
-    local_file = pd.read_json(session["working_file"]).sort_values(
-        by=["Sequential_Record_Id"]
-    )
-
     temp_local_path = f"{config['filespaces']['local_space'] + session['filename']}"
 
     # get the local filepath in_prog and done paths rename locally to in_prog_path
@@ -405,13 +1274,27 @@ def reload_page():
         temp_local_path, temp_local_path.split("/")
     )
 
+    # load the ReviewSession
+    version, review = recall_review()
+    if version != session.get("review_version"):
+        # the local working set, with the deltas of each request since it
+        # was written merged on (see write_working_changes)
+        pairwise = session.get("version") == "pairwise"
+        local_file = read_working_set(local_in_prog_path, pairwise)
+        if pairwise:
+            review = build_pairwise_review(local_file)
+        else:
+            review = build_review(local_file)
+        # the changes since the last save are not known, so save them all
+        session["delta_saves"] = None
+
     # get the hdfs filepath in_prog and done paths and rename in hdfs to in_prog_path
     hdfs_in_prog_path, hdfs_filepath_done = get_save_paths(
         session["full_path"], session["full_path"].split("/")
     )
     # return filepaths
     return (
-        local_file,
+        review,
         local_in_prog_path,
         local_filepath_done,
         hdfs_in_prog_path,
@@ -419,23 +1302,68 @@ def reload_page():
     )
 
 
-def set_session_variables(local_file):
+def store_review(review):
+    """
+    A function to keep the ReviewSession in memory for the next request, and
+    record the current cluster in the session.
+
+    Parameters: review (ReviewSession)
+    Returns: None
+    """
+    session["index"] = review.index
+    session.setdefault("review_key", uuid.uuid4().hex)
+    session["review_version"] = session.get("review_version", 0) + 1
+    with review_sessions_lock:
+        review_sessions[session["review_key"]] = (session["review_version"], review)
+        review_sessions.move_to_end(session["review_key"])
+        while len(review_sessions) > max(max_open_reviews, 1):
+            review_sessions.popitem(last=False)
+
+
+def recall_review():
+    """
+    A function to get the ReviewSession of this browser session kept in
+    memory, marking it as the most recently used.
+
+    Parameters: None
+    Returns: the version of the review stored (Int) and the review
+             (ReviewSession), or None and None if it is not in memory
+    """
+    key = session.get("review_key")
+    with review_sessions_lock:
+        if key not in review_sessions:
+            return None, None
+        review_sessions.move_to_end(key)
+        return review_sessions[key]
+
+
+def forget_review():
+    """
+    A function to drop the ReviewSession of this browser session from
+    memory, when its file is closed or another is opened.
+
+    Parameters: None
+    Returns: None
+    """
+    with review_sessions_lock:
+        review_sessions.pop(session.get("review_key"), None)
+
+
+def set_session_variables(review):
     """
     A function to set the session variables required.
     Index (main iterable to control flow of the application, based on cluster id)
     Select all toggle (initially set to off)
     Highlighter toggle (initially set to off)
 
-    Parameters: None
+    Parameters: review (ReviewSession)
 
     Returns: None
     """
     if "index" not in session:
-        session["index"] = int(
-            local_file["Sequential_Cluster_Id"][
-                (local_file.Match.values == "[]").argmax()
-            ]
-        )
+        first_undecided = review.first_undecided()
+        session["index"] = 0 if first_undecided is None else first_undecided
+    review.index = int(session["index"])
 
     # set select all toggle
     if "select_all" not in session:
@@ -446,45 +1374,39 @@ def set_session_variables(local_file):
         session["highlight_differences"] = 0
 
 
-def make_match(local_file, match_error):
+def make_match(review, match_error):
     """
     A function to declare a a group of records as a match. This gets selected records,
-    from checkboxes, and appends, 'No match for record ID' to the match column.
+    from checkboxes, and adds their record IDs to the match column.
     A comment is also added.
 
-    Parameters: local file (dataframe)
+    Parameters: review (ReviewSession)
                 match_error - error text to display on screen (String)
     Returns:    match_error - error text to display on screen (String)
 
     """
     # get record(s) selected by checkboxes
     cluster = request.form.getlist("cluster")
-    for i in cluster:
+    if cluster:
         # if only 1 selected, display on-screen message
-        if len(cluster) <= 1:
-            match_error = "you have only selected one record"
-
-        # if more than 1 selected; perform match and append comment
-        elif len(cluster) >= 2:
-            local_file.loc[local_file[rec_id] == i, "Match"] = str(cluster)
-            local_file.loc[local_file[rec_id] == i, "Comment"] = str(
-                request.form.get("Comment")
-            )
+        try:
+            review.match_records(cluster, str(request.form.get("Comment")))
             match_error = ""
+        except ValueError as error:
+            match_error = str(error)
 
-        # move on to next cluster if not at end of file
-    if local_file.Sequential_Cluster_Id.nunique() > int(session["index"]) + 1:
-        advance_cluster(local_file)
+    # move on to next cluster if not at end of file
+    advance_cluster(review)
 
     return match_error
 
 
-def make_non_match(local_file):
+def make_non_match(review):
     """
     A function to declare a record as non-match. This gets selected records,
     from checkboxes, and appends, 'No match for record ID' to the match column.
     A comment is also added.
-    Parameters: None
+    Parameters: review (ReviewSession)
 
     Returns: None
     """
@@ -492,52 +1414,186 @@ def make_non_match(local_file):
     cluster = request.form.getlist("cluster")
 
     # add result to match column
-    for i in cluster:
-        local_file.loc[local_file[rec_id] == i, "Match"] = (
-            f"['No Match In Cluster For {i}']"
-        )
-        local_file.loc[local_file[rec_id] == i, "Comment"] = str(
-            request.form.get("Comment")
-        )
+    review.non_match_records(cluster, str(request.form.get("Comment")))
 
     # move on to next cluster if at the end of a file
-    if local_file.Sequential_Cluster_Id.nunique() > int(session["index"]) + 1:
-        advance_cluster(local_file)
+    advance_cluster(review)
 
 
-def clear_cluster(local_file):
+def clear_cluster(review):
     """
     A function to clear the comments and matche results in a given cluster
 
-    Parameters: local_file (dataframe)
+    Parameters: review (ReviewSession)
     Returns: None
     """
+    review.clear()
 
-    # get lisy of ids's in cluster
-    cluster_ids = list(
-        local_file.loc[local_file["Sequential_Cluster_Id"] == session["index"]][
-            rec_id
-        ].values
-    )
 
-    # reset Match and Comment columns to their respective default.
-    for i in cluster_ids:
-        local_file.loc[local_file[rec_id] == i, "Match"] = "[]"
-        local_file.loc[local_file[rec_id] == i, "Comment"] = ""
+def get_pairs_per_page():
+    """
+    A function to get the number of record pairs shown on each page of the
+    pairwise version, from the pairs_per_page custom setting.
+
+    Parameters: None
+    Returns: pairs_per_page (Int)
+    """
+    return int(config.get("custom_setting", "pairs_per_page", fallback="20"))
+
+
+def get_page(review):
+    """
+    A function to get the page of record pairs the review is on; pages hold
+    pairs_per_page pairs, in review order.
+
+    Parameters: review (ReviewSession)
+    Returns: start - review queue position of the first pair on the page (Int)
+             stop - review queue position after the last pair on the page (Int)
+    """
+    pairs_per_page = get_pairs_per_page()
+    index = min(review.index, max(review.queue_length - 1, 0))
+    start = index - index % pairs_per_page
+    return start, min(start + pairs_per_page, review.queue_length)
+
+
+def move_page(review, pages):
+    """
+    A function to move a number of pages forwards (or backwards, if negative),
+    unless that would leave the file.
+
+    Parameters: review (ReviewSession)
+                pages - the number of pages to move (Int)
+    Returns: None
+    """
+    start, _ = get_page(review)
+    index = start + pages * get_pairs_per_page()
+    if 0 <= index < review.queue_length:
+        review.index = index
+
+
+def advance_page(review):
+    """
+    A function to progress to the next page if every record pair on the
+    current page has a decision against it.
+
+    Parameters: review (ReviewSession)
+    Returns: None
+    """
+    start, stop = get_page(review)
+    if all(review.is_cluster_done(review.queue[i]) for i in range(start, stop)):
+        move_page(review, 1)
 
 
-def set_continuation_message(local_file, cur_cluster_done):
+def make_page_decisions(review, advance=True):
+    """
+    A function to make the decisions submitted for every record pair on a
+    page, as one step for undo. Each pair on the page sends its row number
+    as "pair", and its decision ("match" or "non_match") and comment as
+    "decision_<row>" and "comment_<row>". Pairs left without a decision,
+    or whose decision and comment have not changed, are left as they are.
+
+    Parameters: review (ReviewSession)
+                advance - move on to the next page if every pair on this one
+                is decided (Boolean)
+    Returns: None
+    """
+    with review.step():
+        for pair in request.form.getlist("pair"):
+            if not pair.isdigit() or int(pair) >= review.num_records:
+                continue
+            row = int(pair)
+            decision = request.form.get(f"decision_{row}")
+            comment = str(request.form.get(f"comment_{row}", ""))
+            if decision == "match":
+                value = review.format.match_value([row])
+            elif decision == "non_match":
+                value = review.format.non_match_value(row)
+            else:
+                continue
+            if review.match[row] == value and review.comment[row] == comment:
+                continue
+            if decision == "match":
+                review.match_records([row], comment)
+            else:
+                review.non_match_records([row], comment)
+
+    # move on to the next page if every pair on this one is decided
+    if advance:
+        advance_page(review)
+
+
+def get_page_pairs(review):
+    """
+    A function to get the record pairs on the current page, ready to display:
+    each pair's values as a row per dataset and a column per header, with
+    the highlighter applied.
+
+    Parameters: review (ReviewSession)
+    Returns: headers - the column headers (List)
+             pairs - a dict for each pair on the page, with its row, number,
+             datasets, values, decision and comment (List)
+    """
+    headers, columns_by_dataset = get_pairwise_columns()
+    start, stop = get_page(review)
+    pairs = []
+    # each pair is its own cluster, numbered by row.
+    for number, row in enumerate(review.queue[start:stop], start + 1):
+        pair_frame = pd.DataFrame(
+            [
+                [
+                    "" if column is None else review.data.at[row, column]
+                    for column in columns
+                ]
+                for columns in columns_by_dataset.values()
+            ],
+            index=list(columns_by_dataset),
+            columns=headers,
+        )
+        # object columns, so the highlighter's Markup is kept as it is.
+        pair_frame = pair_frame.fillna("").astype(str).astype(object)
+        highlighter_func(headers, pair_frame)
+        if review.match[row] == review.format.match_value([row]):
+            decision = "match"
+        elif review.is_decided(row):
+            decision = "non_match"
+        else:
+            decision = ""
+        pairs.append(
+            {
+                "row": int(row),
+                "number": number,
+                "datasets": list(pair_frame.index),
+                "values": pair_frame.values,
+                "decision": decision,
+                "comment": review.comment[row],
+            }
+        )
+    return headers, pairs
+
+
+def set_pairwise_message(review):
+    """
+    A function to set the message displayed on screen in the pairwise
+    version, depending if every record pair has a decision.
+
+    Parameters: review (ReviewSession)
+    Returns:    done_message - message displayed on screen (String)
+    """
+    if review.is_done():
+        return "Matching Finished- Press save and close the application"
+    return "Keep Matching"
+
+
+def set_continuation_message(review, cur_cluster_done):
     """
     A function to change the message displayed on screen, depending if
     all the matching decisions have been made in a given cluster.
 
-    Parameters: local_file (pandas dataframe)
+    Parameters: review (ReviewSession)
                 cur_cluster_done - Boolean for if all records in a cluster are done (Boolean)
     Returns:    done_message - message displayed on screen (String)
     """
-    not_last_record = (
-        local_file.Sequential_Cluster_Id.nunique() > int(session["index"]) + 1
-    )
+    not_last_record = review.queue_length > review.index + 1
     if (not_last_record) or (cur_cluster_done == 0):
         done_message = "Keep Matching"
     elif (not not_last_record) and (cur_cluster_done == 1):
@@ -597,10 +1653,10 @@ def backup_save(
 
     """
     if session["index"] % int(config["custom_setting"]["backup_save"]) == 0:
-        # set s_thread
-        s_thread = Process(
-            target=save_thread,
-            args=(
+        # initiate save process
+        metrics.run_in_background(
+            save_thread,
+            (
                 local_in_prog_path,
                 hdfs_in_prog_path,
                 local_file,
@@ -608,8 +1664,6 @@ def backup_save(
                 hdfs_filepath_done,
             ),
         )
-        # initiate save process
-        s_thread.start()
 
 
 def clear_session():
@@ -619,7 +1673,52 @@ def clear_session():
     Parameters: None
     Returns: None
     """
+    forget_review()
     session_keys = list(session)
     for i in session_keys:
         if i != "font_choice":
             session.pop(i)
+
+
+def get_user_temp_folder():
+    """
+    A function to get the user specific temp folder within the local space.
+
+    Parameters: None
+    Returns: user_temp_folder (String)
+    """
+    return f"{config['filespaces']['local_space']}{user}"
+
+
+def prepare_user_temp_folder():
+    """
+    A function to create the tmp and user temp folders if they do not exist,
+    and clear out anything left in the user temp folder by a previous run.
+    This is called by the launcher, not on import, so that importing the app
+    has no side effects on the filespace.
+
+    Parameters: None
+    Returns: None
+    """
+    user_temp_folder = get_user_temp_folder()
+    os.makedirs(user_temp_folder, exist_ok=True)
+    clear_user_temp_folder()
+
+
+def clear_user_temp_folder():
+    """
+    A function to remove every file and folder in the user temp folder.
+
+    Parameters: None
+    Returns: None
+    """
+    user_temp_folder = get_user_temp_folder()
+    for filename in os.listdir(user_temp_folder):
+        file_path = os.path.join(user_temp_folder, filename)
+        try:
+            if os.path.isfile(file_path) or os.path.islink(file_path):
+                os.unlink(file_path)
+            elif os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+        except FileNotFoundError:
+            print("temp folder does not exist or is empty")
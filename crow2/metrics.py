@@ -0,0 +1,185 @@
+"""
+Timing instrumentation for the application.
+
+Timings are kept as Prometheus-style histograms, served in the text
+exposition format on the /metrics page, and each one is also written as a
+structured (json) log line to the "crow.metrics" logger.
+
+Saves run in a separate process (see run_in_background), so timings
+observed in a save process are sent back to the app process over a queue and
+picked up the next time the histograms are rendered.
+
+"""
+
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from multiprocessing import Process
+
+logger = logging.getLogger("crow.metrics")
+
+# upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HELP = {
+    "crow_request_seconds": "Time taken to handle a request, by endpoint.",
+    "crow_cluster_version_phase_seconds": "Time taken by each phase of /cluster_version.",
+    "crow_pairwise_version_phase_seconds": "Time taken by each phase of /pairwise_version.",
+    "crow_storage_call_seconds": "Time taken by each call to hdfs.",
+    "crow_background_save_seconds": "Time taken by a background save to hdfs.",
+}
+
+_lock = threading.Lock()
+_histograms = {}
+# set in a background process; the queue back to the app process.
+_child_observations = None
+_in_background_process = False
+
+
+def observe(name, seconds, **labels):
+    """
+    A function to record a timing in a histogram and log it.
+
+    Parameters: name - metric name (String)
+                seconds - the timing (Float)
+                labels - label names and values for the timing (String)
+    Returns: None
+    """
+    logger.info(
+        json.dumps(
+            {"event": "timing", "metric": name, "seconds": round(seconds, 6), **labels}
+        )
+    )
+    if _in_background_process:
+        # in a save process; hand the timing back to the app process.
+        _child_observations.put((name, seconds, labels))
+        return
+    _record(name, seconds, labels)
+
+
+def _record(name, seconds, labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.setdefault(
+            key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        )
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+def _drain_child_observations():
+    if _child_observations is None or _in_background_process:
+        return
+    while True:
+        try:
+            name, seconds, labels = _child_observations.get_nowait()
+        except queue.Empty:
+            return
+        _record(name, seconds, labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    A context manager to time the code inside it.
+
+    Parameters: name - metric name (String)
+                labels - label names and values for the timing (String)
+    Returns: None
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """
+    A decorator to time every call to a function.
+
+    Parameters: name - metric name (String)
+                labels - label names and values for the timing (String)
+    Returns: decorator (Function)
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_in_background(target, args):
+    """
+    A function to run a function in a separate process, timing the whole run
+    as a background save.
+
+    Parameters: target - function to run (Function)
+                args - arguments for the function (Tuple)
+    Returns: process (multiprocessing Process)
+    """
+    global _child_observations
+    if _child_observations is None:
+        _child_observations = multiprocessing.Queue()
+    process = Process(target=_run_timed, args=(_child_observations, target, args))
+    process.start()
+    return process
+
+
+def _run_timed(observations, target, args):
+    global _child_observations, _in_background_process
+    _child_observations = observations
+    _in_background_process = True
+    with timer("crow_background_save_seconds"):
+        target(*args)
+
+
+def _format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render():
+    """
+    A function to render every histogram in the Prometheus text format.
+
+    Parameters: None
+    Returns: metrics text (String)
+    """
+    _drain_child_observations()
+    lines = []
+    with _lock:
+        for name in sorted({name for name, _ in _histograms}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(BUCKETS, histogram["buckets"]):
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, le=bound)} {count}"
+                    )
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, le='+Inf')} "
+                    f"{histogram['count']}"
+                )
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(
+                    f"{name}_count{_format_labels(labels)} {histogram['count']}"
+                )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,63 @@
+"""
+Production entry point for the application.
+
+Runs the app on the waitress WSGI server with a pool of request threads,
+instead of the flask development server used by flask_new_flow.py.
+
+    python wsgi.py
+
+The app object can also be handed to any other WSGI server, for example
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+"""
+
+import argparse
+import os
+
+from flask_new_flow import app, config, prepare_app
+
+
+def get_server_settings():
+    """
+    A function to read the server settings from the config file.
+
+    Parameters: None
+    Returns: threads (Int), workers (Int)
+    """
+    if not config.has_section("server"):
+        return 8, 1
+    threads = config["server"].getint("threads", 8)
+    workers = config["server"].getint("workers", 1)
+    return threads, workers
+
+
+def serve(host, port, threads):
+    """
+    A function to serve the app with waitress.
+
+    Parameters: host - interface to listen on (String)
+                port - port to listen on (Int)
+                threads - number of request threads (Int)
+    Returns: None
+    """
+    from waitress import serve as waitress_serve
+
+    prepare_app(dev_mode=False)
+    print(
+        f"App is running on {host}:{port} with {threads} threads, press icon in "
+        "top corner to launch application."
+    )
+    waitress_serve(app, host=host, port=port, threads=threads)
+
+
+if __name__ == "__main__":
+    default_threads, _ = get_server_settings()
+    parser = argparse.ArgumentParser(description="Run CROW on waitress.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--port", type=int, default=int(os.environ.get("CDSW_APP_PORT", "8080"))
+    )
+    parser.add_argument("--threads", type=int, default=default_threads)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.threads)
@@ -0,0 +1,79 @@
+"""Headless code shared by the CROW1 and CROW2 front-ends."""
+
+from crow_core.auto_resolve import RULES, auto_resolve, parse_rules
+from crow_core.checkpoint import CheckpointWriter
+from crow_core.deltas import (
+    decision_changes,
+    delta_sequence,
+    deltas_folder,
+    read_deltas,
+    write_delta,
+)
+from crow_core.encoding import CATEGORY_RATIO, encode_categories
+from crow_core.files import (
+    FILE_TYPES,
+    file_columns,
+    iter_batches,
+    parse_partitions,
+    read_file,
+    write_file,
+)
+from crow_core.graph import connected_components
+from crow_core.priority import ORDERS, parse_order, prioritise
+from crow_core.progress import (
+    progress_metadata,
+    project_progress,
+    summarise_progress,
+)
+from crow_core.review_session import (
+    AUTO,
+    CARRIED,
+    CROW1_CLUSTER_FORMAT,
+    CROW1_PAIRWISE_FORMAT,
+    CROW2_FORMAT,
+    CROW2_PAIRWISE_FORMAT,
+    DecisionFormat,
+    Progress,
+    ReviewSession,
+    Step,
+)
+from crow_core.validation import check_clerical_file, file_size
+
+__all__ = [
+    "AUTO",
+    "CARRIED",
+    "CATEGORY_RATIO",
+    "CROW1_CLUSTER_FORMAT",
+    "CROW1_PAIRWISE_FORMAT",
+    "CROW2_FORMAT",
+    "CROW2_PAIRWISE_FORMAT",
+    "RULES",
+    "FILE_TYPES",
+    "ORDERS",
+    "CheckpointWriter",
+    "DecisionFormat",
+    "Progress",
+    "ReviewSession",
+    "Step",
+    "auto_resolve",
+    "check_clerical_file",
+    "connected_components",
+    "decision_changes",
+    "delta_sequence",
+    "deltas_folder",
+    "encode_categories",
+    "file_columns",
+    "file_size",
+    "iter_batches",
+    "parse_order",
+    "parse_partitions",
+    "parse_rules",
+    "prioritise",
+    "progress_metadata",
+    "project_progress",
+    "read_deltas",
+    "read_file",
+    "summarise_progress",
+    "write_delta",
+    "write_file",
+]
@@ -0,0 +1,227 @@
+"""Decide the clusters of a clerical file that need no clerical review.
+
+A pre-pass run when a file is loaded. Each rule is evaluated for every
+cluster at once, with numpy reductions over normalised values of the
+compared columns (trimmed, lower case, single spaces; blank, nan and -9 are
+missing and never agree with anything):
+
+singletons
+    A cluster of one record has no match in it.
+exact
+    Every record in the cluster agrees on every compared column.
+all_but_one
+    Every record in the cluster agrees on all but at most one compared
+    column. It needs at least two compared columns, or a cluster would
+    match with no column agreeing.
+
+Only clusters with no decisions yet are considered. The records of a
+cluster that a rule applies to are decided (a non-match for singletons, a
+match of the whole cluster otherwise), marked "auto" in the provenance
+column and left out of the review queue.
+
+In the pairwise version each row is a record pair, so the compared columns
+are given as pairs of columns (one per record) and singletons does not
+apply.
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+from crow_core.review_session import ReviewSession
+
+RULES = ("singletons", "exact", "all_but_one")
+
+MISSING_VALUES = ("", "nan", "none", "-9")
+
+
+def parse_rules(text: str) -> tuple:
+    """Read a comma-separated list of rules, as written in a config file.
+
+    Parameters
+    ----------
+    text : str
+        The rules, e.g. "singletons, exact". Blank for none.
+
+    Returns
+    -------
+    tuple
+        The rule names.
+
+    Raises
+    ------
+    ValueError
+        If a rule is not one of RULES.
+    """
+    rules = tuple(rule.strip() for rule in text.split(",") if rule.strip())
+    _check_rules(rules)
+    return rules
+
+
+def _check_rules(rules: Sequence) -> None:
+    """Raise a ValueError for any rule not in RULES."""
+    unknown = [rule for rule in rules if rule not in RULES]
+    if unknown:
+        raise ValueError(f"unknown auto-resolution rules {unknown}; use {RULES}")
+
+
+def normalise(values: pd.Series) -> np.ndarray:
+    """Code values so that equal values after normalisation get equal codes.
+
+    Parameters
+    ----------
+    values : pd.Series
+        The values of a column.
+
+    Returns
+    -------
+    np.ndarray
+        A code per value; -1 for missing values.
+    """
+    # normalise each distinct value once, then map the rows through it.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        raw_codes = values.cat.codes.to_numpy()
+        uniques = values.cat.categories.astype(str)
+    else:
+        raw_codes, uniques = pd.factorize(values.astype(str))
+    text = (
+        pd.Series(uniques).str.strip().str.lower().str.replace(r"\s+", " ", regex=True)
+    )
+    unique_codes = pd.factorize(text)[0]
+    unique_codes[text.isin(MISSING_VALUES).to_numpy()] = -1
+    codes = unique_codes[raw_codes]
+    codes[raw_codes < 0] = -1
+    return codes
+
+
+def cluster_disagreements(review: ReviewSession, columns: Sequence) -> np.ndarray:
+    """Count the columns the records of each cluster do not all agree on.
+
+    Parameters
+    ----------
+    review : ReviewSession
+        The clerical file.
+    columns : Sequence
+        The columns to compare.
+
+    Returns
+    -------
+    np.ndarray
+        The number of disagreeing columns of each cluster.
+    """
+    disagreements = np.zeros(review.num_clusters, dtype=np.int64)
+    if review.num_clusters == 0:
+        return disagreements
+    starts = review.offsets[:-1]
+    for column in columns:
+        codes = normalise(review.data[column])[review.rows_by_cluster]
+        lowest = np.minimum.reduceat(codes, starts)
+        highest = np.maximum.reduceat(codes, starts)
+        disagreements += (lowest != highest) | (lowest < 0)
+    return disagreements
+
+
+def pair_disagreements(review: ReviewSession, column_pairs: Sequence) -> np.ndarray:
+    """Count the columns the two records of each record pair disagree on.
+
+    Parameters
+    ----------
+    review : ReviewSession
+        The clerical file, with a record pair per row.
+    column_pairs : Sequence
+        (first record's column, second record's column) of each compared
+        column.
+
+    Returns
+    -------
+    np.ndarray
+        The number of disagreeing columns of each record pair (each
+        record pair is its own cluster, numbered by row).
+    """
+    disagreements = np.zeros(review.num_records, dtype=np.int64)
+    for first, second in column_pairs:
+        # code both columns together, so the codes are comparable.
+        codes = normalise(
+            pd.concat([review.data[first], review.data[second]], ignore_index=True)
+        )
+        first_codes = codes[: review.num_records]
+        second_codes = codes[review.num_records :]
+        disagreements += (
+            (first_codes != second_codes) | (first_codes < 0) | (second_codes < 0)
+        )
+    return disagreements
+
+
+def auto_resolve(
+    review: ReviewSession,
+    columns: Sequence | None = None,
+    column_pairs: Sequence | None = None,
+    rules: Sequence = RULES,
+) -> dict:
+    """Decide the clusters the rules apply to and take them out of the queue.
+
+    Parameters
+    ----------
+    review : ReviewSession
+        The clerical file.
+    columns : Sequence, optional
+        The columns to compare, for a file of clusters.
+    column_pairs : Sequence, optional
+        The pairs of columns to compare, for a file of record pairs.
+    rules : Sequence
+        The rules to apply, from RULES.
+
+    Returns
+    -------
+    dict
+        The number of clusters decided by each rule (a cluster both exact
+        and all_but_one apply to is counted under exact).
+
+    Raises
+    ------
+    ValueError
+        If a rule is not one of RULES, or all_but_one is given fewer than
+        two columns to compare.
+    """
+    rules = tuple(rules)
+    _check_rules(rules)
+    counts = dict.fromkeys(rules, 0)
+    if not rules:
+        return counts
+    compared = len(column_pairs) if column_pairs is not None else len(columns or [])
+    if "all_but_one" in rules and compared < 2:
+        raise ValueError(
+            f"the all_but_one auto-resolution rule needs at least 2 columns to "
+            f"compare, but {compared} given; add columns or remove the rule"
+        )
+
+    if column_pairs is not None:
+        disagreements = pair_disagreements(review, column_pairs)
+        # a record pair is never a singleton.
+        singleton = np.zeros(review.num_clusters, dtype=bool)
+        comparable = np.full(review.num_clusters, bool(column_pairs))
+    else:
+        columns = list(columns or [])
+        disagreements = cluster_disagreements(review, columns)
+        singleton = review.cluster_sizes == 1
+        comparable = (review.cluster_sizes > 1) & bool(columns)
+    undecided = review.decided_in_cluster == 0
+
+    non_match = np.zeros(review.num_clusters, dtype=bool)
+    match = np.zeros(review.num_clusters, dtype=bool)
+    if "singletons" in rules:
+        non_match = singleton & undecided
+        counts["singletons"] = int(non_match.sum())
+    if "exact" in rules:
+        exact = comparable & undecided & (disagreements == 0)
+        counts["exact"] = int(exact.sum())
+        match |= exact
+    if "all_but_one" in rules:
+        all_but_one = comparable & undecided & (disagreements <= 1) & ~match
+        counts["all_but_one"] = int(all_but_one.sum())
+        match |= all_but_one
+
+    if match.any() or non_match.any():
+        review.decide_without_review(np.flatnonzero(match), np.flatnonzero(non_match))
+    return counts
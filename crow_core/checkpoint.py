@@ -0,0 +1,104 @@
+"""Save checkpoints of a review on a background thread.
+
+The desktop front-ends save the file every so many decisions, so a crash
+loses little work. On a large file a save takes seconds, and made on the Tk
+main loop it freezes the window for that long. A CheckpointWriter makes
+them on a background thread instead. The front-end hands it a snapshot of
+the decisions (see ReviewSession.snapshot), a copy that decisions made
+while it is written do not change, and carries on.
+
+A checkpoint submitted while another is still waiting replaces it, as it
+has every decision the other has. flush() waits for the last checkpoint to
+be written; call it before renaming the file or saving it for the last
+time.
+"""
+
+import threading
+import time
+from collections.abc import Callable
+
+
+class CheckpointWriter:
+    """Writes checkpoints one at a time, on a background thread.
+
+    Parameters
+    ----------
+    write : Callable
+        Called on the background thread with the arguments given to
+        submit, to write a checkpoint.
+    """
+
+    def __init__(self, write: Callable[..., None]) -> None:
+        """Start the background thread."""
+        self._write = write
+        self._condition = threading.Condition()
+        self._pending = None
+        self._writing = False
+        self._error = None
+        self._saved_at = None
+        # a daemon, so an unsaved window can still be closed; the files are
+        # written to a temporary name, so an interrupted write leaves the
+        # last checkpoint in place.
+        self._thread = threading.Thread(
+            target=self._run, name="crow-checkpoints", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, *args) -> None:
+        """Write a checkpoint in the background, in place of any waiting.
+
+        Parameters
+        ----------
+        *args
+            The arguments to write, e.g. a snapshot and the file name.
+        """
+        with self._condition:
+            self._pending = args
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        """Wait until every checkpoint submitted has been written.
+
+        Raises
+        ------
+        Exception
+            Whatever the last checkpoint written raised, if it failed.
+        """
+        with self._condition:
+            while self._pending is not None or self._writing:
+                self._condition.wait()
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    @property
+    def status(self) -> str:
+        """A line for the front-end to show about the checkpoints."""
+        with self._condition:
+            if self._pending is not None or self._writing:
+                return "Saving..."
+            if self._error is not None:
+                return "Checkpoint save failed"
+            if self._saved_at is not None:
+                return time.strftime("Saved %H:%M:%S", self._saved_at)
+            return ""
+
+    def _run(self) -> None:
+        """Write the checkpoints submitted, as they come."""
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                args, self._pending = self._pending, None
+                self._writing = True
+            error = None
+            try:
+                self._write(*args)
+            except Exception as exc:  # reported by status, raised by flush
+                error = exc
+            with self._condition:
+                self._writing = False
+                self._error = error
+                if error is None:
+                    self._saved_at = time.localtime()
+                self._condition.notify_all()
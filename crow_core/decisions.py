@@ -0,0 +1,150 @@
+"""Read the decisions of a clerical file as the records each record matches.
+
+Each front-end stores a record's decision in its own way (see the
+DecisionFormat of each in crow_core.review_session): crow2 as a stringified
+list of the ids matched, "['r1', 'r2']", crow1's cluster version as the ids
+joined with trailing commas, "r1,r2,", and each with its own text for no
+match. Tools working across files (merging, comparing reviewers, resolving
+entities) read them all into one form: the sorted list of the record ids a
+record was matched with, itself included; an empty list for no match; and
+None for no decision yet.
+
+The brackets, quotes and separators are taken off, and the ids sorted, with
+pyarrow compute functions over the whole column; only the rare crow2 values
+whose ids need quoting other than '...' are read with ast.literal_eval.
+"""
+
+import ast
+
+import numpy as np
+import pandas as pd
+
+from crow_core.review_session import (
+    CROW1_CLUSTER_FORMAT,
+    CROW2_FORMAT,
+    DecisionFormat,
+)
+
+# The separator of the ids in a match key (see match_keys).
+KEY_SEPARATOR = "\x1f"
+
+
+def detect_format(data: pd.DataFrame) -> DecisionFormat:
+    """Find which front-end's format the decisions of a file are in.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        A clerical file of the cluster version of either front-end.
+
+    Returns
+    -------
+    DecisionFormat
+        CROW2_FORMAT or CROW1_CLUSTER_FORMAT.
+
+    Raises
+    ------
+    ValueError
+        If the file has no match column.
+    """
+    if CROW2_FORMAT.match_col not in data.columns:
+        raise ValueError(f"no {CROW2_FORMAT.match_col} column of decisions")
+    if "Sequential_Cluster_Id" in data.columns:
+        return CROW2_FORMAT
+    values = data[CROW2_FORMAT.match_col].dropna().astype(str)
+    if values.str.startswith("[").any():
+        return CROW2_FORMAT
+    if CROW2_FORMAT.comment_col in data.columns:
+        return CROW2_FORMAT
+    return CROW1_CLUSTER_FORMAT
+
+
+def parse_matches(values: pd.Series, decision_format: DecisionFormat) -> pd.Series:
+    """Read a column of decisions as the records each record matches.
+
+    Parameters
+    ----------
+    values : pd.Series
+        The match column of a clerical file.
+    decision_format : DecisionFormat
+        CROW2_FORMAT or CROW1_CLUSTER_FORMAT.
+
+    Returns
+    -------
+    pd.Series
+        For each record, the sorted list of ids it was matched with
+        (itself included), [] for no match, or None for no decision, as
+        a pyarrow list column.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    text = pa.array(
+        values.astype(object).where(values.notna(), "").to_numpy(), type=pa.string()
+    )
+    text = pc.utf8_trim_whitespace(text)
+    undecided = pc.or_(
+        pc.equal(text, str(decision_format.undecided)), pc.equal(text, "")
+    )
+    if decision_format is CROW2_FORMAT:
+        no_match = pc.starts_with(text, "['No Match In Cluster For ")
+        quoted = pc.utf8_slice_codeunits(text, 2, -2)
+        lists = pc.split_pattern(quoted, "', '")
+        simple = pc.and_(
+            pc.starts_with(text, "['"),
+            pc.invert(pc.match_substring_regex(quoted, r"[\"\\]")),
+        )
+        tricky = np.flatnonzero(
+            ~(
+                undecided.to_numpy(False)
+                | no_match.to_numpy(False)
+                | simple.to_numpy(False)
+            )
+        )
+        if len(tricky):
+            lists = lists.to_pylist()
+            for row in tricky:
+                lists[row] = [
+                    str(record) for record in ast.literal_eval(text[row].as_py())
+                ]
+            lists = pa.array(lists, type=pa.list_(pa.string()))
+    else:
+        no_match = pc.equal(text, CROW1_CLUSTER_FORMAT.non_match_value(None))
+        lists = pc.split_pattern(pc.utf8_rtrim(text, ","), ",")
+    matched = ~(undecided.to_numpy(False) | no_match.to_numpy(False))
+
+    # the ids of the matched rows, sorted within each row.
+    lengths = pc.list_value_length(lists).to_numpy(False)
+    flat = pc.list_flatten(lists).filter(pa.array(np.repeat(matched, lengths)))
+    lengths = np.where(matched, lengths, 0)
+    parents = np.repeat(np.arange(len(lengths)), lengths)
+    order = pc.sort_indices(
+        pa.table({"row": parents, "id": flat}),
+        sort_keys=[("row", "ascending"), ("id", "ascending")],
+    )
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    matches = pa.LargeListArray.from_arrays(
+        pa.array(offsets), flat.take(order), mask=undecided
+    )
+    return pd.Series(matches, index=values.index, dtype=pd.ArrowDtype(matches.type))
+
+
+def match_keys(matches: pd.Series) -> pd.Series:
+    """Turn parsed decisions into strings that are equal for equal decisions.
+
+    Parameters
+    ----------
+    matches : pd.Series
+        From parse_matches.
+
+    Returns
+    -------
+    pd.Series
+        The ids joined by KEY_SEPARATOR; "" for no match, None for no
+        decision.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    keys = pc.binary_join(pa.array(matches), KEY_SEPARATOR)
+    return pd.Series(keys, index=matches.index, dtype=pd.ArrowDtype(pa.string()))
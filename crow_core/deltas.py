@@ -0,0 +1,243 @@
+"""Save the decisions changed since the last save, rather than the whole file.
+
+Saving a large clerical file after a few decisions need not rewrite it. A
+front-end can instead write the records whose decisions changed (their key
+and decision columns) as a small parquet file, a delta, to a folder next to
+the file (<file>.decisions), and only now and then rewrite the file itself
+with the deltas folded in.
+
+Each delta is keyed by a record id column or, for files whose records have
+no id (the pairwise version's), by row position in a ROW_KEY column. Delta
+files are named by a sequence number, e.g. the time the save started, and
+where two disagree about a record the later one wins.
+
+read_file merges the deltas onto the file it reads, and write_file folds
+those of its source into the file it writes, so readers see the file as it
+was last saved either way.
+"""
+
+import os
+import re
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+# The folder the deltas of a file are kept in is the file's path with this
+# added.
+DELTAS_SUFFIX = ".decisions"
+
+# The key column of deltas keyed by row position.
+ROW_KEY = "__row__"
+
+_DELTA_NAME = re.compile(r"part-(\d+)\.parquet$")
+
+
+def deltas_folder(path: str | os.PathLike) -> str:
+    """Get the folder the deltas of a file are kept in.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        The file (or folder of parquet files).
+
+    Returns
+    -------
+    str
+        The deltas folder.
+    """
+    return f"{os.fspath(path).rstrip('/')}{DELTAS_SUFFIX}"
+
+
+def delta_sequence(path: str) -> int | None:
+    """Get the sequence number of a delta file from its name.
+
+    Parameters
+    ----------
+    path : str
+        The delta file.
+
+    Returns
+    -------
+    int or None
+        The sequence number, or None if path is not a delta file.
+    """
+    found = _DELTA_NAME.search(path)
+    return None if found is None else int(found.group(1))
+
+
+def decision_changes(
+    data: pd.DataFrame, rows: Sequence, key: str | None, columns: Sequence
+) -> pd.DataFrame:
+    """Take the key and decision columns of the rows that changed.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file.
+    rows : Sequence
+        The row positions whose decisions changed.
+    key : str or None
+        The record id column; if None, rows are keyed by position.
+    columns : Sequence
+        The decision columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        The delta: the key column, then the decision columns as text.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    changes = pd.DataFrame(
+        {ROW_KEY: rows} if key is None else {key: data[key].to_numpy()[rows]}
+    )
+    for column in columns:
+        # as text, so a column holding 1/0 and "" can be written.
+        changes[column] = [
+            "" if pd.isna(value) else str(value)
+            for value in data[column].to_numpy()[rows]
+        ]
+    return changes
+
+
+def write_delta(
+    changes: pd.DataFrame, folder: str, sequence: int, metadata: dict | None = None
+) -> str:
+    """Write a delta to a deltas folder.
+
+    Parameters
+    ----------
+    changes : pd.DataFrame
+        The delta, from decision_changes.
+    folder : str
+        The deltas folder.
+    sequence : int
+        Orders the deltas of a file; a later delta overrides an earlier one.
+    metadata : dict, optional
+        Key-value metadata to write into the delta's footer, e.g. the
+        progress of the review (see crow_core.progress).
+
+    Returns
+    -------
+    str
+        The delta file written.
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"part-{sequence:020d}.parquet")
+    if metadata:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(changes, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), **metadata}
+        )
+        pq.write_table(table, path)
+    else:
+        changes.to_parquet(path, index=False)
+    return path
+
+
+def read_deltas(
+    folder: str, filesystem=None, after: int | None = None
+) -> pd.DataFrame | None:
+    """Read the deltas of a file into one, the latest change of each record.
+
+    Parameters
+    ----------
+    folder : str
+        The deltas folder.
+    filesystem : pyarrow.fs.FileSystem, optional
+        The file system to read from; defaults to local disk.
+    after : int, optional
+        Only read the deltas with a later sequence number, e.g. those
+        written since some were last read.
+
+    Returns
+    -------
+    pd.DataFrame or None
+        The key column, then the decision columns; None if there are no
+        deltas.
+    """
+    if filesystem is None and not os.path.isdir(folder):
+        return None
+    import pyarrow.fs as fs
+    import pyarrow.parquet as pq
+
+    filesystem = filesystem or fs.LocalFileSystem()
+    selector = fs.FileSelector(folder, allow_not_found=True)
+    paths = sorted(
+        info.path
+        for info in filesystem.get_file_info(selector)
+        if delta_sequence(info.path) is not None
+        and (after is None or delta_sequence(info.path) > after)
+    )
+    if not paths:
+        return None
+    deltas = pd.concat(
+        [pq.read_table(path, filesystem=filesystem).to_pandas() for path in paths],
+        ignore_index=True,
+    )
+    return deltas.drop_duplicates(deltas.columns[0], keep="last")
+
+
+def apply_deltas(
+    data: pd.DataFrame, deltas: pd.DataFrame, columns: Sequence | None = None
+) -> pd.DataFrame:
+    """Write the decisions in deltas over those of data, in place.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file, with the key column of deltas.
+    deltas : pd.DataFrame
+        From read_deltas.
+    columns : Sequence, optional
+        The decision columns to apply; defaults to every one in deltas.
+        Those data does not have are added.
+
+    Returns
+    -------
+    pd.DataFrame
+        data.
+    """
+    key = deltas.columns[0]
+    if key == ROW_KEY:
+        rows = deltas[ROW_KEY].to_numpy(dtype=np.int64, copy=True)
+        rows[rows >= len(data)] = -1
+    else:
+        # compared as strings, as a front-end may have read them as such.
+        rows = pd.Index(data[key].astype(str)).get_indexer(deltas[key].astype(str))
+    for column in deltas.columns[1:]:
+        if columns is not None and column not in columns:
+            continue
+        if column in data.columns:
+            values = data[column].to_numpy(dtype=object, copy=True)
+        else:
+            values = np.full(len(data), None, dtype=object)
+        changed = deltas[column].to_numpy(dtype=object)
+        found = (rows >= 0) & ~pd.isna(changed)
+        values[rows[found]] = changed[found]
+        data[column] = values
+    return data
+
+
+def unapplied_deltas(deltas: pd.DataFrame, data: pd.DataFrame) -> pd.DataFrame:
+    """Get the changes in deltas to records that are not in data.
+
+    Parameters
+    ----------
+    deltas : pd.DataFrame
+        From read_deltas.
+    data : pd.DataFrame
+        The records that were read, with the key column of deltas.
+
+    Returns
+    -------
+    pd.DataFrame
+        The rows of deltas for other records (e.g. other partitions).
+    """
+    key = deltas.columns[0]
+    if key == ROW_KEY:
+        return deltas[deltas[ROW_KEY] >= len(data)]
+    return deltas[~deltas[key].astype(str).isin(data[key].astype(str))]
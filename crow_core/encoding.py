@@ -0,0 +1,69 @@
+"""Dictionary-encode the low-cardinality columns of a clerical file.
+
+Columns such as the dataset, sex, postcode or a date of birth part repeat a
+handful of values across every record. Held as Python strings, each row
+costs a pointer and (for values read from a file) a string object of its
+own; held as a pandas categorical, each row costs a small integer code and
+each distinct value is stored once.
+
+A column is encoded when its number of distinct values is at most
+CATEGORY_RATIO of its number of rows, so a name or record id column is left
+as it is. The values are encoded as text, as the front-ends display them.
+Nothing needs decoding up front: the front-ends take the records of the
+cluster on screen and convert just those rows with astype(str).
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+# The most distinct values, as a share of the rows, a column may have to be
+# encoded.
+CATEGORY_RATIO = 0.5
+
+
+def encode_categories(
+    data: pd.DataFrame,
+    columns: Sequence | None = None,
+    max_ratio: float = CATEGORY_RATIO,
+    missing: str | None = None,
+) -> list:
+    """Dictionary-encode the low-cardinality columns of data, in place.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file.
+    columns : Sequence, optional
+        The columns that may be encoded; defaults to every column. Do not
+        include columns that decisions are written to.
+    max_ratio : float, optional
+        The most distinct values, as a share of the rows, a column may have.
+    missing : str, optional
+        The text for missing values; by default they stay missing.
+
+    Returns
+    -------
+    list
+        The columns encoded.
+    """
+    encoded = []
+    for column in data.columns if columns is None else columns:
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            continue
+        codes, uniques = pd.factorize(values)
+        if len(uniques) > max_ratio * len(values):
+            continue
+        # values that only differ in type (1 and "1") share their text, so
+        # code the text of each distinct value; the last code is missing.
+        text = [str(value) for value in uniques]
+        if missing is not None:
+            text.append(missing)
+        text_codes, categories = pd.factorize(pd.Index(text, dtype=object))
+        if missing is None:
+            text_codes = np.append(text_codes, -1)
+        data[column] = pd.Categorical.from_codes(text_codes[codes], categories)
+        encoded.append(column)
+    return encoded
@@ -0,0 +1,676 @@
+"""Read and write clerical files as CSV, parquet or Arrow IPC.
+
+The format is chosen by the file extension, so the _inProgress/_DONE file
+names the front-ends give a file keep working whatever its format, or can be
+given for files without one.
+
+Arrow IPC files (.arrow, .feather, .ipc) are opened memory-mapped: the file
+is paged in from the operating system's cache rather than read into a
+buffer and parsed, and they are written uncompressed so they can be. Parquet
+and Arrow IPC need pyarrow, which is imported only when one is used.
+
+Only the columns a front-end needs are read (see file_columns and the
+columns argument of read_file). When the file is saved, the decision columns
+are joined back onto the full file on disk, by record id or by row, reading
+and writing it a batch of rows at a time; the other columns are copied as
+they are, so memory and load time depend on the columns read, not the width
+of the file.
+
+Files too large to read at once can be read a batch of rows at a time (see
+iter_batches).
+
+A parquet file may also be a folder of parquet files, such as Spark writes,
+partitioned hive-style (region=North/part-0.parquet). The part files are
+read in parallel, the partition keys are read as columns, and a read can be
+limited to some of the partitions (see parse_partitions). A save joins the
+decisions onto each part file of the partitions that were read and copies
+the others as they are, so the folder keeps its layout.
+
+Decisions saved as deltas next to a file (see crow_core.deltas) are merged
+onto it when it is read, and folded into it when it is written.
+
+A save can also write key-value metadata into the file, e.g. the progress
+of the review (see crow_core.progress): into the footer of a parquet file,
+the schema of an Arrow IPC file or, for a folder of parquet files, its
+_common_metadata file. CSV files have nowhere to keep it.
+
+Files are written to a temporary file next to them and then moved into
+place, so an interrupted save never leaves a half-written file, the file
+being joined onto can be the one being replaced, and a file that is still
+memory-mapped is replaced rather than overwritten.
+"""
+
+import os
+import shutil
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from crow_core.deltas import (
+    ROW_KEY,
+    apply_deltas,
+    deltas_folder,
+    read_deltas,
+    unapplied_deltas,
+    write_delta,
+)
+
+CSV_SUFFIXES = (".csv",)
+PARQUET_SUFFIXES = (".parquet",)
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+FORMATS = {
+    **dict.fromkeys(CSV_SUFFIXES, "csv"),
+    **dict.fromkeys(PARQUET_SUFFIXES, "parquet"),
+    **dict.fromkeys(ARROW_SUFFIXES, "arrow"),
+}
+
+# For tkinter's file dialogs: every supported file first, then each format.
+FILE_TYPES = (
+    ("Clerical files", " ".join(f"*{s}" for s in FORMATS)),
+    ("CSV files", " ".join(f"*{s}" for s in CSV_SUFFIXES)),
+    ("Parquet files", " ".join(f"*{s}" for s in PARQUET_SUFFIXES)),
+    ("Arrow IPC files", " ".join(f"*{s}" for s in ARROW_SUFFIXES)),
+)
+
+# Rows read at a time when joining decisions back onto a file.
+BATCH_SIZE = 100_000
+
+
+def _format(path: str | os.PathLike, file_format: str | None) -> str:
+    """Get the format of a file from its extension, unless given."""
+    if file_format is not None:
+        if file_format not in FORMATS.values():
+            raise ValueError(f"unknown file format {file_format!r}")
+        return file_format
+    suffix = Path(path).suffix.lower()
+    if suffix not in FORMATS:
+        raise ValueError(
+            f"{path} is not a CSV, parquet or Arrow IPC file "
+            f"(expected one of {tuple(FORMATS)})"
+        )
+    return FORMATS[suffix]
+
+
+def _parquet_dataset(path: str | os.PathLike, filesystem=None):
+    """Open a parquet file, or a folder of them, as a pyarrow dataset."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    options = {"filesystem": filesystem, "format": "parquet", "partitioning": "hive"}
+    dataset = ds.dataset(path, **options)
+    if len(dataset.files) <= 1:
+        return dataset
+    # the columns of every part file, not just the first; e.g. only the
+    # partitions reviewed so far have decision columns.
+    schema = pa.unify_schemas(
+        [dataset.schema]
+        + [fragment.physical_schema for fragment in dataset.get_fragments()]
+    )
+    return ds.dataset(path, schema=schema, **options)
+
+
+def parse_partitions(text: str) -> dict:
+    """Read the partitions to load, as written in a config file or form.
+
+    Parameters
+    ----------
+    text : str
+        Comma-separated key=value pairs, e.g. "region=North, batch=3"; a
+        key given more than once matches any of its values.
+
+    Returns
+    -------
+    dict
+        The values of each partition key.
+
+    Raises
+    ------
+    ValueError
+        If a pair has no "=".
+    """
+    partitions = {}
+    for pair in text.split(","):
+        if not pair.strip():
+            continue
+        if "=" not in pair:
+            raise ValueError(f"expected key=value for a partition, got {pair!r}")
+        key, value = (part.strip() for part in pair.split("=", 1))
+        partitions.setdefault(key, []).append(value)
+    return partitions
+
+
+def _partition_filter(dataset, partitions: dict | None):
+    """Get the filter expression selecting some partitions of a dataset."""
+    if not partitions:
+        return None
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    keys = dataset.partitioning.schema.names if dataset.partitioning else []
+    expression = None
+    for key, values in partitions.items():
+        if key not in keys:
+            raise ValueError(f"{key} is not a partition of the file (has {keys})")
+        # partition values are typed from the folder names, e.g. batch=3 as int.
+        values = pa.array(values).cast(dataset.schema.field(key).type)
+        condition = ds.field(key).isin(values)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def file_columns(
+    path: str | os.PathLike, file_format: str | None = None, filesystem=None
+) -> list:
+    """Get the columns of a file, without reading its rows.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        A CSV, parquet or Arrow IPC file (or a folder of parquet files).
+    file_format : str, optional
+        "csv", "parquet" or "arrow"; defaults to the file's extension.
+    filesystem : pyarrow.fs.FileSystem, optional
+        For parquet, the file system to read from; defaults to local disk.
+
+    Returns
+    -------
+    list
+        The column names, in file order.
+    """
+    file_format = _format(path, file_format)
+    if file_format == "csv":
+        return list(pd.read_csv(path, nrows=0).columns)
+    if file_format == "parquet":
+        return _parquet_dataset(path, filesystem).schema.names
+
+    import pyarrow as pa
+
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def read_file(
+    path: str | os.PathLike,
+    columns: Sequence | None = None,
+    file_format: str | None = None,
+    partitions: dict | None = None,
+    filesystem=None,
+) -> pd.DataFrame:
+    """Read a clerical file, with any decisions saved as deltas merged on.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        A .csv, .parquet, .arrow, .feather or .ipc file (or a folder of
+        parquet files).
+    columns : Sequence, optional
+        The columns to read; defaults to every column.
+    file_format : str, optional
+        "csv", "parquet" or "arrow"; defaults to the file's extension.
+    partitions : dict, optional
+        For a partitioned folder of parquet files, the values of each
+        partition key to read (see parse_partitions); defaults to all.
+    filesystem : pyarrow.fs.FileSystem, optional
+        For parquet, the file system to read from, a row group at a time;
+        defaults to local disk.
+
+    Returns
+    -------
+    pd.DataFrame
+        The clerical file.
+
+    Raises
+    ------
+    ValueError
+        If the file is not one of the supported formats, or partitions are
+        given for a file that does not have them (or whose deltas are
+        keyed by row position).
+    """
+    file_format = _format(path, file_format)
+    columns = None if columns is None else list(columns)
+    if partitions and file_format != "parquet":
+        raise ValueError("only folders of parquet files have partitions")
+    deltas = read_deltas(deltas_folder(path), filesystem)
+    if deltas is None:
+        return _read(path, columns, file_format, partitions, filesystem)
+    key = deltas.columns[0]
+    if key == ROW_KEY and partitions:
+        raise ValueError(
+            "the file has decisions saved by row position, so cannot be read "
+            "a partition at a time"
+        )
+    read_columns = columns
+    if columns is not None and key != ROW_KEY and key not in columns:
+        # the deltas are matched to the records by key.
+        read_columns = columns + [key]
+    data = apply_deltas(
+        _read(path, read_columns, file_format, partitions, filesystem),
+        deltas,
+        columns,
+    )
+    return data if read_columns is columns else data[columns]
+
+
+def iter_batches(
+    path: str | os.PathLike,
+    columns: Sequence | None = None,
+    file_format: str | None = None,
+    filesystem=None,
+    batch_size: int = BATCH_SIZE,
+):
+    """Read a file a batch of rows at a time, as it is on disk.
+
+    For files too large to read at once, e.g. linkage output being split
+    into clerical files. Deltas are not merged on. CSV values are read as
+    text, so ids such as 007 are kept as they are.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        A CSV, parquet or Arrow IPC file (or a folder of parquet files).
+    columns : Sequence, optional
+        The columns to read; defaults to every column.
+    file_format : str, optional
+        "csv", "parquet" or "arrow"; defaults to the file's extension.
+    filesystem : pyarrow.fs.FileSystem, optional
+        The file system to read from; defaults to local disk.
+    batch_size : int, optional
+        The most rows in a batch.
+
+    Yields
+    ------
+    pyarrow.RecordBatch
+        The next rows of the file.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    file_format = _format(path, file_format)
+    columns = None if columns is None else list(columns)
+    if file_format == "parquet":
+        dataset = _parquet_dataset(path, filesystem)
+    elif file_format == "csv":
+        import pyarrow.csv as csv
+
+        names = file_columns(path, file_format)
+        options = csv.ConvertOptions(
+            column_types=dict.fromkeys(names, pa.string()),
+            strings_can_be_null=False,
+            quoted_strings_can_be_null=False,
+        )
+        dataset = ds.dataset(
+            path,
+            format=ds.CsvFileFormat(convert_options=options),
+            filesystem=filesystem,
+        )
+    else:
+        dataset = ds.dataset(path, format="ipc", filesystem=filesystem)
+    yield from dataset.to_batches(
+        columns=columns, batch_size=batch_size, use_threads=True
+    )
+
+
+def _read(
+    path: str | os.PathLike,
+    columns: list | None,
+    file_format: str,
+    partitions: dict | None,
+    filesystem,
+) -> pd.DataFrame:
+    """Read the columns of a file, as it is on disk."""
+    if file_format == "csv":
+        # every value as text, as a save reads the file to join onto it, so
+        # e.g. a record id of 007 is not read as 7 and then not found.
+        return pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False)
+    if file_format == "parquet":
+        dataset = _parquet_dataset(path, filesystem)
+        table = dataset.to_table(
+            columns=columns,
+            filter=_partition_filter(dataset, partitions),
+            use_threads=True,
+        )
+        return table.to_pandas()
+
+    import pyarrow as pa
+
+    with pa.memory_map(str(path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas()
+
+
+def _arrow_compatible(data: pd.DataFrame) -> pd.DataFrame:
+    """Write columns holding values of mixed types as strings.
+
+    Arrow needs one type per column; e.g. the pairwise match column holds
+    1/0 for decisions and "" for none.
+    """
+    mixed = [
+        column
+        for column in data.columns
+        if data[column].dtype == object
+        and pd.api.types.infer_dtype(data[column], skipna=True)
+        not in ("string", "empty")
+    ]
+    if not mixed:
+        return data
+    data = data.copy(deep=False)
+    for column in mixed:
+        data[column] = data[column].map(
+            lambda value: "" if pd.isna(value) else str(value)
+        )
+    return data
+
+
+class _Joiner:
+    """Finds the rows of the data for each batch of rows of the file."""
+
+    def __init__(self, data: pd.DataFrame, key: str | None) -> None:
+        self.key = key
+        self.num_rows = len(data)
+        self.offset = 0
+        if key is not None:
+            # compared as strings, as a front-end may have read them as such.
+            self.ids = pd.Index(data[key].astype(str))
+
+    def rows(self, keys: pd.Series | None, num_rows: int) -> np.ndarray:
+        """Get the rows of the data for the next num_rows rows of the file."""
+        if self.key is None:
+            rows = np.arange(self.offset, self.offset + num_rows)
+            self.offset += num_rows
+            if self.offset > self.num_rows:
+                raise ValueError("the file has more rows than the data")
+            return rows
+        rows = self.ids.get_indexer(keys.astype(str))
+        if (rows < 0).any():
+            raise ValueError(f"the file has {self.key} values not in the data")
+        return rows
+
+    def finish(self) -> None:
+        """Check every row of the data was matched to a row of the file."""
+        if self.key is None and self.offset != self.num_rows:
+            raise ValueError("the file has fewer rows than the data")
+
+
+def _write_joined(
+    data: pd.DataFrame,
+    temporary: str,
+    source: str | os.PathLike,
+    key: str | None,
+    columns: list,
+    file_format: str,
+    partitions: dict | None = None,
+    metadata: dict | None = None,
+) -> None:
+    """Write the file at source to temporary, with columns taken from data."""
+    joiner = _Joiner(data, key)
+    if file_format == "csv":
+        # read every value as text, so the other columns are copied as is.
+        chunks = pd.read_csv(
+            source, dtype=str, keep_default_na=False, chunksize=BATCH_SIZE
+        )
+        header = True
+        for chunk in chunks:
+            rows = joiner.rows(chunk[key] if key else None, len(chunk))
+            for column in columns:
+                chunk[column] = data[column].to_numpy()[rows]
+            chunk.to_csv(
+                temporary, index=False, header=header, mode="w" if header else "a"
+            )
+            header = False
+        joiner.finish()
+        if header:
+            data.to_csv(temporary, index=False)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    joined = pa.Table.from_pandas(
+        _arrow_compatible(data[columns]), preserve_index=False
+    )
+
+    if file_format == "parquet" and os.path.isdir(source):
+        _write_joined_folder(
+            joined, joiner, temporary, source, key, columns, partitions, metadata
+        )
+        joiner.finish()
+        return
+
+    def batches():
+        if file_format == "parquet":
+            yield from pq.ParquetFile(source).iter_batches(batch_size=BATCH_SIZE)
+            return
+        with pa.memory_map(str(source)) as mapped:
+            reader = pa.ipc.open_file(mapped)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+    tables = _join_batches(batches(), joined, joiner, key, columns)
+    written = _write_tables(tables, temporary, file_format, metadata)
+    joiner.finish()
+    if not written:
+        # an empty file; there is nothing to join onto.
+        _write(data, temporary, file_format, metadata)
+
+
+def _join_batches(batches, joined, joiner: _Joiner, key: str | None, columns: list):
+    """Put the rows of joined matching each batch of the file into it."""
+    import pyarrow as pa
+
+    for batch in batches:
+        table = pa.Table.from_batches([batch])
+        keys = table.column(key).to_pandas() if key else None
+        taken = joined.take(joiner.rows(keys, table.num_rows))
+        for column in columns:
+            if column in table.column_names:
+                table = table.set_column(
+                    table.column_names.index(column), column, taken.column(column)
+                )
+            else:
+                table = table.append_column(column, taken.column(column))
+        yield table
+
+
+def _write_tables(
+    tables, path: str, file_format: str, metadata: dict | None = None
+) -> bool:
+    """Write tables to a parquet or Arrow IPC file; False if there were none.
+
+    metadata is added to the key-value metadata of the first table's schema.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = schema = None
+    for table in tables:
+        if writer is None:
+            schema = table.schema
+            if metadata:
+                schema = schema.with_metadata({**(schema.metadata or {}), **metadata})
+            if file_format == "parquet":
+                writer = pq.ParquetWriter(path, schema)
+            else:
+                writer = pa.ipc.new_file(
+                    path, schema, options=pa.ipc.IpcWriteOptions(compression=None)
+                )
+        writer.write_table(table.cast(schema))
+    if writer is None:
+        return False
+    writer.close()
+    return True
+
+
+def _write_joined_folder(
+    joined,
+    joiner: _Joiner,
+    temporary: str,
+    source: str | os.PathLike,
+    key: str | None,
+    columns: list,
+    partitions: dict | None,
+    metadata: dict | None = None,
+) -> None:
+    """Write a folder of parquet files with the decisions joined on.
+
+    The part files of the partitions that were read get the columns of
+    joined; every other file is copied as it is. metadata is written to
+    the folder's _common_metadata file.
+    """
+    import pyarrow.parquet as pq
+
+    dataset = _parquet_dataset(source)
+    selected = {
+        os.path.normpath(fragment.path)
+        for fragment in dataset.get_fragments(
+            filter=_partition_filter(dataset, partitions)
+        )
+    }
+    # part files in the order they were read, so rows can be matched by
+    # position when there is no key.
+    for path in [os.path.normpath(path) for path in dataset.files]:
+        target = os.path.join(temporary, os.path.relpath(path, source))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if path not in selected:
+            continue
+        batches = pq.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE)
+        tables = _join_batches(batches, joined, joiner, key, columns)
+        if not _write_tables(tables, target, "parquet"):
+            shutil.copy2(path, target)
+    # the other partitions, and files that are not data (e.g. _SUCCESS).
+    for folder, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(folder, name)
+            target = os.path.join(temporary, os.path.relpath(path, source))
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(path, target)
+    if metadata:
+        import pyarrow as pa
+
+        # readers of the folder skip it, as its name starts with "_".
+        pq.write_metadata(
+            pa.schema([]).with_metadata(metadata),
+            os.path.join(temporary, "_common_metadata"),
+        )
+
+
+def _move_into_place(temporary: str, path: str | os.PathLike) -> None:
+    """Replace path (a file or folder) with temporary."""
+    if os.path.isdir(path):
+        replaced = f"{path}.old"
+        _remove(replaced)
+        os.rename(path, replaced)
+        os.rename(temporary, path)
+        _remove(replaced)
+    else:
+        if os.path.isdir(temporary) and os.path.exists(path):
+            # a file is being replaced with a folder.
+            os.remove(path)
+        os.replace(temporary, path)
+
+
+def _remove(path: str | os.PathLike) -> None:
+    """Remove a file or folder, if it exists."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _write(
+    data: pd.DataFrame, path: str, file_format: str, metadata: dict | None = None
+) -> None:
+    """Write the whole of data to path, with metadata if it is not CSV."""
+    if file_format == "csv":
+        data.to_csv(path, index=False)
+    elif metadata:
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(_arrow_compatible(data), preserve_index=False)
+        _write_tables([table], path, file_format, metadata)
+    elif file_format == "parquet":
+        _arrow_compatible(data).to_parquet(path, index=False)
+    else:
+        _arrow_compatible(data).reset_index(drop=True).to_feather(
+            path, compression="uncompressed"
+        )
+
+
+def write_file(
+    data: pd.DataFrame,
+    path: str | os.PathLike,
+    source: str | os.PathLike | None = None,
+    key: str | None = None,
+    columns: Sequence | None = None,
+    file_format: str | None = None,
+    partitions: dict | None = None,
+    metadata: dict | None = None,
+) -> None:
+    """Write a clerical file, in the format given by its extension.
+
+    Any deltas of the file at path are removed, as the file written has
+    every decision in it.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file, or the columns of it that were read.
+    path : str or os.PathLike
+        A .csv, .parquet, .arrow, .feather or .ipc file.
+    source : str or os.PathLike, optional
+        The full file data was read from, in the same format; it may be
+        path itself. If given, the file written is source with columns
+        (and any columns of data it does not have) taken from data, and
+        the deltas of source are folded in.
+    key : str, optional
+        The column to match the rows of source and data on; if None, they
+        are matched by position.
+    columns : Sequence, optional
+        The columns of data to write into source; defaults to every column.
+    file_format : str, optional
+        "csv", "parquet" or "arrow"; defaults to the file's extension.
+    partitions : dict, optional
+        For a partitioned folder of parquet files, the partitions data was
+        read from (see read_file); the others are copied from source as
+        they are.
+    metadata : dict, optional
+        Key-value metadata to write into a parquet or Arrow IPC file (e.g.
+        from crow_core.progress.progress_metadata), in place of any under
+        the same keys in source; ignored for CSV.
+
+    Raises
+    ------
+    ValueError
+        If the file is not one of the supported formats, or a row of source
+        is not in data.
+    """
+    file_format = _format(path, file_format)
+    temporary = f"{path}.tmp"
+    _remove(temporary)
+    deltas = None if source is None else read_deltas(deltas_folder(source))
+    if source is None:
+        _write(data, temporary, file_format, metadata)
+    else:
+        source_columns = file_columns(source, file_format)
+        columns = list(data.columns if columns is None else columns)
+        columns += [
+            column
+            for column in data.columns
+            if column not in source_columns and column not in columns
+        ]
+        _write_joined(
+            data, temporary, source, key, columns, file_format, partitions, metadata
+        )
+    _move_into_place(temporary, path)
+    # data was read with the deltas of source merged on, so they are now in
+    # the file; only those of records not read (other partitions) are kept.
+    _remove(deltas_folder(path))
+    if deltas is not None:
+        unapplied = unapplied_deltas(deltas, data)
+        if len(unapplied):
+            write_delta(unapplied, deltas_folder(path), 0)
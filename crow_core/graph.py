@@ -0,0 +1,49 @@
+"""Find the connected components of a graph of records, as a union-find does.
+
+The records are numbered 0 to n - 1 and the edges given as two arrays of
+record numbers, e.g. each record and a record it was matched with. Rather
+than uniting one edge at a time in Python, every edge is united at once
+with numpy: each component's root is hooked onto the smallest root it has
+an edge to, then every record's parent is replaced by its parent's parent
+until all point straight at their root (path compression), and this is
+repeated for the edges still joining two components. A few rounds unite
+tens of millions of edges in seconds.
+"""
+
+import numpy as np
+
+
+def connected_components(left: np.ndarray, right: np.ndarray, size: int) -> np.ndarray:
+    """Find the component of each record of a graph.
+
+    Parameters
+    ----------
+    left, right : np.ndarray
+        The records at either end of each edge, as numbers from 0 to
+        size - 1.
+    size : int
+        The number of records, including any without edges.
+
+    Returns
+    -------
+    np.ndarray
+        For each record, the smallest record number in its component.
+    """
+    parent = np.arange(size, dtype=np.int64)
+    left = np.asarray(left, dtype=np.int64)
+    right = np.asarray(right, dtype=np.int64)
+    while len(left):
+        low = np.minimum(parent[left], parent[right])
+        high = np.maximum(parent[left], parent[right])
+        joining = low != high
+        if not joining.any():
+            break
+        left, right = left[joining], right[joining]
+        # roots only ever point to smaller roots, so no cycle is made.
+        np.minimum.at(parent, high[joining], low[joining])
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
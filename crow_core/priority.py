@@ -0,0 +1,148 @@
+"""Put the clusters of a clerical file in order of priority for review.
+
+By default clusters are reviewed in the order they first appear in the file.
+Under a deadline the most valuable decisions can be made first instead, with
+one of these orders:
+
+file
+    The order of the file.
+uncertainty
+    Clusters whose match score (a column of the file, e.g. the probability
+    from the linkage model) is nearest the threshold first, as they are the
+    ones the model was least sure of; the score nearest it of any record of
+    the cluster counts. Clusters with no score come last.
+size
+    The largest clusters first, as they have the most records to decide.
+datasets
+    Clusters with records from the most datasets (the values of a column,
+    e.g. the source dataset) first, and clusters of the same combination of
+    datasets together, combinations in order of first appearance.
+
+Ties keep the order of the file. The order is computed once, for every
+cluster at once with numpy reductions, as the review queue (see
+ReviewSession.set_queue), so moving between clusters stays O(1).
+"""
+
+import numpy as np
+import pandas as pd
+
+from crow_core.review_session import ReviewSession
+
+ORDERS = ("file", "uncertainty", "size", "datasets")
+
+# The score threshold of the uncertainty order, if none is given.
+THRESHOLD = 0.5
+
+
+def parse_order(text: str) -> str:
+    """Read an order, as written in a config file.
+
+    Parameters
+    ----------
+    text : str
+        The order, e.g. "uncertainty". Blank for file order.
+
+    Returns
+    -------
+    str
+        One of ORDERS.
+
+    Raises
+    ------
+    ValueError
+        If the order is not one of ORDERS.
+    """
+    order = text.strip().lower() or "file"
+    if order not in ORDERS:
+        raise ValueError(f"unknown review order {order!r}; use one of {ORDERS}")
+    return order
+
+
+def _scores(values: pd.Series) -> np.ndarray:
+    """Read a column of scores as floats, nan where there is none."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # each distinct value once, as the front-ends may store it encoded.
+        categories = pd.to_numeric(values.cat.categories.astype(str), errors="coerce")
+        scores = np.asarray(categories, dtype=float)[values.cat.codes.to_numpy()]
+        scores[values.cat.codes.to_numpy() < 0] = np.nan
+        return scores
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+
+
+def cluster_priority(
+    review: ReviewSession,
+    order: str,
+    column: str | None = None,
+    threshold: float = THRESHOLD,
+) -> np.ndarray:
+    """Rank the clusters of a file for review.
+
+    Parameters
+    ----------
+    review : ReviewSession
+        The clerical file.
+    order : str
+        One of ORDERS.
+    column : str, optional
+        The score column for uncertainty, or the dataset column for
+        datasets.
+    threshold : float, optional
+        For uncertainty, the score at which the model is least sure.
+
+    Returns
+    -------
+    np.ndarray
+        The priority of each cluster: the lower, the sooner it is reviewed.
+
+    Raises
+    ------
+    ValueError
+        If the order is unknown, or needs a column and has none.
+    """
+    order = parse_order(order)
+    if order in ("uncertainty", "datasets") and column is None:
+        raise ValueError(f"the {order} order needs a column")
+    clusters = np.arange(review.num_clusters)
+    if order == "file" or review.num_clusters == 0:
+        return clusters
+    if order == "size":
+        return np.lexsort((clusters, -review.cluster_sizes)).argsort()
+    starts = review.offsets[:-1]
+    rows = review.rows_by_cluster
+    if order == "uncertainty":
+        distance = np.abs(_scores(review.data[column]) - threshold)[rows]
+        # fmin leaves out records with no score; a cluster with none is last.
+        nearest = np.fmin.reduceat(distance, starts)
+        nearest[np.isnan(nearest)] = np.inf
+        return np.lexsort((clusters, nearest)).argsort()
+    codes = pd.factorize(review.data[column])[0]
+    if codes.max(initial=0) >= 63:
+        raise ValueError(f"{column} has too many values to be a dataset column")
+    # each cluster's datasets as the bits of a number.
+    bits = np.where(codes >= 0, np.left_shift(1, codes.clip(0)), 0)
+    combination = np.bitwise_or.reduceat(bits[rows], starts)
+    num_datasets = np.unpackbits(combination.view(np.uint8)).reshape(-1, 64)
+    num_datasets = num_datasets.sum(axis=1, dtype=np.int64)
+    first_seen = pd.factorize(combination)[0]
+    return np.lexsort((clusters, first_seen, -num_datasets)).argsort()
+
+
+def prioritise(
+    review: ReviewSession,
+    order: str,
+    column: str | None = None,
+    threshold: float = THRESHOLD,
+) -> None:
+    """Put the review queue in order of priority and go to its first undecided.
+
+    Clusters left out of the queue (e.g. decided without review) stay out.
+
+    Parameters
+    ----------
+    review : ReviewSession
+        The clerical file.
+    order, column, threshold
+        As for cluster_priority.
+    """
+    priority = cluster_priority(review, order, column, threshold)
+    review.set_queue(review.queue[np.argsort(priority[review.queue], kind="stable")])
@@ -0,0 +1,294 @@
+"""Record how far the review of a file has got in the file itself.
+
+Coordinators otherwise find the progress of a project from the _inprogress
+and _done names of its files, or by opening them. Each save instead writes
+the progress of the review (see ReviewSession.progress), who saved it and
+when into the key-value metadata of the file written, under PROGRESS_KEY:
+the footer of a parquet file or the schema of an Arrow IPC file (see the
+metadata argument of write_file), the _common_metadata file of a folder of
+parquet files, or the delta of a save that writes one (see
+crow_core.deltas).
+
+Reading it back needs only the footer of each file, a few kilobytes whatever
+the size of the file. project_progress lists a folder once and reads the
+footers of all its files in parallel, taking a file's latest delta where it
+was saved after the file, so the progress of a whole project is known
+without reading any of its records.
+
+CSV files have no footer to write it in. A file with none (CSV, or last
+saved before this was written) shows only the status its name gives it, and
+its number of records if it is a parquet file; a done file counts as fully
+decided, and one not started as not at all.
+"""
+
+import json
+import posixpath
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+import pandas as pd
+
+from crow_core.deltas import DELTAS_SUFFIX, delta_sequence
+from crow_core.files import FORMATS
+from crow_core.review_session import Progress
+
+# The key the progress is written under, as JSON.
+PROGRESS_KEY = b"crow.progress"
+
+# The file of a folder of parquet files the progress is written to.
+FOLDER_METADATA = "_common_metadata"
+
+# The status of a clerical file, from its name.
+STATUSES = ("not started", "in progress", "done")
+
+# Footers read at once; reading them is waiting on storage, not computing.
+WORKERS = 16
+
+COLUMNS = [
+    "file",
+    "status",
+    "decided_records",
+    "total_records",
+    "done_clusters",
+    "total_clusters",
+    "user",
+    "saved_at",
+]
+
+
+def progress_metadata(
+    progress: Progress, user: str, saved_at: float | None = None
+) -> dict:
+    """Make the key-value metadata recording the progress of a save.
+
+    Parameters
+    ----------
+    progress : Progress
+        From ReviewSession.progress, when the decisions saved were taken.
+    user : str
+        Who is saving.
+    saved_at : float, optional
+        When the save was made, in seconds since the epoch; defaults to now.
+
+    Returns
+    -------
+    dict
+        PROGRESS_KEY and the progress, as JSON.
+    """
+    record = {
+        **progress._asdict(),
+        "user": user,
+        "saved_at": time.time() if saved_at is None else saved_at,
+    }
+    return {PROGRESS_KEY: json.dumps(record).encode()}
+
+
+def file_status(path: str) -> str:
+    """Get the status of a clerical file from its name.
+
+    Parameters
+    ----------
+    path : str
+        The clerical file.
+
+    Returns
+    -------
+    str
+        One of STATUSES: "done" for crow2's name_user_done and crow1's
+        name_user_DONE.csv, "in progress" for their _inprogress names.
+    """
+    name = PurePosixPath(path.rstrip("/")).name.lower()
+    suffix = PurePosixPath(name).suffix
+    stem = name[: -len(suffix)] if suffix in FORMATS else name
+    if stem.endswith("done"):
+        return "done"
+    if stem.endswith("inprogress"):
+        return "in progress"
+    return "not started"
+
+
+def read_footer(path: str, file_format: str, filesystem=None) -> tuple:
+    """Read the progress in the footer of a parquet or Arrow IPC file.
+
+    Parameters
+    ----------
+    path : str
+        The file; for parquet, it may be a folder's FOLDER_METADATA file.
+    file_format : str
+        "parquet" or "arrow".
+    filesystem : pyarrow.fs.FileSystem, optional
+        Where the file is; local by default.
+
+    Returns
+    -------
+    tuple
+        The progress (a dict of the fields written by progress_metadata),
+        or None if the file has none; and the number of rows of a parquet
+        file, or None. Both are None if the file cannot be read, e.g. while
+        it is being written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    try:
+        if file_format == "parquet":
+            footer = pq.read_metadata(path, filesystem=filesystem)
+            metadata, num_rows = footer.metadata, footer.num_rows
+        else:
+            if filesystem is None:
+                with pa.memory_map(path) as source:
+                    metadata = pa.ipc.open_file(source).schema.metadata
+            else:
+                with filesystem.open_input_file(path) as source:
+                    metadata = pa.ipc.open_file(source).schema.metadata
+            num_rows = None
+    except (OSError, ValueError):
+        return None, None
+    if not metadata or PROGRESS_KEY not in metadata:
+        return None, num_rows
+    return json.loads(metadata[PROGRESS_KEY]), num_rows
+
+
+def _footers(folder: str, filesystem) -> list:
+    """List the clerical files of a folder and the footers to read of each.
+
+    Returns a (path, file_format, footers) tuple per file, footers being the
+    (path, file_format) of the file's own footer, if it has one, and of its
+    latest delta, if it has deltas.
+    """
+    from pyarrow import fs
+
+    entries = filesystem.get_file_info(fs.FileSelector(folder, recursive=True))
+    folder = folder.rstrip("/")
+    children = {}
+    files = set()
+    latest_delta = {}
+    for entry in entries:
+        parent, name = posixpath.split(entry.path)
+        if entry.type == fs.FileType.File:
+            files.add(entry.path)
+        if parent == folder:
+            children[entry.path] = entry.type == fs.FileType.Directory
+        elif parent.endswith(DELTAS_SUFFIX):
+            sequence = delta_sequence(name)
+            owner = parent[: -len(DELTAS_SUFFIX)]
+            if sequence is not None and sequence >= latest_delta.get(owner, (-1,))[0]:
+                latest_delta[owner] = (sequence, entry.path)
+
+    listed = []
+    for path, is_folder in sorted(children.items()):
+        name = posixpath.basename(path)
+        if name.startswith((".", "_")) or name.endswith((".tmp", ".old", ".saved")):
+            continue
+        if name.endswith(DELTAS_SUFFIX):
+            continue
+        suffix = PurePosixPath(name).suffix.lower()
+        if is_folder or not suffix:
+            file_format = "parquet"
+        elif suffix in FORMATS:
+            file_format = FORMATS[suffix]
+        else:
+            continue
+        footers = []
+        if is_folder:
+            if posixpath.join(path, FOLDER_METADATA) in files:
+                footers.append((posixpath.join(path, FOLDER_METADATA), "parquet"))
+        elif file_format != "csv":
+            footers.append((path, file_format))
+        if path in latest_delta:
+            footers.append((latest_delta[path][1], "parquet"))
+        listed.append((path, file_format, footers))
+    return listed
+
+
+def _file_progress(path: str, footers: Sequence, filesystem) -> dict:
+    """Read the progress of one clerical file from its footers."""
+    status = file_status(path)
+    row = dict.fromkeys(COLUMNS)
+    row.update(file=path, status=status)
+    progress = None
+    for footer, file_format in footers:
+        found, num_rows = read_footer(footer, file_format, filesystem)
+        if num_rows is not None and footer == path:
+            row["total_records"] = num_rows
+        if found is not None and (
+            progress is None or found["saved_at"] >= progress["saved_at"]
+        ):
+            progress = found
+    if progress is not None:
+        row.update({column: progress.get(column) for column in COLUMNS[2:]})
+    elif row["total_records"] is not None and status != "in progress":
+        row["decided_records"] = row["total_records"] if status == "done" else 0
+    return row
+
+
+def project_progress(
+    folder: str, filesystem=None, workers: int = WORKERS
+) -> pd.DataFrame:
+    """Read the progress of every clerical file in a folder from its footers.
+
+    Parameters
+    ----------
+    folder : str
+        The folder of clerical files, as laid out by the front-ends.
+    filesystem : pyarrow.fs.FileSystem, optional
+        Where the folder is (e.g. hdfs); local by default.
+    workers : int, optional
+        The footers read at once.
+
+    Returns
+    -------
+    pd.DataFrame
+        A row per file, sorted by name: its path, status (see file_status),
+        decided_records, total_records, done_clusters and total_clusters
+        (missing where unknown), and the user and time of its last save.
+    """
+    if filesystem is None:
+        from pyarrow import fs
+
+        filesystem = fs.LocalFileSystem()
+        folder = Path(folder).resolve().as_posix()
+    listed = _footers(folder, filesystem)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        rows = list(
+            pool.map(lambda file: _file_progress(file[0], file[2], filesystem), listed)
+        )
+    table = pd.DataFrame(rows, columns=COLUMNS)
+    for column in COLUMNS[2:6]:
+        table[column] = table[column].astype("Int64")
+    table["user"] = table["user"].fillna("")
+    table["saved_at"] = pd.to_datetime(table["saved_at"].astype(float), unit="s")
+    return table
+
+
+def summarise_progress(table: pd.DataFrame) -> dict:
+    """Add up the progress of the files of a project.
+
+    Parameters
+    ----------
+    table : pd.DataFrame
+        From project_progress.
+
+    Returns
+    -------
+    dict
+        The number of files of each status and in all; the records decided
+        and in all, over the files where they are known, and the number of
+        files where they are not ("unknown"); and the clusters done and in
+        all, over the files that have recorded them ("clusters_known"),
+        which a file only does once it is saved.
+    """
+    known = table["decided_records"].notna() & table["total_records"].notna()
+    clusters_known = table["done_clusters"].notna() & table["total_clusters"].notna()
+    summary = {"files": len(table)}
+    for status in STATUSES:
+        summary[status] = int((table["status"] == status).sum())
+    for column in COLUMNS[2:4]:
+        summary[column] = int(table.loc[known, column].sum())
+    for column in COLUMNS[4:6]:
+        summary[column] = int(table.loc[clusters_known, column].sum())
+    summary["unknown"] = int((~known).sum())
+    summary["clusters_known"] = int(clusters_known.sum())
+    return summary
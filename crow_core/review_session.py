@@ -0,0 +1,750 @@
+"""The headless clerical review engine shared by CROW1 and CROW2.
+
+A ReviewSession owns the records of a clerical file, an index of the
+records in each cluster and the decision state (the match and comment
+columns). The front-ends only draw the current cluster and pass the
+reviewer's choices on to it.
+
+Every operation touches only the records it decides on, or the records of
+the current cluster, and the per-cluster and overall progress counts are
+kept up to date as decisions are made, so nothing rescans the file.
+
+Each decision is also recorded in a history of the values it replaced, so
+any number of decisions can be undone and redone, again touching only the
+records they changed.
+
+The rows whose decisions have changed since a front-end last took them
+(see take_changes) are tracked, so it can save just those.
+
+Clusters are reviewed in the order of a review queue. Clusters decided
+without review (see crow_core.auto_resolve) are marked "auto" in the
+provenance column and are left out of it, as are those whose decisions were
+carried over from an earlier round of review, marked "carried".
+"""
+
+from collections import deque
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from typing import Any, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+class DecisionFormat(NamedTuple):
+    """How a front-end stores decisions in its clerical files.
+
+    Attributes
+    ----------
+    match_col : str
+        The column holding the decision of each record.
+    comment_col : str or None
+        The column holding the reviewer's comment, or None for no comments.
+    undecided : Any
+        The value of match_col for records with no decision yet.
+    match_value : Callable
+        Takes the list of matched record ids and returns the value stored
+        against each of them.
+    non_match_value : Callable
+        Takes a record id and returns the value stored against it when it
+        has no match.
+    min_match : int
+        The fewest records that can be declared a match.
+    provenance_col : str or None
+        The column marking decisions made without review, or None if they
+        cannot be made.
+    """
+
+    match_col: str
+    comment_col: str | None
+    undecided: Any
+    match_value: Callable[[list], Any]
+    non_match_value: Callable[[Any], Any]
+    min_match: int = 2
+    provenance_col: str | None = None
+
+    def decision_columns(self) -> list:
+        """The columns decisions can be stored in."""
+        columns = (self.match_col, self.comment_col, self.provenance_col)
+        return [column for column in columns if column is not None]
+
+
+# The provenance of decisions made without review.
+AUTO = "auto"
+
+# The provenance of decisions carried over from an earlier round of review
+# of the same cluster (see coordinator/carry_over.py); also not reviewed.
+CARRIED = "carried"
+
+
+# CROW2: the matched ids as a stringified list.
+CROW2_FORMAT = DecisionFormat(
+    match_col="Match",
+    comment_col="Comment",
+    undecided="[]",
+    match_value=lambda ids: str([str(record) for record in ids]),
+    non_match_value=lambda record: f"['No Match In Cluster For {record}']",
+    provenance_col="Decision_Source",
+)
+
+# CROW1 cluster version: the matched ids joined with trailing commas.
+CROW1_CLUSTER_FORMAT = DecisionFormat(
+    match_col="Match",
+    comment_col="Comments",
+    undecided="",
+    match_value=lambda ids: "".join(f"{record}," for record in ids),
+    non_match_value=lambda record: "No match in cluster",
+    provenance_col="Decision_Source",
+)
+
+# CROW1 pairwise version: each row is a record pair, 1 = match, 0 = not.
+CROW1_PAIRWISE_FORMAT = DecisionFormat(
+    match_col="match",
+    comment_col="comments",
+    undecided="",
+    match_value=lambda ids: 1,
+    non_match_value=lambda record: 0,
+    min_match=1,
+    provenance_col="decision_source",
+)
+
+# CROW2 pairwise version: as CROW1 pairwise, with the decisions stored as
+# strings so the column can be written to parquet.
+CROW2_PAIRWISE_FORMAT = DecisionFormat(
+    match_col="match",
+    comment_col="comments",
+    undecided="",
+    match_value=lambda ids: "1",
+    non_match_value=lambda record: "0",
+    min_match=1,
+    provenance_col="decision_source",
+)
+
+
+class Progress(NamedTuple):
+    """How far through a clerical file the review is."""
+
+    decided_records: int
+    total_records: int
+    done_clusters: int
+    total_clusters: int
+
+
+class Step(NamedTuple):
+    """One undoable decision: the rows it changed and their values.
+
+    Attributes
+    ----------
+    index : int
+        The review queue position when it was made.
+    rows : list
+        The row positions it changed.
+    before : list
+        The (match, comment) of each row before it.
+    after : list
+        The (match, comment) of each row after it.
+    """
+
+    index: int
+    rows: list
+    before: list
+    after: list
+
+
+class ReviewSession:
+    """The records, cluster index and decisions of one clerical file.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file. It is not copied; the decision columns are added
+        to it if missing and written back to it by to_frame().
+    record_id : str or None
+        The record id column. If None, records are identified by their row
+        position (as in the pairwise version).
+    cluster_id : str or None
+        The cluster id column. If None, every row is its own cluster.
+    decision_format : DecisionFormat
+        How decisions are stored in the match and comment columns.
+    history_limit : int, optional
+        The most decisions that can be undone; defaults to no limit.
+
+    Attributes
+    ----------
+    index : int
+        The position of the cluster under review in the review queue. It
+        may be equal to queue_length once the last cluster has been passed.
+    queue : np.ndarray
+        The clusters to review, in review order.
+    cluster_codes : np.ndarray
+        The sequential cluster number of each row, numbered in order of
+        first appearance.
+    """
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        record_id: str | None,
+        cluster_id: str | None,
+        decision_format: DecisionFormat = CROW2_FORMAT,
+        history_limit: int | None = None,
+    ) -> None:
+        """Initialise the ReviewSession and build its indexes."""
+        self.data = data
+        self.record_id = record_id
+        self.cluster_id = cluster_id
+        self.format = decision_format
+        self.num_records = len(data)
+
+        # Decision state, aligned with the rows of data.
+        fmt = decision_format
+        if fmt.match_col not in data.columns:
+            data[fmt.match_col] = fmt.undecided
+        self.match = data[fmt.match_col].to_numpy(dtype=object, copy=True)
+        self.match[pd.isna(self.match)] = fmt.undecided
+        if fmt.comment_col is not None:
+            if fmt.comment_col not in data.columns:
+                data[fmt.comment_col] = ""
+            self.comment = data[fmt.comment_col].to_numpy(dtype=object, copy=True)
+            self.comment[pd.isna(self.comment)] = ""
+        else:
+            self.comment = None
+        if fmt.provenance_col is not None and fmt.provenance_col in data.columns:
+            self.provenance = data[fmt.provenance_col].to_numpy(dtype=object, copy=True)
+            self.provenance[pd.isna(self.provenance)] = ""
+        else:
+            self.provenance = None
+
+        # Record id -> row position.
+        if record_id is None:
+            self.record_ids = pd.RangeIndex(self.num_records)
+        else:
+            self.record_ids = pd.Index(data[record_id])
+
+        # Cluster index: the rows of cluster k are
+        # rows_by_cluster[offsets[k]:offsets[k + 1]], in file order.
+        if cluster_id is None:
+            self.cluster_codes = np.arange(self.num_records)
+        else:
+            self.cluster_codes = pd.factorize(data[cluster_id])[0]
+        self.num_clusters = int(self.cluster_codes.max(initial=-1)) + 1
+        self.rows_by_cluster = np.argsort(self.cluster_codes, kind="stable")
+        self.cluster_sizes = np.bincount(
+            self.cluster_codes, minlength=self.num_clusters
+        )
+        self.offsets = np.r_[0, np.cumsum(self.cluster_sizes)]
+
+        # Progress counts.
+        decided = self.match != fmt.undecided
+        self.decided_in_cluster = np.bincount(
+            self.cluster_codes, weights=decided, minlength=self.num_clusters
+        ).astype(np.int64)
+        self.num_decided = int(decided.sum())
+        self.num_done_clusters = int(
+            (self.decided_in_cluster == self.cluster_sizes).sum()
+        )
+
+        # The rows changed since the changes were last taken.
+        self.changed = np.zeros(self.num_records, dtype=bool)
+
+        # Undo and redo history, and the step being recorded.
+        self.history = deque(maxlen=history_limit)
+        self.redo_history = deque(maxlen=history_limit)
+        self._step = None
+
+        # Review queue, leaving out the clusters decided without review.
+        self.set_queue(np.flatnonzero(~self.auto_clusters()))
+
+    def set_queue(self, clusters: Sequence) -> None:
+        """Set the clusters to review, in order, and start at the first undecided.
+
+        Parameters
+        ----------
+        clusters : Sequence
+            The cluster positions.
+        """
+        self.queue = np.asarray(clusters, dtype=np.int64)
+        self.queue_position = np.full(self.num_clusters, -1, dtype=np.int64)
+        self.queue_position[self.queue] = np.arange(len(self.queue))
+        # Queue positions before this one are known to be done.
+        self._done_before = 0
+        self.index = self.first_undecided() or 0
+
+    def auto_clusters(self) -> np.ndarray:
+        """Find the clusters decided without review.
+
+        Returns
+        -------
+        np.ndarray
+            True for each cluster whose records are all marked "auto" or
+            "carried".
+        """
+        if self.provenance is None:
+            return np.zeros(self.num_clusters, dtype=bool)
+        auto = np.bincount(
+            self.cluster_codes,
+            weights=np.isin(self.provenance, [AUTO, CARRIED]),
+            minlength=self.num_clusters,
+        )
+        return auto == self.cluster_sizes
+
+    # ------------------------------------------------------------------
+    # Lookups.
+
+    def rows(self, record_ids: Sequence) -> np.ndarray:
+        """Get the row positions of some records.
+
+        Parameters
+        ----------
+        record_ids : Sequence
+            The record ids (row positions if there is no record id column).
+
+        Returns
+        -------
+        np.ndarray
+            The row position of each record.
+        """
+        record_ids = list(record_ids)
+        positions = self.record_ids.get_indexer(record_ids)
+        if (positions < 0).any() and not pd.api.types.is_string_dtype(self.record_ids):
+            # ids from a web form are strings; try the id column's type.
+            try:
+                positions = self.record_ids.get_indexer(
+                    pd.Index(record_ids).astype(self.record_ids.dtype)
+                )
+            except (TypeError, ValueError):
+                pass
+        if (positions < 0).any():
+            missing = [r for r, p in zip(record_ids, positions) if p < 0]
+            raise KeyError(f"record ids not in the file: {missing}")
+        return positions
+
+    @property
+    def cluster(self) -> int:
+        """The position of the cluster under review."""
+        return int(self.queue[self.index])
+
+    @property
+    def queue_length(self) -> int:
+        """The number of clusters to review."""
+        return len(self.queue)
+
+    def cluster_rows(self, cluster: int | None = None) -> np.ndarray:
+        """Get the row positions of the records in a cluster.
+
+        Parameters
+        ----------
+        cluster : int, optional
+            The cluster position; defaults to the current cluster.
+
+        Returns
+        -------
+        np.ndarray
+            The row positions, in file order (none once the last cluster in
+            the queue has been passed).
+        """
+        if cluster is None:
+            if self.at_end:
+                return self.rows_by_cluster[:0]
+            cluster = self.cluster
+        return self.rows_by_cluster[self.offsets[cluster] : self.offsets[cluster + 1]]
+
+    def cluster_frame(
+        self, columns: list | None = None, cluster: int | None = None
+    ) -> pd.DataFrame:
+        """Get the records of a cluster, with their decisions.
+
+        Parameters
+        ----------
+        columns : list, optional
+            The columns to return; defaults to every column.
+        cluster : int, optional
+            The cluster position; defaults to the current cluster.
+
+        Returns
+        -------
+        pd.DataFrame
+            The records of the cluster.
+        """
+        rows = self.cluster_rows(cluster)
+        frame = self.data.iloc[rows].copy()
+        frame[self.format.match_col] = self.match[rows]
+        if self.comment is not None:
+            frame[self.format.comment_col] = self.comment[rows]
+        return frame if columns is None else frame[columns]
+
+    def is_decided(self, row: int) -> bool:
+        """Check whether the record at a row position has a decision."""
+        return self.match[row] != self.format.undecided
+
+    def num_decided_in_cluster(self, cluster: int | None = None) -> int:
+        """Count the records with a decision in a cluster."""
+        if cluster is None and self.at_end:
+            return 0
+        cluster = self.cluster if cluster is None else cluster
+        return int(self.decided_in_cluster[cluster])
+
+    def num_undecided_in_cluster(self, cluster: int | None = None) -> int:
+        """Count the records with no decision in a cluster."""
+        if cluster is None and self.at_end:
+            return 0
+        cluster = self.cluster if cluster is None else cluster
+        return int(self.cluster_sizes[cluster] - self.decided_in_cluster[cluster])
+
+    def is_cluster_done(self, cluster: int | None = None) -> bool:
+        """Check whether every record in a cluster has a decision."""
+        return self.num_undecided_in_cluster(cluster) == 0
+
+    def is_done(self) -> bool:
+        """Check whether every record in the file has a decision."""
+        return self.num_decided == self.num_records
+
+    def progress(self) -> Progress:
+        """Get the number of decided records and done clusters."""
+        return Progress(
+            self.num_decided,
+            self.num_records,
+            self.num_done_clusters,
+            self.num_clusters,
+        )
+
+    @property
+    def at_end(self) -> bool:
+        """Whether the review has moved past the last cluster."""
+        return self.index >= self.queue_length
+
+    # ------------------------------------------------------------------
+    # Decisions.
+
+    @contextmanager
+    def step(self) -> Iterator[None]:
+        """Record the decisions made inside it as a single undoable step.
+
+        Steps can be nested; only the outermost one is recorded.
+        """
+        if self._step is not None:
+            yield
+            return
+        self._step = Step(self.index, [], [], [])
+        try:
+            yield
+        finally:
+            step, self._step = self._step, None
+            if step.rows:
+                self.history.append(step)
+                self.redo_history.clear()
+
+    def _value(self, row: int) -> tuple:
+        """Get the (match, comment) of a row."""
+        comment = None if self.comment is None else self.comment[row]
+        return self.match[row], comment
+
+    def _set(self, row: int, value: Any, comment: str | None) -> None:
+        """Set the decision of one row, keeping the progress counts."""
+        if self._step is not None:
+            self._step.rows.append(row)
+            self._step.before.append(self._value(row))
+        self._write(row, value, comment)
+        if self._step is not None:
+            self._step.after.append(self._value(row))
+
+    def _write(self, row: int, value: Any, comment: str | None) -> None:
+        """Write the decision of one row, keeping the progress counts."""
+        cluster = self.cluster_codes[row]
+        was_decided = self.match[row] != self.format.undecided
+        now_decided = value != self.format.undecided
+        self.match[row] = value
+        if comment is not None and self.comment is not None:
+            self.comment[row] = comment
+        self.changed[row] = True
+        if was_decided == now_decided:
+            return
+        change = 1 if now_decided else -1
+        was_done = self.decided_in_cluster[cluster] == self.cluster_sizes[cluster]
+        self.decided_in_cluster[cluster] += change
+        self.num_decided += change
+        now_done = self.decided_in_cluster[cluster] == self.cluster_sizes[cluster]
+        self.num_done_clusters += int(now_done) - int(was_done)
+        position = self.queue_position[cluster]
+        if not now_done and position >= 0:
+            self._done_before = min(self._done_before, int(position))
+
+    def match_records(self, record_ids: Sequence, comment: str | None = None):
+        """Declare a group of records a match.
+
+        Parameters
+        ----------
+        record_ids : Sequence
+            The ids of the matching records.
+        comment : str, optional
+            A comment to store against each of them.
+
+        Raises
+        ------
+        ValueError
+            If fewer than format.min_match records are given.
+        """
+        record_ids = list(record_ids)
+        if len(record_ids) < self.format.min_match:
+            raise ValueError("you have only selected one record")
+        value = self.format.match_value(record_ids)
+        with self.step():
+            for row in self.rows(record_ids):
+                self._set(row, value, comment)
+
+    def non_match_records(self, record_ids: Sequence, comment: str | None = None):
+        """Declare that records have no match in their cluster.
+
+        Parameters
+        ----------
+        record_ids : Sequence
+            The ids of the records.
+        comment : str, optional
+            A comment to store against each of them.
+        """
+        record_ids = list(record_ids)
+        with self.step():
+            for record, row in zip(record_ids, self.rows(record_ids)):
+                self._set(row, self.format.non_match_value(record), comment)
+
+    def non_match_remaining(self, comment: str | None = None) -> None:
+        """Declare every undecided record in the current cluster a non-match.
+
+        Parameters
+        ----------
+        comment : str, optional
+            A comment to store against each of them.
+        """
+        with self.step():
+            for row in self.cluster_rows():
+                if not self.is_decided(row):
+                    self._set(row, self.format.non_match_value(self._id(row)), comment)
+
+    def clear(self, cluster: int | None = None) -> None:
+        """Remove the decisions and comments of every record in a cluster.
+
+        Parameters
+        ----------
+        cluster : int, optional
+            The cluster position; defaults to the current cluster.
+        """
+        with self.step():
+            for row in self.cluster_rows(cluster):
+                if self.is_decided(row) or (
+                    self.comment is not None and self.comment[row] != ""
+                ):
+                    self._set(row, self.format.undecided, "")
+
+    def _id(self, row: int) -> Any:
+        """Get the record id of a row position."""
+        return self.record_ids[row]
+
+    def decide_without_review(
+        self, match_clusters: Sequence, non_match_clusters: Sequence
+    ) -> None:
+        """Decide whole clusters, mark them "auto" and take them out of the queue.
+
+        These decisions are not recorded in the undo history.
+
+        Parameters
+        ----------
+        match_clusters : Sequence
+            The cluster positions whose records all match each other.
+        non_match_clusters : Sequence
+            The cluster positions whose records have no match.
+        """
+        if self.format.provenance_col is None:
+            raise ValueError("this decision format has no provenance column")
+        match_clusters = np.asarray(match_clusters, dtype=np.int64)
+        non_match_clusters = np.asarray(non_match_clusters, dtype=np.int64)
+        ids = self.record_ids.to_numpy(dtype=object)
+        for cluster in match_clusters:
+            rows = self.cluster_rows(cluster)
+            self.match[rows] = self.format.match_value(ids[rows].tolist())
+        rows = np.flatnonzero(np.isin(self.cluster_codes, non_match_clusters))
+        self.match[rows] = [self.format.non_match_value(record) for record in ids[rows]]
+
+        clusters = np.union1d(match_clusters, non_match_clusters)
+        if self.provenance is None:
+            self.provenance = np.full(self.num_records, "", dtype=object)
+        decided = np.isin(self.cluster_codes, clusters)
+        self.provenance[decided] = AUTO
+        self.changed |= decided
+
+        # Progress counts.
+        sizes = self.cluster_sizes[clusters]
+        self.num_decided += int((sizes - self.decided_in_cluster[clusters]).sum())
+        self.num_done_clusters += int((self.decided_in_cluster[clusters] < sizes).sum())
+        self.decided_in_cluster[clusters] = sizes
+
+        self.set_queue(self.queue[~np.isin(self.queue, clusters)])
+
+    def undo(self) -> bool:
+        """Undo the last decision and move to the cluster it was made in.
+
+        Returns
+        -------
+        bool
+            False if there was nothing to undo.
+        """
+        if not self.history:
+            return False
+        step = self.history.pop()
+        for row, (match, comment) in zip(reversed(step.rows), reversed(step.before)):
+            self._write(row, match, comment)
+        self.redo_history.append(step)
+        self.index = step.index
+        return True
+
+    def redo(self) -> bool:
+        """Redo the last undone decision and move to the cluster it was made in.
+
+        Returns
+        -------
+        bool
+            False if there was nothing to redo.
+        """
+        if not self.redo_history:
+            return False
+        step = self.redo_history.pop()
+        for row, (match, comment) in zip(step.rows, step.after):
+            self._write(row, match, comment)
+        self.history.append(step)
+        self.index = step.index
+        return True
+
+    @property
+    def can_undo(self) -> bool:
+        """Whether there is a decision to undo."""
+        return bool(self.history)
+
+    @property
+    def can_redo(self) -> bool:
+        """Whether there is an undone decision to redo."""
+        return bool(self.redo_history)
+
+    # ------------------------------------------------------------------
+    # Navigation.
+
+    def back(self) -> None:
+        """Move to the previous cluster, unless at the first."""
+        if self.index > 0:
+            self.index -= 1
+
+    def advance(self) -> None:
+        """Move to the next cluster, or past the last one."""
+        if self.index < self.queue_length:
+            self.index += 1
+
+    def advance_if_done(self) -> None:
+        """Move to the next cluster if the current one is done.
+
+        Stays on the last cluster rather than moving past it.
+        """
+        if self.is_cluster_done() and self.index < self.queue_length - 1:
+            self.index += 1
+
+    def next_undecided(self, start: int | None = None) -> int | None:
+        """Find the first cluster in the queue with an undecided record.
+
+        Clusters before the last answer are known to be done, so moving
+        forward through a file costs O(1) per cluster overall.
+
+        Parameters
+        ----------
+        start : int, optional
+            The queue position to search from; defaults to the current one.
+
+        Returns
+        -------
+        int or None
+            The queue position, or None if every cluster from start on is
+            done.
+        """
+        start = self.index if start is None else start
+        position = max(start, self._done_before)
+        while position < self.queue_length and self.is_cluster_done(
+            self.queue[position]
+        ):
+            position += 1
+        if start <= self._done_before:
+            self._done_before = position
+        return position if position < self.queue_length else None
+
+    def first_undecided(self) -> int | None:
+        """Find the first queue position with an undecided record."""
+        return self.next_undecided(0)
+
+    # ------------------------------------------------------------------
+    # Output.
+
+    def take_changes(self) -> np.ndarray:
+        """Get the rows whose decisions changed since this was last called.
+
+        Returns
+        -------
+        np.ndarray
+            The row positions, in order.
+        """
+        rows = np.flatnonzero(self.changed)
+        self.changed[rows] = False
+        return rows
+
+    @property
+    def decision_columns(self) -> list:
+        """The columns to_frame() writes decisions to."""
+        columns = [self.format.match_col]
+        if self.comment is not None:
+            columns.append(self.format.comment_col)
+        if self.provenance is not None:
+            columns.append(self.format.provenance_col)
+        return columns
+
+    def snapshot(
+        self, columns: Sequence = (), rows: Sequence | None = None
+    ) -> pd.DataFrame:
+        """Copy the record ids and decisions, e.g. to save them elsewhere.
+
+        Unlike to_frame(), the copy is not changed by later decisions.
+
+        Parameters
+        ----------
+        columns : Sequence, optional
+            Other columns of the data to copy.
+        rows : Sequence, optional
+            The row positions to copy, e.g. from take_changes; defaults to
+            every row.
+
+        Returns
+        -------
+        pd.DataFrame
+            The record id column (if any), columns and the decision
+            columns, a row per row copied.
+        """
+        rows = slice(None) if rows is None else np.asarray(rows, dtype=np.int64)
+        copied = {}
+        for column in [self.record_id, *columns]:
+            if column is not None:
+                # only the rows copied, not the whole column, are converted.
+                copied[column] = self.data[column].iloc[rows].to_numpy(copy=True)
+        copied[self.format.match_col] = self.match[rows].copy()
+        if self.comment is not None:
+            copied[self.format.comment_col] = self.comment[rows].copy()
+        if self.provenance is not None:
+            copied[self.format.provenance_col] = self.provenance[rows].copy()
+        return pd.DataFrame(copied)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Write the decisions back into the data and return it.
+
+        Returns
+        -------
+        pd.DataFrame
+            The clerical file with its match (and comment) columns.
+        """
+        self.data[self.format.match_col] = self.match
+        if self.comment is not None:
+            self.data[self.format.comment_col] = self.comment
+        if self.provenance is not None:
+            self.data[self.format.provenance_col] = self.provenance
+        return self.data
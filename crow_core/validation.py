@@ -0,0 +1,87 @@
+"""Check clerical files before they are reviewed.
+
+The front-ends check a file when a matcher opens it; a coordinator can
+check a whole folder of files beforehand (see coordinator/prepare_files.py)
+with the same checks, so a bad file is found before it is handed out.
+"""
+
+import os
+from collections.abc import Sequence
+
+import pandas as pd
+
+# The most duplicate record ids listed in a problem.
+MAX_LISTED = 10
+
+
+def check_clerical_file(
+    data: pd.DataFrame,
+    record_id: str,
+    cluster_id: str | None,
+    columns: Sequence = (),
+) -> list:
+    """Find the problems that would stop a clerical file being reviewed.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The clerical file, or the columns of it the review uses.
+    record_id : str
+        The record id column, which must be unique.
+    cluster_id : str or None
+        The cluster id column; None for pairwise files.
+    columns : Sequence, optional
+        Other columns the file must have, e.g. the display columns.
+
+    Returns
+    -------
+    list
+        A description of each problem found; empty if there are none.
+    """
+    problems = []
+    ids = [column for column in (record_id, cluster_id) if column is not None]
+    missing = [column for column in [*ids, *columns] if column not in data.columns]
+    if missing:
+        problems.append(f"no columns {list(dict.fromkeys(missing))}")
+    for column in ids:
+        if column not in data.columns:
+            continue
+        blank = data[column].isna()
+        if pd.api.types.is_string_dtype(data[column].dtype):
+            blank |= data[column] == ""
+        if blank.any():
+            problems.append(f"{blank.sum()} records have no {column}")
+    if record_id in data.columns:
+        record_ids = data[record_id].dropna()
+        duplicated = record_ids.duplicated()
+        if duplicated.any():
+            duplicates = record_ids[duplicated].unique()
+            listed = ", ".join(str(value) for value in duplicates[:MAX_LISTED])
+            more = len(duplicates) - MAX_LISTED
+            problems.append(
+                f"{len(duplicates)} {record_id} values are not unique: {listed}"
+                + (f" and {more} more" if more > 0 else "")
+            )
+    return problems
+
+
+def file_size(path: str | os.PathLike) -> int:
+    """Get the size of a file, or of every file in a folder, in bytes.
+
+    Parameters
+    ----------
+    path : str or os.PathLike
+        A file, or a folder of parquet files.
+
+    Returns
+    -------
+    int
+        The size in bytes.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(folder, name))
+        for folder, _, names in os.walk(path)
+        for name in names
+    )
@@ -0,0 +1,40 @@
+"""Tests of comparing reviews of one clerical file (coordinator/agreement.py)."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "coordinator"))
+from agreement import check_output, write_disagreements  # noqa: E402
+
+
+def test_disagreements_without_extension_written_as_parquet(tmp_path):
+    """A --disagreements path with no extension is written as parquet."""
+    review = tmp_path / "sample_alice_done.parquet"
+    pd.DataFrame(
+        {
+            "record_id": ["1", "2", "3", "4"],
+            "cluster_id": ["a", "a", "b", "b"],
+            "Match": ["['1', '2']", "['1', '2']", "[]", "[]"],
+        }
+    ).to_parquet(review)
+    clusters = pd.DataFrame(
+        {"cluster_id": ["a", "b"], "pairs": [1, 1], "agreed": [1, 0]}
+    )
+    output = tmp_path / "sample_recheck"
+    assert check_output(str(output)) is None
+
+    rows = write_disagreements(str(review), str(output), clusters, "cluster_id")
+
+    assert rows == 2
+    written = pq.read_table(output).to_pandas()
+    assert written["record_id"].tolist() == ["3", "4"]
+    assert "Match" not in written.columns
+
+
+def test_disagreements_path_checked():
+    """A path that cannot be written is rejected before the reviews are read."""
+    assert check_output("sample_recheck.txt") is not None
+    assert check_output("no/such/folder/sample_recheck") is not None
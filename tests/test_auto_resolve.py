@@ -0,0 +1,39 @@
+"""Tests of deciding clusters without review (crow_core.auto_resolve)."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import CROW1_CLUSTER_FORMAT, ReviewSession, auto_resolve  # noqa: E402
+
+
+def make_review():
+    data = pd.DataFrame(
+        {
+            "record_id": ["1", "2", "3", "4"],
+            "cluster_id": ["a", "a", "b", "b"],
+            "name": ["ann", "bob", "cy", "cy"],
+            "dob": ["1990", "1991", "1980", "1980"],
+            "Match": ["", "", "", ""],
+        }
+    )
+    return ReviewSession(data, "record_id", "cluster_id", CROW1_CLUSTER_FORMAT)
+
+
+def test_all_but_one_needs_two_columns():
+    """With one column compared, all_but_one would match every cluster."""
+    review = make_review()
+    with pytest.raises(ValueError, match="all_but_one"):
+        auto_resolve(review, columns=["name"], rules=["all_but_one"])
+    with pytest.raises(ValueError, match="all_but_one"):
+        auto_resolve(review, column_pairs=[("name", "dob")], rules=["all_but_one"])
+    assert review.num_decided == 0
+
+
+def test_all_but_one_allows_one_disagreement():
+    review = make_review()
+    counts = auto_resolve(review, columns=["name", "dob"], rules=["all_but_one"])
+    assert counts == {"all_but_one": 1}
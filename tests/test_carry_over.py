@@ -0,0 +1,45 @@
+"""Tests of carrying decisions over between rounds (coordinator/carry_over.py)."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "coordinator"))
+from carry_over import build_index, carry_over_file  # noqa: E402
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import read_file  # noqa: E402
+
+
+def test_partitioned_folder_carried_in_place_keeps_partitions(tmp_path):
+    """--in-place joins the decisions onto each part file, not one file."""
+    records = {
+        "N": {"record_id": ["1", "2"], "cluster_id": ["a", "a"], "name": ["x", "x"]},
+        "S": {"record_id": ["3", "4"], "cluster_id": ["b", "b"], "name": ["y", "z"]},
+    }
+    earlier = tmp_path / "round1"
+    earlier.mkdir()
+    done = pd.concat([pd.DataFrame(table) for table in records.values()])
+    done["Match"] = ["['1', '2']", "['1', '2']", "[]", "[]"]
+    done.to_parquet(earlier / "proj_ann_done")
+    folder = tmp_path / "round2"
+    project = folder / "proj"
+    for region, table in records.items():
+        (project / f"region={region}").mkdir(parents=True)
+        table = dict(table, name=["x", "x"] if region == "N" else ["y", "q"])
+        pd.DataFrame(table).to_parquet(project / f"region={region}" / "part-0.parquet")
+
+    index = build_index([str(earlier)], "record_id", "cluster_id", ["name"])
+    result = carry_over_file(
+        str(project), index, "record_id", "cluster_id", ["name"], str(folder)
+    )
+
+    assert (result["carried"], result["changed"]) == (1, 1)
+    assert sorted(path.name for path in project.iterdir()) == ["region=N", "region=S"]
+    part = pd.read_parquet(project / "region=N" / "part-0.parquet")
+    assert "region" not in part.columns
+    data = read_file(project, file_format="parquet").sort_values("record_id")
+    assert data["region"].astype(str).tolist() == ["N", "N", "S", "S"]
+    assert data["Carry_Over"].tolist() == ["carried", "carried", "changed", "changed"]
+    assert data["Decision_Source"].tolist() == ["carried", "carried", "", ""]
@@ -0,0 +1,34 @@
+"""Tests of reading and saving clerical files (crow_core.files)."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import CROW1_CLUSTER_FORMAT, ReviewSession, read_file, write_file  # noqa: E402
+
+
+def test_csv_leading_zero_ids_save(tmp_path):
+    """A CSV read and saved keeps record ids such as 007 as they are."""
+    path = tmp_path / "sample.csv"
+    path.write_text(
+        "record_id,cluster_id,name,Match\n007,01,ann,\n008,01,anne,\n010,02,bob,\n"
+    )
+    data = read_file(path, columns=["record_id", "cluster_id", "Match"])
+    assert data["record_id"].tolist() == ["007", "008", "010"]
+
+    review = ReviewSession(data, "record_id", "cluster_id", CROW1_CLUSTER_FORMAT)
+    review.match_records(["007", "008"])
+    write_file(
+        review.snapshot(),
+        path,
+        source=path,
+        key="record_id",
+        columns=review.decision_columns,
+    )
+
+    saved = pd.read_csv(path, dtype=str, keep_default_na=False)
+    assert saved["record_id"].tolist() == ["007", "008", "010"]
+    assert saved["name"].tolist() == ["ann", "anne", "bob"]
+    assert saved["Match"].tolist() == ["007,008,", "007,008,", ""]
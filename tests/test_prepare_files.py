@@ -0,0 +1,41 @@
+"""Tests of checking and preparing clerical files (coordinator/prepare_files.py)."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "coordinator"))
+from prepare_files import check_file  # noqa: E402
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import read_file  # noqa: E402
+
+
+def test_partitioned_folder_prepared_in_place_keeps_partitions(tmp_path):
+    """--in-place joins the columns onto each part file, not one file."""
+    project = tmp_path / "proj"
+    for region, ids in (("N", ["1", "2"]), ("S", ["3", "4"])):
+        (project / f"region={region}").mkdir(parents=True)
+        pd.DataFrame(
+            {"record_id": ids, "cluster_id": ["b", "a"], "name": ["ann", "bob"]}
+        ).to_parquet(project / f"region={region}" / "part-0.parquet")
+
+    result = check_file(
+        str(project), "record_id", "cluster_id", ["name"], output=str(tmp_path)
+    )
+
+    assert result["status"] == "prepared"
+    assert project.is_dir()
+    assert sorted(path.name for path in project.iterdir()) == ["region=N", "region=S"]
+    part = pd.read_parquet(project / "region=N" / "part-0.parquet")
+    assert "region" not in part.columns
+    assert {"Match", "Comment", "Sequential_Cluster_Id"} <= set(part.columns)
+    data = read_file(project, file_format="parquet").sort_values("record_id")
+    assert data["region"].astype(str).tolist() == ["N", "N", "S", "S"]
+    assert data["Sequential_Record_Id"].notna().all()
+
+    again = check_file(
+        str(project), "record_id", "cluster_id", ["name"], output=str(tmp_path)
+    )
+    assert again["status"] == "ready"
@@ -0,0 +1,38 @@
+"""Tests of recording and reading review progress (crow_core.progress)."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from crow_core import (  # noqa: E402
+    project_progress,
+    progress_metadata,
+    summarise_progress,
+    write_file,
+)
+from crow_core.review_session import Progress  # noqa: E402
+
+
+def test_clusters_summed_over_files_that_recorded_them(tmp_path):
+    """Files not yet saved leave the clusters out, not count them as 0 of 0."""
+    data = pd.DataFrame({"record_id": ["1", "2", "3"], "cluster_id": ["a", "a", "b"]})
+    data.to_parquet(tmp_path / "sample1")
+    data.to_parquet(tmp_path / "sample2_bob_done")
+    summary = summarise_progress(project_progress(tmp_path))
+    assert summary["decided_records"] == 3
+    assert summary["total_records"] == 6
+    assert summary["clusters_known"] == 0
+
+    write_file(
+        data,
+        tmp_path / "sample3_ann_inprogress",
+        file_format="parquet",
+        metadata=progress_metadata(Progress(2, 3, 1, 2), "ann"),
+    )
+    summary = summarise_progress(project_progress(tmp_path))
+    assert summary["decided_records"] == 5
+    assert summary["total_records"] == 9
+    assert summary["clusters_known"] == 1
+    assert (summary["done_clusters"], summary["total_clusters"]) == (1, 2)